@@ -1,14 +1,19 @@
 import logging
+from typing import AsyncGenerator
+from contextlib import asynccontextmanager
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import status, WebSocketException
+from fastapi import status, WebSocketException, HTTPException
 from fastapi import Depends
-from jose import jwt, JWTError
 from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, InterfaceError
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.db.base import get_async_session
-from app.db.models import User
+from app.db.routing import replica_router
+from app.db.models import User, UserChat
 from app.exceptions import UnauthorizedException
-from app.core import settings
+from app.core.security import decode_access_token
+from app.core.revocation import revocation_list
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
@@ -20,16 +25,15 @@ async def get_current_user(
     """
     Get current user from token"
     """
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        email = payload.get("sub")
-        if email is None:
-            raise UnauthorizedException(detail="Invalid credentials")
-    except JWTError:
+    payload = decode_access_token(token)
+    if payload is None:
         logging.error("JWTError: Invalid token")
         raise UnauthorizedException
+    if revocation_list.is_revoked(payload.get("fam")):
+        raise UnauthorizedException(detail="Token revoked")
+    email = payload.get("sub")
+    if email is None:
+        raise UnauthorizedException(detail="Invalid credentials")
     stmt = select(User).where(User.email == email)
     result = await session.execute(stmt)
     user = result.scalars().first()
@@ -47,19 +51,16 @@ async def get_current_user_from_token(token: str, session: AsyncSession) -> User
         code=status.WS_1008_POLICY_VIOLATION,
         reason="Invalid authentication credentials",
     )
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+    payload = decode_access_token(token)
+    if payload is None or revocation_list.is_revoked(payload.get("fam")):
+        logging.error("JWTError decoding WebSocket token")
+        raise credentials_exception
+    email = payload.get("sub")
+    if not email:
+        logging.error(
+            "JWTError: 'sub' (email) missing in WebSocket token payload."
         )
-        email = payload.get("sub")
-        if not email:
-            logging.error(
-                "JWTError: 'sub' (email) missing in WebSocket token payload."
-            )
-            raise credentials_exception
-    except JWTError as e:
-        logging.error(f"JWTError decoding WebSocket token: {e}")
-        raise credentials_exception from e 
+        raise credentials_exception
     stmt = select(User).where(User.email == email)
     result = await session.execute(stmt)
     user = result.scalars().first()
@@ -67,3 +68,84 @@ async def get_current_user_from_token(token: str, session: AsyncSession) -> User
         logging.warning(f"WebSocket Auth: User not found for email from token: {email}")
         raise credentials_exception
     return user
+
+
+def is_admin(user: User) -> bool:
+    return user.email in settings.ADMIN_EMAILS
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """
+    Current user if listed in ADMIN_EMAILS, 403 otherwise.
+    """
+    if not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admins only"
+        )
+    return current_user
+
+
+async def ensure_chat_member(session: AsyncSession, chat_id: int, user_id: int):
+    """
+    Raise 403 unless the user is a member of the chat.
+    """
+    stmt = select(UserChat.id).where(
+        UserChat.chat_id == chat_id, UserChat.user_id == user_id
+    )
+    result = await session.execute(stmt)
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a member of this chat",
+        )
+
+
+@asynccontextmanager
+async def _read_session(user_id: int, chat_id: int | None = None, chat_ids=()):
+    engine = replica_router.pick(user_id, chat_id, chat_ids)
+    async with replica_router.session(engine) as session:
+        try:
+            yield session
+        except (OperationalError, InterfaceError) as e:
+            logging.error(f"Read session failed: {e}")
+            replica_router.mark_unhealthy(engine)
+            raise
+
+
+async def get_chat_list_session(
+    current_user: User = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Read-only session for the chat list of the current user.
+    """
+    async with _read_session(current_user.id) as session:
+        yield session
+
+
+async def get_chat_history_session(
+    chat_id: int,
+    current_user: User = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Read-only session for the message history of a chat.
+    """
+    async with _read_session(current_user.id, chat_id) as session:
+        yield session
+
+
+def chats_read_session(user_id: int, chat_ids: list[int]):
+    """
+    Read-only session for the messages of several chats, opened by the
+    caller, e.g. inside a streamed response.
+    """
+    return _read_session(user_id, chat_ids=chat_ids)
+
+
+async def get_user_directory_session(
+    current_user: User = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Read-only session for user lookups.
+    """
+    async with _read_session(current_user.id) as session:
+        yield session
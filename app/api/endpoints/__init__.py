@@ -1,3 +1,7 @@
 from .auth import auth_router
 from .chat import chat_router
-from .messages import message_router
\ No newline at end of file
+from .messages import message_router
+from .health import health_router
+from .attachments import attachment_router
+from .debug import debug_router
+from .users import user_router
\ No newline at end of file
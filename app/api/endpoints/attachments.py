@@ -0,0 +1,297 @@
+import logging
+import uuid
+from urllib.parse import quote
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import FileResponse
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core import settings
+from app.core.attachments import attachment_storage, UploadInterrupted, UploadTooLarge
+from app.db.base import AsyncLocalSession, get_async_session
+from app.db.models import Attachment, AttachmentUpload, User
+from app.db.models.message import current_timestamp
+from app.api.deps import get_current_user, ensure_chat_member
+from app.schemas import AttachmentUploadCreate, AttachmentUploadRead, AttachmentRead
+
+attachment_router = APIRouter(prefix="/attachments", tags=["Attachment"])
+
+
+async def get_own_upload(
+    upload_id: uuid.UUID, current_user: User, session: AsyncSession
+) -> AttachmentUpload:
+    upload = await session.get(AttachmentUpload, upload_id)
+    if not upload or upload.uploader_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found"
+        )
+    return upload
+
+
+@attachment_router.post(
+    "/uploads",
+    response_model=AttachmentUploadRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="Start an upload",
+    description="Start a resumable upload of an attachment to a chat.",
+    responses={
+        status.HTTP_201_CREATED: {
+            "description": "Upload started",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "id": "3f0c1c1e-5a3b-4d55-9a57-0f5c3b8e2d11",
+                        "chat_id": 1,
+                        "size": 1048576,
+                        "received": 0,
+                        "attachment": None,
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not a member of this chat",
+        },
+        status.HTTP_413_CONTENT_TOO_LARGE: {
+            "description": "File is larger than the allowed maximum",
+        },
+    },
+)
+async def create_upload(
+    upload_in: AttachmentUploadCreate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Start an upload.
+    """
+    await ensure_chat_member(session, upload_in.chat_id, current_user.id)
+    if upload_in.size > settings.ATTACHMENT_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"Attachments are limited to {settings.ATTACHMENT_MAX_SIZE} bytes",
+        )
+    upload = AttachmentUpload(
+        id=uuid.uuid4(),
+        uploader_id=current_user.id,
+        received=0,
+        **upload_in.model_dump(),
+    )
+    await attachment_storage.create(upload.id)
+    session.add(upload)
+    await session.commit()
+    return upload
+
+
+@attachment_router.get(
+    "/uploads/{upload_id}",
+    response_model=AttachmentUploadRead,
+    status_code=status.HTTP_200_OK,
+    summary="Get upload state",
+    description="Get the offset to resume an interrupted upload from.",
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Upload not found",
+        },
+    },
+)
+async def get_upload(
+    upload_id: uuid.UUID,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get upload state.
+    """
+    return await get_own_upload(upload_id, current_user, session)
+
+
+@attachment_router.patch(
+    "/uploads/{upload_id}",
+    response_model=AttachmentUploadRead,
+    status_code=status.HTTP_200_OK,
+    summary="Upload a chunk",
+    description=(
+        "Append the raw request body to the upload at the offset given in the "
+        "Upload-Offset header. The attachment is stored once all bytes are received."
+    ),
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Upload not found",
+        },
+        status.HTTP_409_CONFLICT: {
+            "description": "Upload-Offset does not match the received bytes",
+        },
+        status.HTTP_413_CONTENT_TOO_LARGE: {
+            "description": "Body goes past the declared size",
+        },
+    },
+)
+async def upload_chunk(
+    upload_id: uuid.UUID,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Upload a chunk.
+
+    The upload row is claimed before the part file is touched, so one
+    request at a time writes to it across every worker. The request session
+    is committed before the body is streamed, and the result is recorded
+    through a short session of its own.
+    """
+    upload = await get_own_upload(upload_id, current_user, session)
+    if upload_offset != upload.received:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload-Offset must be {upload.received}",
+        )
+    claim = uuid.uuid4()
+    now = current_timestamp()
+    claimed_until = now + settings.ATTACHMENT_CHUNK_SECONDS
+    result = await session.execute(
+        update(AttachmentUpload)
+        .where(
+            AttachmentUpload.id == upload.id,
+            AttachmentUpload.received == upload_offset,
+            or_(
+                AttachmentUpload.claim.is_(None),
+                AttachmentUpload.claimed_until <= now,
+            ),
+        )
+        .values(claim=claim, claimed_until=claimed_until)
+    )
+    if result.rowcount != 1:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another chunk of this upload is in progress",
+        )
+    # no transaction stays open while the client sends the body
+    await session.commit()
+    try:
+        received = await attachment_storage.append(
+            upload.id, upload_offset, upload.size, request.stream(), claimed_until
+        )
+    except UploadInterrupted as e:
+        received = e.received
+        too_large = isinstance(e.__cause__, UploadTooLarge)
+        if not too_large:
+            logging.info(f"Upload {upload.id} interrupted at {received} bytes")
+    else:
+        too_large = False
+    async with AsyncLocalSession() as write_session:
+        # fails only if the claim expired and another request took over
+        result = await write_session.execute(
+            update(AttachmentUpload)
+            .where(AttachmentUpload.id == upload.id, AttachmentUpload.claim == claim)
+            .values(received=received, claim=None)
+        )
+        if result.rowcount != 1:
+            await write_session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload was modified concurrently",
+            )
+        upload.received = received
+        if too_large:
+            await write_session.commit()
+            raise HTTPException(
+                status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                detail=f"Body goes past the declared size of {upload.size} bytes",
+            )
+        response = AttachmentUploadRead.model_validate(upload)
+        if received == upload.size:
+            sha256 = await attachment_storage.digest(upload.id, received)
+            attachment = Attachment(
+                chat_id=upload.chat_id,
+                uploader_id=upload.uploader_id,
+                filename=upload.filename,
+                content_type=upload.content_type,
+                size=upload.size,
+                sha256=sha256,
+            )
+            write_session.add(attachment)
+            await write_session.flush()
+            # the references locked here keep the stored file until this
+            # commits; references a cleanup deleted are waited for and
+            # skipped, the file may be gone then and the copy is stored
+            shared_stmt = (
+                select(Attachment.id)
+                .where(Attachment.sha256 == sha256, Attachment.id != attachment.id)
+                .limit(1)
+                .with_for_update(read=True)
+            )
+            shared = (await write_session.execute(shared_stmt)).first() is not None
+            await attachment_storage.complete(upload.id, sha256, shared)
+            await write_session.execute(
+                delete(AttachmentUpload).where(AttachmentUpload.id == upload.id)
+            )
+            await write_session.commit()
+            response.attachment = AttachmentRead.model_validate(attachment)
+        else:
+            await write_session.commit()
+    return response
+
+
+@attachment_router.get(
+    "/{attachment_id}",
+    status_code=status.HTTP_200_OK,
+    summary="Download an attachment",
+    description="Download an attachment. Supports Range requests.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "File content",
+        },
+        status.HTTP_206_PARTIAL_CONTENT: {
+            "description": "Requested byte range of the file",
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not a member of this chat",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Attachment not found",
+        },
+    },
+)
+async def download_attachment(
+    attachment_id: int,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Download an attachment.
+    """
+    attachment = await session.get(Attachment, attachment_id)
+    if not attachment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found"
+        )
+    await ensure_chat_member(session, attachment.chat_id, current_user.id)
+    path = attachment_storage.object_path(attachment.sha256)
+    if settings.ATTACHMENTS_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the file with sendfile and handles Range itself
+        relative = path.relative_to(attachment_storage.root).as_posix()
+        return Response(
+            headers={
+                "X-Accel-Redirect": settings.ATTACHMENTS_ACCEL_REDIRECT_PREFIX + relative,
+                "Content-Type": attachment.content_type,
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(attachment.filename)}",
+            }
+        )
+    # FileResponse answers Range requests and hands the file to the server
+    # through the pathsend extension (sendfile) when the server supports it
+    return FileResponse(
+        path,
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+    )
@@ -1,16 +1,43 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.models import User
+from app.db.models import User, TokenFamily
 from app.api.deps import get_async_session
-from app.schemas import UserCreate, UserRead, Token
-from app.core.security import hash_password, verify_password, create_access_token
+from app.schemas import UserCreate, UserRead, Token, TokenRefresh
+from app.core.security import (
+    hash_password,
+    verify_password,
+    create_access_token,
+    create_refresh_token,
+    decode_refresh_token,
+)
+from app.core.revocation import revocation_list
 from app.exceptions import UnauthorizedException
 
 auth_router = APIRouter(tags=["Auth"])
 
 
+def issue_tokens(user_id: int, email: str, family: str | None = None) -> tuple[dict, dict]:
+    """
+    Token response with a new access and refresh token, and the claims of
+    the refresh token. Access tokens carry the family so revoking it cuts
+    them off too.
+    """
+    refresh_token, claims = create_refresh_token(
+        data={"sub": email, "uid": user_id}, family=family
+    )
+    access_token = create_access_token(
+        data={"sub": email, "uid": user_id, "fam": claims["fam"]}
+    )
+    tokens = {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+    return tokens, claims
+
+
 @auth_router.post(
     "/register/",
     response_model=UserRead,
@@ -60,7 +87,10 @@ async def register_user(
     "/token/",
     response_model=Token,
     summary="Generate access token",
-    description="Generate an access token using email and password.",
+    description=(
+        "Generate an access token using email and password, with a refresh "
+        "token to renew it at /token/refresh without the password."
+    ),
     responses={
         status.HTTP_200_OK: {
             "description": "Access token generated successfully",
@@ -69,6 +99,7 @@ async def register_user(
                     "example": {
                         "access_token": "string",
                         "token_type": "bearer",
+                        "refresh_token": "string",
                     }
                 }
             },
@@ -87,5 +118,102 @@ async def login(
     user = result.scalars().first()
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise UnauthorizedException(detail="Invalid credentials")
-    access_token = create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
+    tokens, claims = issue_tokens(user.id, user.email)
+    session.add(
+        TokenFamily(
+            id=claims["fam"],
+            user_id=user.id,
+            current_jti=claims["jti"],
+            expires_at=claims["exp"],
+        )
+    )
+    await session.commit()
+    return tokens
+
+
+@auth_router.post(
+    "/token/refresh",
+    response_model=Token,
+    summary="Refresh access token",
+    description=(
+        "Exchange a refresh token for a new access and refresh token. Each "
+        "refresh token is valid once: presenting a used one revokes every "
+        "token issued from the same login."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Tokens refreshed successfully",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "access_token": "string",
+                        "token_type": "bearer",
+                        "refresh_token": "string",
+                    }
+                }
+            },
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Invalid, expired, used or revoked refresh token",
+        },
+    },
+)
+async def refresh(
+    token_in: TokenRefresh,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Rotate a refresh token.
+    """
+    payload = decode_refresh_token(token_in.refresh_token)
+    if payload is None or revocation_list.is_revoked(payload["fam"]):
+        raise UnauthorizedException(detail="Invalid refresh token")
+    tokens, claims = issue_tokens(payload["uid"], payload["sub"], payload["fam"])
+    # compare and set, only one of concurrent refreshes with a token wins
+    stmt = (
+        update(TokenFamily)
+        .where(
+            TokenFamily.id == payload["fam"],
+            TokenFamily.current_jti == payload["jti"],
+        )
+        .values(current_jti=claims["jti"], expires_at=claims["exp"])
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    await session.commit()
+    if result.rowcount != 1:
+        # the token was rotated already, it may have been stolen
+        await revocation_list.revoke(payload["fam"])
+        raise UnauthorizedException(detail="Invalid refresh token")
+    return tokens
+
+
+@auth_router.post(
+    "/token/revoke",
+    status_code=status.HTTP_200_OK,
+    summary="Revoke tokens",
+    description=(
+        "Log out: revoke a refresh token and every token issued from the "
+        "same login, access tokens included."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Tokens revoked",
+            "content": {
+                "application/json": {"example": {"detail": "Tokens revoked"}}
+            },
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Invalid or expired refresh token",
+        },
+    },
+)
+async def revoke(token_in: TokenRefresh):
+    """
+    Revoke a token family.
+    """
+    payload = decode_refresh_token(token_in.refresh_token)
+    if payload is None:
+        raise UnauthorizedException(detail="Invalid refresh token")
+    await revocation_list.revoke(payload["fam"])
+    return {"detail": "Tokens revoked"}
@@ -2,6 +2,7 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     status,
 )
 from sqlalchemy import select
@@ -9,8 +10,17 @@ from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.base import get_async_session
 from app.db.models import Chat, UserChat, User
-from app.api.deps import get_current_user
-from app.schemas import ChatRead, ChatCreate
+from app.api.deps import get_current_user, get_chat_list_session, ensure_chat_member, is_admin
+from app.db.routing import replica_router
+from app.core.websocket import ws_manager
+from app.core.versions import version_tracker, etag_matches, not_modified, etag_headers
+from app.core.serialization import (
+    CHAT_COLUMNS,
+    chat_rows_adapter,
+    rows_to_dicts,
+    json_response,
+)
+from app.schemas import ChatRead, ChatCreate, ChatRetentionUpdate, ChatRetentionRead
 
 chat_router = APIRouter(prefix="/chats", tags=["Chat"])
 
@@ -43,22 +53,40 @@ chat_router = APIRouter(prefix="/chats", tags=["Chat"])
                 }
             },
         },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "Chat list unchanged since the ETag in If-None-Match"
+        },
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Unauthorized (e.g., invalid token)"
         },
     },
 )
 async def get_chats(
+    request: Request,
     current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_chat_list_session),
 ):
     """
     Get all chats for the current user.
     """
-    stmt = select(Chat).join(UserChat).where(UserChat.user_id == current_user.id)
+    # read before the list and from the database serving it, a lagging
+    # replica then only makes the tag older than the list, never newer
+    if session.bind is replica_router.primary:
+        version = current_user.chats_version
+    else:
+        version = await version_tracker.chats_version(session, current_user.id) or 0
+    etag = version_tracker.user_etag(current_user.id, version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    stmt = (
+        select(*CHAT_COLUMNS)
+        .select_from(Chat)
+        .join(UserChat)
+        .where(UserChat.user_id == current_user.id)
+    )
     result = await session.execute(stmt)
-    chats = result.scalars().all()
-    return [ChatRead.model_validate(chat) for chat in chats]
+    chats = rows_to_dicts(result)
+    return json_response(chat_rows_adapter.dump_json(chats), etag_headers(etag))
 
 
 @chat_router.post(
@@ -139,15 +167,19 @@ async def create_chat(
             )
 
         # create new chat
+        # one transaction, so maintenance never sees the chat without members
         chat = Chat(name=chat_in.name, is_group=False)
         session.add(chat)
-        await session.commit()
-        await session.refresh(chat)
+        await session.flush()
         relation_1 = UserChat(user_id=current_user.id, chat_id=chat.id)
         relation_2 = UserChat(user_id=recipient.id, chat_id=chat.id)
         session.add(relation_1)
         session.add(relation_2)
+        await version_tracker.bump_users(session, current_user.id, recipient.id)
         await session.commit()
+        replica_router.mark_write(user_ids=(current_user.id, recipient.id))
+        ws_manager.join(current_user.id, chat.id)
+        ws_manager.join(recipient.id, chat.id)
         return chat
     elif chat_in.is_group:
         # check for existing group chat with the same name
@@ -166,15 +198,17 @@ async def create_chat(
             )
 
         # create new group chat
-        chat = Chat(name=chat_in.name, is_group=True)
+        chat = Chat(name=chat_in.name, is_group=True, creator_id=current_user.id)
         session.add(chat)
-        await session.commit()
-        await session.refresh(chat)
+        await session.flush()
 
         # add current user to the group chat
         relation = UserChat(user_id=current_user.id, chat_id=chat.id)
         session.add(relation)
+        await version_tracker.bump_users(session, current_user.id)
         await session.commit()
+        replica_router.mark_write(user_ids=(current_user.id,))
+        ws_manager.join(current_user.id, chat.id)
         return chat
     else:
         raise HTTPException(
@@ -269,7 +303,10 @@ async def add_user_to_chat(
     # Add the user to the chat
     relation = UserChat(user_id=user.id, chat_id=chat.id)
     session.add(relation)
+    await version_tracker.bump_users(session, user.id)
     await session.commit()
+    replica_router.mark_write(user_ids=(current_user.id, user.id))
+    ws_manager.join(user.id, chat.id)
     await session.refresh(chat)
     return {"detail": "User added to chat successfully"}
 
@@ -328,6 +365,59 @@ async def exit_chat(
 
     # Remove the user from the chat
     await session.delete(is_member)
+    await version_tracker.bump_users(session, current_user.id)
     await session.commit()
+    replica_router.mark_write(user_ids=(current_user.id,))
+    ws_manager.leave(current_user.id, chat_id)
     await session.refresh(chat)
-    return {"detail": "User removed from chat successfully"}
\ No newline at end of file
+    return {"detail": "User removed from chat successfully"}
+
+
+@chat_router.patch(
+    "/{chat_id}/retention",
+    response_model=ChatRetentionRead,
+    status_code=status.HTTP_200_OK,
+    summary="Set message retention",
+    description="Set how many days messages of a chat are kept, null for the server default.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Retention updated",
+            "content": {
+                "application/json": {
+                    "example": {"id": 1, "retention_days": 30}
+                }
+            },
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Chat not found"
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not a member of this chat, or not the creator of this group"
+        },
+    },
+)
+async def set_chat_retention(
+    chat_id: int,
+    retention_in: ChatRetentionUpdate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Set message retention of a chat. Allowed to the members of a private
+    chat, the creator of a group and admins.
+    """
+    chat = await session.get(Chat, chat_id)
+    if not chat:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found"
+        )
+    if not is_admin(current_user):
+        await ensure_chat_member(session, chat_id, current_user.id)
+        if chat.is_group and chat.creator_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Only the creator of this group can change its retention",
+            )
+    chat.retention_days = retention_in.retention_days
+    await session.commit()
+    return chat
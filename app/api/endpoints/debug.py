@@ -0,0 +1,293 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from app.core import settings
+from app.core.tracing import recent_traces
+from app.core.tasks import task_queue
+from app.core.spool import message_spool
+from app.core.reactions import reaction_aggregator
+from app.core.scheduler import message_scheduler
+from app.db.maintenance import maintenance
+from app.db.models import User
+from app.api.deps import get_admin_user
+
+debug_router = APIRouter(prefix="/debug", tags=["Debug"])
+
+
+@debug_router.get(
+    "/traces",
+    status_code=status.HTTP_200_OK,
+    summary="Recent traces",
+    description=(
+        "Sampled and flagged traces of recent requests and WebSocket commands, "
+        "newest first. Available when TRACING_ENABLED is set."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "List of traces",
+            "content": {
+                "application/json": {
+                    "example": [
+                        {
+                            "name": "POST /chats/{chat_id}/add-user",
+                            "status": 200,
+                            "started_at": 1760000000.0,
+                            "duration_ms": 12.5,
+                            "queries": 6,
+                            "db_ms": 8.1,
+                            "flags": [],
+                            "spans": [],
+                            "slowest": [
+                                {
+                                    "duration_ms": 2.3,
+                                    "statement": "SELECT chats.id FROM chats WHERE chats.id = $1",
+                                }
+                            ],
+                            "repeated": [],
+                            "profile": [],
+                        }
+                    ]
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Tracing is disabled",
+        },
+    },
+)
+async def get_traces(
+    limit: int = Query(50, ge=1, le=500),
+    flagged: bool = Query(False, description="Only traces with flags"),
+    current_user: User = Depends(get_admin_user),
+):
+    """
+    Recent traces.
+    """
+    if not settings.TRACING_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Tracing is disabled"
+        )
+    traces = []
+    for trace in reversed(recent_traces):
+        if flagged and not trace.flags:
+            continue
+        traces.append(trace.to_dict())
+        if len(traces) == limit:
+            break
+    return traces
+
+
+@debug_router.get(
+    "/maintenance",
+    status_code=status.HTTP_200_OK,
+    summary="Maintenance progress",
+    description="Counters of the retention and orphan cleanup jobs of this process.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Maintenance counters",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "runs": 3,
+                        "running_job": None,
+                        "last_started_at": 1760000000.0,
+                        "last_duration_seconds": 4.2,
+                        "last_error": None,
+                        "batches": 120,
+                        "messages_deleted": 118000,
+                        "chats_deleted": 12,
+                        "attachments_deleted": 3,
+                        "tokens_deleted": 40,
+                        "uploads_deleted": 2,
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+    },
+)
+async def get_maintenance(current_user: User = Depends(get_admin_user)):
+    """
+    Maintenance progress.
+    """
+    return maintenance.stats.to_dict()
+
+
+@debug_router.get(
+    "/tasks",
+    status_code=status.HTTP_200_OK,
+    summary="Task queue",
+    description=(
+        "Depth of the post-commit task queue of this process and counters by "
+        "task type. blocked counts enqueues that waited for a full queue."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Task queue counters",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "workers": 4,
+                        "depth": 2,
+                        "tasks": {
+                            "message.fanout": {
+                                "enqueued": 1200,
+                                "completed": 1198,
+                                "failed": 0,
+                                "blocked": 0,
+                                "run_seconds": 0.35,
+                                "max_wait_seconds": 0.004,
+                                "pending": 2,
+                            }
+                        },
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+    },
+)
+async def get_tasks(current_user: User = Depends(get_admin_user)):
+    """
+    Task queue counters.
+    """
+    return task_queue.to_dict()
+
+
+@debug_router.get(
+    "/spool",
+    status_code=status.HTTP_200_OK,
+    summary="Message spool",
+    description=(
+        "State of the local message spool of this process: messages waiting "
+        "for the database and counters. Available when MESSAGE_SPOOL_PATH is set."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Spool counters",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "pending": 0,
+                        "size_bytes": 0,
+                        "spooled": 1520,
+                        "recovered": 0,
+                        "stored": 1520,
+                        "dropped": 0,
+                        "fsyncs": 310,
+                        "last_error": "connection refused",
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "The spool is disabled",
+        },
+    },
+)
+async def get_spool(current_user: User = Depends(get_admin_user)):
+    """
+    Message spool counters.
+    """
+    if not message_spool.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="The spool is disabled"
+        )
+    return {
+        "pending": len(message_spool.pending),
+        "size_bytes": message_spool.size,
+        **message_spool.stats.to_dict(),
+    }
+
+
+@debug_router.get(
+    "/reactions",
+    status_code=status.HTTP_200_OK,
+    summary="Reaction aggregator",
+    description=(
+        "Reaction changes of this process waiting for the next flush and "
+        "counters. refused counts REACT commands turned away while "
+        "REACTION_PENDING_MAX changes were waiting."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Reaction counters",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "pending": 12,
+                        "accepted": 48000,
+                        "refused": 0,
+                        "written": 47988,
+                        "dropped": 0,
+                        "flushes": 3600,
+                        "notifications": 5200,
+                        "last_error": None,
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+    },
+)
+async def get_reactions(current_user: User = Depends(get_admin_user)):
+    """
+    Reaction aggregator counters.
+    """
+    return {
+        "pending": len(reaction_aggregator.pending),
+        **reaction_aggregator.stats.to_dict(),
+    }
+
+
+@debug_router.get(
+    "/scheduler",
+    status_code=status.HTTP_200_OK,
+    summary="Message scheduler",
+    description=(
+        "Scheduled messages this process holds in memory, the end of the "
+        "loaded window and counters."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Scheduler counters",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "loaded": 42,
+                        "next_send_at": 1760000012,
+                        "loaded_until": 1760000060.0,
+                        "loads": 300,
+                        "sent": 1250,
+                        "retried": 0,
+                        "failed": 0,
+                        "last_error": None,
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not an admin",
+        },
+    },
+)
+async def get_scheduler(current_user: User = Depends(get_admin_user)):
+    """
+    Message scheduler counters.
+    """
+    return {
+        "loaded": len(message_scheduler.heap),
+        "next_send_at": message_scheduler.heap[0][0] if message_scheduler.heap else None,
+        "loaded_until": message_scheduler.loaded_until,
+        **message_scheduler.stats.to_dict(),
+    }
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, HTTPException, status
+from app.db.base import async_engine
+from app.core.warmup import readiness, check_database
+
+health_router = APIRouter(tags=["Health"])
+
+
+@health_router.get(
+    "/healthz",
+    status_code=status.HTTP_200_OK,
+    summary="Liveness probe",
+    description="Report that the process is up and serving requests.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Process is alive",
+            "content": {"application/json": {"example": {"status": "ok"}}},
+        },
+    },
+)
+async def healthz():
+    """
+    Liveness probe. Does not touch the database.
+    """
+    return {"status": "ok"}
+
+
+@health_router.get(
+    "/readyz",
+    status_code=status.HTTP_200_OK,
+    summary="Readiness probe",
+    description="Report whether the connection pool is warmed and the database is reachable.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Ready to receive traffic",
+            "content": {
+                "application/json": {
+                    "example": {"status": "ready", "warmed_connections": 5}
+                }
+            },
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "Warm-up not finished or database unreachable",
+        },
+    },
+)
+async def readyz():
+    """
+    Readiness probe.
+    """
+    if not readiness.warmed:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Warm-up in progress",
+        )
+    if not await check_database(async_engine):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database unreachable",
+        )
+    return {"status": "ready", "warmed_connections": readiness.warmed_connections}
@@ -1,4 +1,9 @@
+import asyncio
+import base64
+import json
 import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
 from fastapi import (
     APIRouter,
     WebSocket,
@@ -7,20 +12,75 @@ from fastapi import (
     Depends,
     status,
     HTTPException,
+    Request,
+    Query,
 )
-from sqlalchemy import select
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete, func, and_, or_, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import ValidationError
-from app.db.base import get_async_session
-from app.db.models import Chat, User, UserChat, Message
-from app.api.deps import get_current_user_from_token, get_current_user
+from app.db.base import AsyncLocalSession, get_async_session
+from app.db.models import Chat, User, UserChat, Message, Attachment, ScheduledMessage
+from app.api.deps import (
+    get_current_user_from_token,
+    get_current_user,
+    get_chat_history_session,
+    get_chat_list_session,
+    chats_read_session,
+)
+from app.db.routing import replica_router
+from app.db.sharding import shard_router
 from app.schemas import (
-    MessageCreate,
     MessageResponse,
+    MessageExpanded,
+    MessageExpand,
+    SpooledMessage,
+    HistoryBatchRequest,
+    ScheduledMessageRead,
+    ScheduledMessageNotification,
     MessageReadNotification,
+    AuthNotification,
+    ErrorNotification,
     WebSocketCommand,
+    SendMessagePayload,
+    ScheduleMessagePayload,
+    ReadMessagePayload,
+    TypingPayload,
+    ReactPayload,
+    AuthPayload,
+)
+from app.exceptions import CommandError
+from app.core.websocket import Connection, ws_manager
+from app.core.security import decode_access_token
+from app.core.revocation import revocation_list
+from app.core.logs import log_event
+from app.core.tasks import task_queue
+from app.core.spool import message_spool, SpoolFullError, DATABASE_UNAVAILABLE
+from app.core.config import settings
+from app.core.profiles import profile_cache
+from app.core.reactions import reaction_aggregator
+from app.core.scheduler import message_scheduler
+from app.core.tracing import traced, span
+from app.core.typing_indicators import typing_tracker
+from app.core.versions import (
+    version_tracker,
+    profile_period,
+    etag_matches,
+    not_modified,
+    etag_headers,
+)
+from app.core.serialization import (
+    MESSAGE_COLUMNS,
+    message_rows_adapter,
+    expanded_message_rows_adapter,
+    history_batch_row_adapter,
+    client_frame_adapter,
+    with_reactions,
+    history_page_stmt,
+    fold_reaction,
+    json_response,
 )
-from app.core.websocket import ws_manager
 
 message_router = APIRouter(tags=["Message"])
 
@@ -30,7 +90,11 @@ message_router = APIRouter(tags=["Message"])
     response_model=list[MessageResponse],
     status_code=status.HTTP_200_OK,
     summary="Get all messages in a chat",
-    description="Retrieve all messages in a chat with pagination support.",
+    description=(
+        "Retrieve all messages in a chat with pagination support, with the "
+        "reaction counts of each message. With expand=sender each message "
+        "also carries the profile of its sender."
+    ),
     responses={
         status.HTTP_200_OK: {
             "description": "List of messages",
@@ -45,11 +109,15 @@ message_router = APIRouter(tags=["Message"])
                             "timestamp": 171234567890,
                             "is_read": False,
                             "client_message_id": "abc123",
+                            "reactions": {"👍": 3},
                         }
                     ]
                 }
             },
         },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "Page unchanged since the ETag in If-None-Match",
+        },
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Not authenticated",
             "content": {
@@ -75,137 +143,836 @@ message_router = APIRouter(tags=["Message"])
     },
 )
 async def get_messages(
+    request: Request,
     chat_id: int,
     limit: int = 100,
     offset: int = 0,
-    session: AsyncSession = Depends(get_async_session),
+    expand: MessageExpand | None = Query(
+        None, description="sender: include the profile of the sender of each message"
+    ),
+    session: AsyncSession = Depends(get_chat_history_session),
     current_user: User = Depends(get_current_user),
 ):
     """
     Get all messages in a chat.
     """
-    chat_user_stmt = select(UserChat).where(
-        UserChat.chat_id == chat_id,
-        UserChat.user_id == current_user.id,
+    # the version comes with the membership check, from the session the
+    # page is read through
+    chat_user_stmt = (
+        select(Chat.version)
+        .join(UserChat, UserChat.chat_id == Chat.id)
+        .where(
+            UserChat.chat_id == chat_id,
+            UserChat.user_id == current_user.id,
+        )
     )
     result = await session.execute(chat_user_stmt)
-    chat_user = result.scalars().first()
-    if not chat_user:
+    version = result.scalar_one_or_none()
+    if version is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are not a member of this chat",
         )
-    message_stmt = (
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.timestamp.asc())
-        .offset(offset)
-        .limit(limit)
+    if expand:
+        # profiles are part of the page, a change of one must change the tag
+        etag = version_tracker.chat_etag(
+            chat_id, version, limit, offset, f"p{profile_period()}"
+        )
+    else:
+        etag = version_tracker.chat_etag(chat_id, version, limit, offset)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    # reaction counts come along in the same query, one row per emoji
+    message_stmt = history_page_stmt(chat_id, limit, offset)
+    messages = []
+    async with shard_router.session_for(chat_id, session) as message_session:
+        result = await message_session.execute(message_stmt)
+        keys = tuple(result.keys())
+        for row in result:
+            fold_reaction(messages, dict(zip(keys, row)))
+    if expand:
+        profiles = await profile_cache.load(
+            (message["sender_id"] for message in messages), session
+        )
+        for message in messages:
+            message["sender"] = profiles.get(message["sender_id"])
+        content = expanded_message_rows_adapter.dump_json(messages)
+    else:
+        content = message_rows_adapter.dump_json(messages)
+    return json_response(content, etag_headers(etag))
+
+
+def encode_history_cursor(timestamp: int, message_id: int) -> str:
+    raw = json.dumps([timestamp, message_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(timestamp, int) or not isinstance(message_id, int):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return timestamp, message_id
+
+
+def history_batch_stmt(
+    chat_ids: list[int], limit: int, cursors: dict[int, tuple[int, int]]
+):
+    """
+    The latest limit messages of each chat, older than the cursor of the
+    chat if any, in one windowed query, joined with their reaction counts.
+    Rows come by chat, oldest first, one per emoji of a message.
+    """
+    condition = Message.chat_id.in_(chat_ids)
+    if cursors:
+        condition = and_(
+            condition,
+            or_(
+                Message.chat_id.not_in(list(cursors)),
+                *(
+                    and_(
+                        Message.chat_id == chat_id,
+                        tuple_(Message.timestamp, Message.id) < tuple_(*cursor),
+                    )
+                    for chat_id, cursor in cursors.items()
+                ),
+            ),
+        )
+    recency = func.row_number().over(
+        partition_by=Message.chat_id,
+        order_by=(Message.timestamp.desc(), Message.id.desc()),
     )
-    result = await session.execute(message_stmt)
-    messages = result.scalars().all()
-    return [MessageResponse.model_validate(message) for message in messages]
+    ranked = select(*MESSAGE_COLUMNS, recency.label("recency")).where(condition).subquery()
+    page = (
+        select(*(ranked.c[column.key] for column in MESSAGE_COLUMNS), ranked.c.recency)
+        .where(ranked.c.recency <= limit)
+        .subquery()
+    )
+    return with_reactions(page).order_by(page.c.chat_id, page.c.recency.desc())
 
 
-@message_router.websocket("/ws/{token}")
-async def websocket_endpoint(
-    websocket: WebSocket, token: str, session: AsyncSession = Depends(get_async_session)
+def history_batch_line(chat_id: int, messages: list[dict], limit: int) -> bytes:
+    next_cursor = None
+    if len(messages) == limit:
+        next_cursor = encode_history_cursor(messages[0]["timestamp"], messages[0]["id"])
+    row = {"chat_id": chat_id, "messages": messages, "next_cursor": next_cursor}
+    return history_batch_row_adapter.dump_json(row) + b"\n"
+
+
+async def stream_history_batch(
+    user_id: int,
+    chat_ids: list[int],
+    limit: int,
+    cursors: dict[int, tuple[int, int]],
+) -> AsyncIterator[bytes]:
+    """
+    One NDJSON line per chat, written as the rows arrive. Runs one query per
+    database holding some of the chats, in sessions of its own since it
+    outlives the request handler.
+    """
+    if not chat_ids:
+        return
+    if shard_router.enabled:
+        shards: dict[int, list[int]] = {}
+        for chat_id in chat_ids:
+            shards.setdefault(shard_router.shard_for(chat_id), []).append(chat_id)
+        groups = [
+            (shard_router.shard_session(shard), shard_chat_ids)
+            for shard, shard_chat_ids in sorted(shards.items())
+        ]
+    else:
+        groups = [(chats_read_session(user_id, chat_ids), chat_ids)]
+    for session_context, group_chat_ids in groups:
+        empty = set(group_chat_ids)
+        async with session_context as session:
+            result = await session.stream(history_batch_stmt(group_chat_ids, limit, cursors))
+            keys = tuple(result.keys())
+            chat_id, messages = None, []
+            async for row in result:
+                message = dict(zip(keys, row))
+                if message["chat_id"] != chat_id:
+                    if messages:
+                        yield history_batch_line(chat_id, messages, limit)
+                    chat_id, messages = message["chat_id"], []
+                    empty.discard(chat_id)
+                fold_reaction(messages, message)
+            if messages:
+                yield history_batch_line(chat_id, messages, limit)
+        for chat_id in sorted(empty):
+            yield history_batch_line(chat_id, [], limit)
+
+
+@message_router.post(
+    "/history/batch",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Get the latest messages of several chats",
+    description=(
+        "Initial sync: the latest limit messages of each listed chat, or of "
+        "every chat of the user when chats is null, in one request. The "
+        "response is streamed as newline-delimited JSON, one HistoryBatchPage "
+        "per chat, chats without messages included. Pass a next_cursor as "
+        "before of its chat to load older messages."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "One line per chat",
+            "content": {
+                "application/x-ndjson": {
+                    "example": {
+                        "chat_id": 1,
+                        "messages": [
+                            {
+                                "chat_id": 1,
+                                "sender_id": 1,
+                                "text": "Hello, world!",
+                                "client_message_id": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+                                "attachment_id": None,
+                                "id": 1,
+                                "timestamp": 171234567890,
+                                "is_read": False,
+                                "reactions": {},
+                            }
+                        ],
+                        "next_cursor": None,
+                    }
+                }
+            },
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid cursor",
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not a member of one of these chats",
+        },
+    },
+)
+async def get_history_batch(
+    batch: HistoryBatchRequest,
+    session: AsyncSession = Depends(get_chat_list_session),
+    current_user: User = Depends(get_current_user),
 ):
     """
-    WebSocket endpoint for real-time chat communication
+    Get the latest messages of several chats.
+    """
+    member_stmt = select(UserChat.chat_id).where(UserChat.user_id == current_user.id)
+    cursors = {}
+    if batch.chats is not None:
+        requested = {chat.chat_id for chat in batch.chats}
+        member_stmt = member_stmt.where(UserChat.chat_id.in_(requested))
+        cursors = {
+            chat.chat_id: decode_history_cursor(chat.before)
+            for chat in batch.chats
+            if chat.before
+        }
+    result = await session.execute(member_stmt)
+    chat_ids = sorted(result.scalars().all())
+    if batch.chats is not None and len(chat_ids) < len(requested):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a member of one of these chats",
+        )
+    return StreamingResponse(
+        stream_history_batch(current_user.id, chat_ids, batch.limit, cursors),
+        media_type="application/x-ndjson",
+    )
+
+# HTTP status of the CommandError codes of schedule_message
+COMMAND_ERROR_STATUS = {
+    "forbidden": status.HTTP_403_FORBIDDEN,
+    "not_found": status.HTTP_404_NOT_FOUND,
+    "duplicate": status.HTTP_409_CONFLICT,
+}
+
+
+@message_router.post(
+    "/scheduled",
+    response_model=ScheduledMessageRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="Schedule a message",
+    description=(
+        "Send a message to a chat at send_at. It is sent like a SEND_MESSAGE "
+        "with the given client_message_id, so it is sent once even if the "
+        "server restarts meanwhile."
+    ),
+    responses={
+        status.HTTP_201_CREATED: {
+            "description": "Scheduled message",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "id": 1,
+                        "chat_id": 1,
+                        "sender_id": 1,
+                        "text": "Happy birthday!",
+                        "client_message_id": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+                        "attachment_id": None,
+                        "send_at": 1760000000,
+                        "created_at": 1759990000,
+                    }
+                }
+            },
+        },
+        status.HTTP_403_FORBIDDEN: {
+            "description": "You are not a member of this chat",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Attachment not found in this chat",
+        },
+        status.HTTP_409_CONFLICT: {
+            "description": "client_message_id already used",
+        },
+    },
+)
+async def create_scheduled_message(
+    payload: ScheduleMessagePayload,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Schedule a message.
     """
-    user_id: int | None = None
-    logging.info(f"WebSocket connection attempt with token: {token}")
     try:
+        return await schedule_message(session, current_user.id, payload)
+    except CommandError as e:
+        raise HTTPException(status_code=COMMAND_ERROR_STATUS[e.code], detail=e.detail)
+
+
+@message_router.get(
+    "/scheduled",
+    response_model=list[ScheduledMessageRead],
+    status_code=status.HTTP_200_OK,
+    summary="List scheduled messages",
+    description="Messages of the current user not sent yet, the next one first.",
+)
+async def get_scheduled_messages(
+    chat_id: int | None = Query(None, description="Only the messages of this chat"),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    List scheduled messages.
+    """
+    stmt = (
+        select(ScheduledMessage)
+        .where(ScheduledMessage.sender_id == current_user.id)
+        .order_by(ScheduledMessage.send_at, ScheduledMessage.id)
+    )
+    if chat_id is not None:
+        stmt = stmt.where(ScheduledMessage.chat_id == chat_id)
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+
+@message_router.delete(
+    "/scheduled/{scheduled_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Cancel a scheduled message",
+    description="Cancel a message of the current user that was not sent yet.",
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Scheduled message not found, or already sent",
+        },
+    },
+)
+async def delete_scheduled_message(
+    scheduled_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Cancel a scheduled message.
+    """
+    result = await session.execute(
+        delete(ScheduledMessage).where(
+            ScheduledMessage.id == scheduled_id,
+            ScheduledMessage.sender_id == current_user.id,
+        )
+    )
+    if not result.rowcount:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Scheduled message not found",
+        )
+    await session.commit()
+
+
+async def authenticate(token: str) -> tuple[int, list[int]]:
+    """
+    Id and chat ids of the user a WebSocket token belongs to.
+    """
+    async with AsyncLocalSession() as session:
         current_user = await get_current_user_from_token(token=token, session=session)
-        user_id = current_user.id
-        await ws_manager.connect(websocket, user_id)
-        logging.info(f"User {user_id} connected to WebSocket")
-        while True:
-            data = await websocket.receive_json()
-            command = data.get("command")
-            payload = data.get("payload")
-            if command == WebSocketCommand.SEND_MESSAGE:
-                try:
-                    message_in = MessageCreate(**payload, sender_id=user_id)
-                except ValidationError as e:
-                    logging.error(f"Validation error: {e}")
-                    raise WebSocketException(
-                        code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
-                        reason="Invalid message format",
-                    )
-                chat_stmt = select(Chat).where(Chat.id == message_in.chat_id)
-                result = await session.execute(chat_stmt)
-                chat = result.scalars().first()
-                if not chat:
-                    raise WebSocketException(
-                        code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
-                        reason="Chat not found",
-                    )
-                chat_users_stmt = select(UserChat).where(
-                    UserChat.chat_id == chat.id,
-                    UserChat.user_id == user_id,
-                )
-                result = await session.execute(chat_users_stmt)
-                chat_user = result.scalar_one_or_none()
-                if not chat_user:
-                    raise WebSocketException(
-                        code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
-                        reason="You are not a member of this chat",
-                    )
-                double_stmt = select(Message).where(
-                    Message.client_message_id == message_in.client_message_id
+        chat_ids_stmt = select(UserChat.chat_id).where(UserChat.user_id == current_user.id)
+        result = await session.execute(chat_ids_stmt)
+        # the user is loaded anyway, spare a query when their messages are expanded
+        profile_cache.put(current_user.id, {"id": current_user.id, "name": current_user.name})
+        return current_user.id, result.scalars().all()
+
+
+# handler of each command, see command_handler
+command_handlers: dict[WebSocketCommand, Callable[[Connection, Any], Awaitable[None]]] = {}
+
+# pydantic error types of frames that are not a known command
+FRAME_ERROR_CODES = {
+    "json_invalid": "invalid_json",
+    "union_tag_invalid": "unknown_command",
+    "union_tag_not_found": "unknown_command",
+}
+
+
+def command_handler(command: WebSocketCommand):
+    """
+    Register the handler of a command. It is called with the connection and
+    the validated payload, and reports failures by raising CommandError.
+    """
+
+    def register(handler):
+        command_handlers[command] = handler
+        return handler
+
+    return register
+
+
+@command_handler(WebSocketCommand.AUTH)
+async def reauthenticate(connection: Connection, payload: AuthPayload):
+    """
+    Extend a connection with a fresh access token of the same user. Only
+    the signature and the revocation list are checked, no database.
+    """
+    claims = decode_access_token(payload.token)
+    if (
+        claims is None
+        or claims.get("uid") != connection.user_id
+        or revocation_list.is_revoked(claims.get("fam"))
+    ):
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason="Invalid authentication credentials",
+        )
+    connection.expires_at = claims["exp"]
+    connection.family = claims.get("fam")
+    ws_manager.send(
+        connection, AuthNotification(expires_at=claims["exp"]).model_dump_json()
+    )
+
+
+async def deliver_message(message: MessageResponse):
+    """
+    Fan a committed message out to the chat, run from the task queue.
+    """
+    expanded = None
+    if ws_manager.wants_expanded(message.chat_id):
+        profiles = await profile_cache.load((message.sender_id,))
+        expanded = MessageExpanded(
+            **message.model_dump(), sender=profiles.get(message.sender_id)
+        ).model_dump_json()
+    await ws_manager.send_to_chat(
+        message.model_dump_json(), message.chat_id, expanded=expanded
+    )
+    log_event(
+        "message.sent",
+        user_id=message.sender_id,
+        chat_id=message.chat_id,
+        message_id=message.id,
+    )
+
+
+async def deliver_spooled_message(message: SpooledMessage):
+    """
+    Fan a spooled message out to the chat, run from the task queue.
+    """
+    expanded = None
+    if ws_manager.wants_expanded(message.chat_id):
+        profiles = await profile_cache.load((message.sender_id,))
+        message.sender = profiles.get(message.sender_id)
+        expanded = message.model_dump_json()
+    await ws_manager.send_to_chat(
+        message.model_dump_json(exclude={"sender"}), message.chat_id, expanded=expanded
+    )
+
+
+async def deliver_read_notification(
+    notification: MessageReadNotification, sender_id: int, reader_id: int
+):
+    """
+    Tell the sender their message was read, run from the task queue.
+    """
+    await ws_manager.send_to_user(
+        message=notification.model_dump_json(), user_id=sender_id
+    )
+    log_event(
+        "message.read",
+        user_id=reader_id,
+        message_id=notification.id,
+        sender_id=sender_id,
+    )
+
+
+async def store_message(user_id: int, payload: SendMessagePayload) -> Message:
+    """
+    Check and commit a message.
+    """
+    async with AsyncLocalSession() as session:
+        chat_stmt = select(Chat).where(Chat.id == payload.chat_id)
+        result = await session.execute(chat_stmt)
+        chat = result.scalars().first()
+        if not chat:
+            raise CommandError("not_found", "Chat not found")
+        chat_users_stmt = select(UserChat).where(
+            UserChat.chat_id == chat.id,
+            UserChat.user_id == user_id,
+        )
+        result = await session.execute(chat_users_stmt)
+        chat_user = result.scalar_one_or_none()
+        if not chat_user:
+            raise CommandError("forbidden", "You are not a member of this chat")
+        if payload.attachment_id is not None:
+            attachment = await session.get(Attachment, payload.attachment_id)
+            if not attachment or attachment.chat_id != payload.chat_id:
+                raise CommandError("not_found", "Attachment not found in this chat")
+        async with shard_router.write_session_for(
+            payload.chat_id, session
+        ) as message_session:
+            double_stmt = select(Message).where(
+                Message.client_message_id == payload.client_message_id
+            )
+            result = await message_session.execute(double_stmt)
+            existing_message = result.scalars().first()
+            if existing_message:
+                raise CommandError(
+                    "duplicate",
+                    f"Duplicate message detected (Client ID: {payload.client_message_id}).",
                 )
-                result = await session.execute(double_stmt)
-                existing_message = result.scalars().first()
-                if existing_message:
-                    raise WebSocketException(
-                        code=status.WS_1008_POLICY_VIOLATION,
-                        reason=f"Duplicate message detected (Client ID: {message_in.client_message_id}).",
-                    )
-                message = Message(**message_in.model_dump())
-                session.add(message)
-                await session.commit()
-                await session.refresh(message)
-                message_out = MessageResponse.model_validate(message)
-                get_users_stmt = select(UserChat).where(
-                    UserChat.chat_id == message.chat_id
+            message = Message(
+                **payload.model_dump(),
+                sender_id=user_id,
+                id=await shard_router.allocate_message_id(),
+            )
+            message_session.add(message)
+            await version_tracker.commit_with_bump(
+                message_session, (message.chat_id,), session
+            )
+            replica_router.mark_write(
+                user_ids=(user_id,), chat_ids=(message.chat_id,)
+            )
+            await message_session.refresh(message)
+    return message
+
+
+async def spool_message(user_id: int, payload: SendMessagePayload) -> SpooledMessage:
+    """
+    Check a message against the in-memory subscriptions only and spool it.
+    """
+    if not ws_manager.is_chat_member(user_id, payload.chat_id):
+        raise CommandError("forbidden", "You are not a member of this chat")
+    if payload.attachment_id is not None:
+        raise CommandError(
+            "unavailable", "Attachments cannot be sent while the database is unavailable"
+        )
+    client_message_id = str(payload.client_message_id)
+    if message_spool.is_pending(client_message_id):
+        raise CommandError(
+            "duplicate",
+            f"Duplicate message detected (Client ID: {client_message_id}).",
+        )
+    message = SpooledMessage(**payload.model_dump(), sender_id=user_id, timestamp=int(time.time()))
+    try:
+        await message_spool.append(message.model_dump(mode="json", exclude={"id", "sender"}))
+    except (SpoolFullError, OSError):
+        raise CommandError("unavailable", "Messages cannot be stored right now, retry later")
+    log_event("message.spooled", user_id=user_id, chat_id=message.chat_id)
+    return message
+
+
+@command_handler(WebSocketCommand.SEND_MESSAGE)
+async def send_message(connection: Connection, payload: SendMessagePayload):
+    """
+    Store a message and queue its delivery to the chat.
+
+    With the spool enabled, a message that is not committed within
+    MESSAGE_SPOOL_AFTER_SECONDS is spooled and delivered without an id
+    instead, and so are the next ones until the spool is drained, to keep
+    them in order.
+    """
+    user_id = connection.user_id
+    if message_spool.enabled:
+        if not message_spool.has_pending():
+            try:
+                message = await asyncio.wait_for(
+                    store_message(user_id, payload), settings.MESSAGE_SPOOL_AFTER_SECONDS
                 )
-                result = await session.execute(get_users_stmt)
-                user_chats = result.scalars().all()
-                user_ids = [user_chat.user_id for user_chat in user_chats]
-                await ws_manager.send_to_chat(message_out.model_dump_json(), user_ids)
-                logging.info(
-                    f"Message sent from user {user_id} to chat {message.chat_id}: {message.text}"
+            except DATABASE_UNAVAILABLE as e:
+                log_event(
+                    "message.store_failed",
+                    logging.WARNING,
+                    user_id=user_id,
+                    error=type(e).__name__,
                 )
-            elif command == WebSocketCommand.READ_MESSAGE:
-                message_id = payload.get("id")
-                if not message_id:
-                    raise WebSocketException(
-                        code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
-                        reason="Message ID is required",
-                    )
-                read_stmt = select(Message).where(Message.id == message_id)
-                result = await session.execute(read_stmt)
-                message = result.scalars().first()
-                if not message:
-                    raise WebSocketException(
-                        code=status.WS_1008_POLICY_VIOLATION,
-                        reason="Message not found",
-                    )
-                if not message.is_read:
-                    message.is_read = True
-                    await session.commit()
-                    await ws_manager.send_to_user(
-                        message=MessageReadNotification.model_validate(
-                            message
-                        ).model_dump_json(),
-                        user_id=message.sender_id,
-                    )
-                    logging.info(
-                        f"Message {message.id} marked as read by user {user_id} and notified sender {message.sender_id}"
-                    )
+            else:
+                await enqueue_delivery(message)
+                return
+        spooled = await spool_message(user_id, payload)
+        with span("ws.enqueue"):
+            await task_queue.enqueue(
+                "message.fanout",
+                deliver_spooled_message,
+                spooled,
+                key=spooled.chat_id,
+            )
+        return
+    await enqueue_delivery(await store_message(user_id, payload))
+
+
+async def enqueue_delivery(message: Message):
+    with span("ws.enqueue"):
+        await task_queue.enqueue(
+            "message.fanout",
+            deliver_message,
+            MessageResponse.model_validate(message),
+            key=message.chat_id,
+        )
+
+
+async def schedule_message(
+    session: AsyncSession, user_id: int, payload: ScheduleMessagePayload
+) -> ScheduledMessage:
+    """
+    Check and commit a scheduled message, then hand it to the scheduler.
+    """
+    member_stmt = select(UserChat.id).where(
+        UserChat.chat_id == payload.chat_id, UserChat.user_id == user_id
+    )
+    if (await session.execute(member_stmt)).scalar_one_or_none() is None:
+        raise CommandError("forbidden", "You are not a member of this chat")
+    if payload.attachment_id is not None:
+        attachment = await session.get(Attachment, payload.attachment_id)
+        if not attachment or attachment.chat_id != payload.chat_id:
+            raise CommandError("not_found", "Attachment not found in this chat")
+    duplicate = CommandError(
+        "duplicate",
+        f"Duplicate message detected (Client ID: {payload.client_message_id}).",
+    )
+    async with shard_router.session_for(payload.chat_id, session) as message_session:
+        sent_stmt = select(Message.id).where(
+            Message.client_message_id == payload.client_message_id
+        )
+        if (await message_session.execute(sent_stmt)).first() is not None:
+            raise duplicate
+    scheduled = ScheduledMessage(**payload.model_dump(), sender_id=user_id)
+    session.add(scheduled)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # client_message_id of another scheduled message
+        raise duplicate
+    message_scheduler.add(scheduled)
+    log_event(
+        "message.scheduled",
+        user_id=user_id,
+        chat_id=scheduled.chat_id,
+        send_at=scheduled.send_at,
+    )
+    return scheduled
+
+
+@command_handler(WebSocketCommand.SCHEDULE_MESSAGE)
+async def schedule_message_command(connection: Connection, payload: ScheduleMessagePayload):
+    """
+    Schedule a message and confirm it to the connection.
+    """
+    async with AsyncLocalSession() as session:
+        scheduled = await schedule_message(session, connection.user_id, payload)
+    reply = ScheduledMessageNotification.model_validate(scheduled)
+    ws_manager.send(connection, reply.model_dump_json())
+
+
+async def send_scheduled_message(scheduled: ScheduledMessage):
+    """
+    Send a message that came due the way SEND_MESSAGE does, run by the
+    scheduler. A client_message_id already stored was sent before a restart
+    or by another process and is skipped, as is a message its sender may
+    not send anymore.
+    """
+    payload = SendMessagePayload(
+        chat_id=scheduled.chat_id,
+        text=scheduled.text,
+        client_message_id=scheduled.client_message_id,
+        attachment_id=scheduled.attachment_id,
+    )
+    try:
+        message = await store_message(scheduled.sender_id, payload)
+    except CommandError as e:
+        if e.code != "duplicate":
+            log_event(
+                "message.schedule_dropped",
+                logging.WARNING,
+                user_id=scheduled.sender_id,
+                chat_id=scheduled.chat_id,
+                code=e.code,
+            )
+        return
+    except IntegrityError:
+        # stored by another process between the check and the insert
+        return
+    await enqueue_delivery(message)
+
+
+@command_handler(WebSocketCommand.READ_MESSAGE)
+async def read_message(connection: Connection, payload: ReadMessagePayload):
+    """
+    Mark a message as read and queue the notification of its sender.
+    """
+    chat_id = payload.chat_id
+    if chat_id is None:
+        chat_id = await shard_router.find_chat_id(payload.id)
+        if chat_id is None and shard_router.enabled:
+            raise CommandError("not_found", "Message not found")
+    async with AsyncLocalSession() as session:
+        async with shard_router.write_session_for(chat_id, session) as message_session:
+            read_stmt = select(Message).where(Message.id == payload.id)
+            result = await message_session.execute(read_stmt)
+            message = result.scalars().first()
+            if not message:
+                raise CommandError("not_found", "Message not found")
+            if message.is_read:
+                return
+            message.is_read = True
+            await version_tracker.commit_with_bump(
+                message_session, (message.chat_id,), session
+            )
+    replica_router.mark_write(chat_ids=(message.chat_id,))
+    await task_queue.enqueue(
+        "message.read_notification",
+        deliver_read_notification,
+        MessageReadNotification.model_validate(message),
+        message.sender_id,
+        connection.user_id,
+        key=message.chat_id,
+    )
+
+
+@command_handler(WebSocketCommand.TYPING)
+async def typing(connection: Connection, payload: TypingPayload):
+    if not ws_manager.is_chat_member(connection.user_id, payload.chat_id):
+        raise CommandError("forbidden", "You are not a member of this chat")
+    await typing_tracker.typing(connection.user_id, payload.chat_id)
+
+
+@command_handler(WebSocketCommand.REACT)
+async def react(connection: Connection, payload: ReactPayload):
+    """
+    Add or take back a reaction. It is written with the next flush of the
+    aggregator, which then sends the new counts to the chat.
+    """
+    if not ws_manager.is_chat_member(connection.user_id, payload.chat_id):
+        raise CommandError("forbidden", "You are not a member of this chat")
+    if not await reaction_aggregator.message_in_chat(payload.message_id, payload.chat_id):
+        raise CommandError("not_found", "Message not found")
+    if not reaction_aggregator.react(
+        payload.chat_id, payload.message_id, connection.user_id, payload.emoji, not payload.remove
+    ):
+        raise CommandError("unavailable", "Too many reactions waiting, retry later")
+
+
+def frame_error(error: ValidationError) -> ErrorNotification:
+    """
+    ERROR reply to a frame that failed to parse. Errors leave out the input,
+    which would echo the payload, message text included.
+    """
+    errors = error.errors(include_url=False, include_context=False, include_input=False)
+    first = errors[0]
+    code = FRAME_ERROR_CODES.get(first["type"])
+    if code is not None:
+        return ErrorNotification(code=code, detail=first["msg"])
+    command = first["loc"][0] if first["loc"] else None
+    if command not in command_handlers:
+        return ErrorNotification(code="invalid_frame", detail=first["msg"])
+    # locations start with the command, the discriminator of the frame
+    for e in errors:
+        e["loc"] = e["loc"][1:]
+    return ErrorNotification(
+        request=command, code="invalid_payload", detail="Invalid payload", errors=errors
+    )
+
+
+async def dispatch(connection: Connection, raw: str):
+    """
+    Parse one frame in a single pass and run the handler of its command.
+    Invalid frames and failed commands are answered with an ERROR frame and
+    the connection stays open. Expired or invalid credentials close it.
+    """
+    try:
+        frame = client_frame_adapter.validate_json(raw)
+    except ValidationError as e:
+        reply = frame_error(e)
+        log_event(
+            "ws.invalid_frame",
+            logging.WARNING,
+            user_id=connection.user_id,
+            code=reply.code,
+            request=reply.request,
+            errors=e.error_count(),
+        )
+        ws_manager.send(connection, reply.model_dump_json())
+        return
+    if frame.command != WebSocketCommand.AUTH and connection.expired():
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason="Token expired, send AUTH with a new token",
+        )
+    if connection.revoked():
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION, reason="Token revoked"
+        )
+    async with traced(f"WS {frame.command}"):
+        try:
+            await command_handlers[frame.command](connection, frame.payload)
+        except CommandError as e:
+            reply = ErrorNotification(request=frame.command, code=e.code, detail=e.detail)
+            ws_manager.send(connection, reply.model_dump_json())
+
+
+@message_router.websocket("/ws/{token}")
+async def websocket_endpoint(
+    websocket: WebSocket, token: str, expand: MessageExpand | None = None
+):
+    """
+    WebSocket endpoint for real-time chat communication. With expand=sender
+    delivered messages carry the profile of their sender.
+
+    Sessions only live while a command runs, an idle connection holds no
+    database resources, only its Connection record. The record is removed
+    however the connection ends: a close by the client, a close by the
+    server through WebSocketException, or a command failing unexpectedly.
+    """
+    user_id: int | None = None
+    connection = None
+    try:
+        user_id, chat_ids = await authenticate(token)
+        claims = decode_access_token(token)
+        connection = await ws_manager.connect(
+            websocket,
+            user_id,
+            chat_ids,
+            claims["exp"],
+            expand == MessageExpand.SENDER,
+            claims.get("fam"),
+        )
+        log_event("ws.connected", user_id=user_id)
+        while True:
+            raw = await websocket.receive_text()
+            connection.touch()
+            await dispatch(connection, raw)
     except WebSocketDisconnect:
-        logging.info(f"WebSocket disconnected for user {user_id}.")
-        if user_id:
-            ws_manager.disconnect(websocket, user_id)
+        log_event("ws.disconnected", user_id=user_id)
+    except WebSocketException as e:
+        log_event("ws.closed", user_id=user_id, code=e.code, reason=e.reason)
+        raise
+    finally:
+        if connection:
+            ws_manager.disconnect(connection)
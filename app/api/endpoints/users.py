@@ -0,0 +1,234 @@
+import base64
+import json
+import sys
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, func, or_, and_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import User
+from app.api.deps import get_async_session, get_current_user, get_user_directory_session
+from app.core.profiles import profile_cache
+from app.core.versions import version_tracker
+from app.db.routing import replica_router
+from app.schemas import UserRead, UserUpdate, UserSearchPage
+
+user_router = APIRouter(prefix="/users", tags=["User"])
+
+# shorter terms have no trigrams, they are matched as prefixes only
+TRIGRAM_MIN_LENGTH = 3
+# terms found anywhere in more users than this are matched as prefixes, so a
+# page never sorts more matches than this
+SUBSTRING_MAX_MATCHES = 1000
+# SQLite lower() only folds ASCII letters
+ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def encode_cursor(key: str, user_id: int) -> str:
+    raw = json.dumps([key, user_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(key, str) or not isinstance(user_id, int):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return key, user_id
+
+
+def _lower(column, dialect_name: str):
+    key = func.lower(column)
+    if dialect_name == "postgresql":
+        # matches the COLLATE "C" expression indexes of the migration
+        key = key.collate("C")
+    return key
+
+
+def _prefix(key, prefix: str):
+    "Range over every string starting with prefix, usable by a btree index"
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        # nothing sorts after U+10FFFF
+        return key >= prefix
+    code = ord(stem[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # surrogates cannot be sent to the database, none is stored either
+        code = 0xE000
+    return and_(key >= prefix, key < stem[:-1] + chr(code))
+
+
+def _fold(q: str, dialect_name: str) -> str:
+    "q lowercased like the database lowercases names"
+    if dialect_name == "sqlite":
+        return q.translate(ASCII_LOWER)
+    return q.lower()
+
+
+def _substring_condition(q: str):
+    return or_(
+        User.name.icontains(q, autoescape=True),
+        User.email.icontains(q, autoescape=True),
+    )
+
+
+def substring_search_stmt(q: str, dialect_name: str = "postgresql"):
+    """
+    Count of users matching q anywhere, up to SUBSTRING_MAX_MATCHES + 1, or
+    None when q is matched as a prefix only.
+    """
+    if dialect_name != "postgresql" or len(q) < TRIGRAM_MIN_LENGTH:
+        return None
+    matches = (
+        select(User.id)
+        .where(_substring_condition(q.lower()))
+        .limit(SUBSTRING_MAX_MATCHES + 1)
+        .subquery()
+    )
+    return select(func.count()).select_from(matches)
+
+
+def user_search_stmt(
+    q: str,
+    limit: int,
+    after: tuple[str, int] | None = None,
+    dialect_name: str = "postgresql",
+    substring: bool = False,
+):
+    """
+    Users matching q in case-insensitive (name, id) order, with the sort key
+    as second column.
+
+    Names starting with q are an ordered walk of ix_users_lower_name_id.
+    Emails are matched by prefix only for terms containing "@": sorting the
+    many emails sharing a short prefix by name would cost a full sort. With
+    substring, q matches anywhere in name or email through the pg_trgm
+    indexes instead, and every match is sorted: only pass it when
+    substring_search_stmt found at most SUBSTRING_MAX_MATCHES.
+    """
+    q = _fold(q, dialect_name)
+    name_key = _lower(User.name, dialect_name)
+    if substring:
+        condition = _substring_condition(q)
+    elif "@" in q:
+        condition = or_(
+            _prefix(name_key, q),
+            _prefix(_lower(User.email, dialect_name), q),
+        )
+    else:
+        condition = _prefix(name_key, q)
+    stmt = (
+        select(User, name_key.label("search_key"))
+        .where(condition)
+        .order_by(name_key, User.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(name_key, User.id) > tuple_(*after))
+    return stmt
+
+
+async def find_users(
+    session: AsyncSession, q: str, limit: int, after: tuple[str, int] | None = None
+) -> list:
+    """
+    Rows of user_search_stmt, matching q anywhere when it is rare enough.
+    """
+    dialect_name = session.bind.dialect.name
+    substring = False
+    count_stmt = substring_search_stmt(q, dialect_name)
+    if count_stmt is not None:
+        # common terms fall back to prefixes, every page of q the same way
+        substring = (await session.execute(count_stmt)).scalar_one() <= SUBSTRING_MAX_MATCHES
+    stmt = user_search_stmt(q, limit, after, dialect_name, substring)
+    return (await session.execute(stmt)).all()
+
+
+@user_router.get(
+    "/search",
+    response_model=UserSearchPage,
+    status_code=status.HTTP_200_OK,
+    summary="Search users",
+    description=(
+        "Find users by name or email, e.g. to add them to a group. Names "
+        "starting with the query match, emails too if the query contains @. "
+        "On PostgreSQL queries of three or more characters match anywhere in "
+        "name or email, unless they are found in more than 1000 users. "
+        "Results are ordered by name, pass next_cursor to get the next page."
+    ),
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Page of matching users",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "items": [
+                            {"id": 2, "name": "Bob", "email": "bob@example.com"}
+                        ],
+                        "next_cursor": "WyJib2IiLDJd",
+                    }
+                }
+            },
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid cursor",
+        },
+    },
+)
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=100, description="Start or part of a name or email"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_user_directory_session),
+):
+    """
+    Search users.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    rows = await find_users(session, q, limit + 1, after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_user, last_key = rows[-1]
+        next_cursor = encode_cursor(last_key, last_user.id)
+    return UserSearchPage(
+        items=[UserRead.model_validate(user) for user, _ in rows],
+        next_cursor=next_cursor,
+    )
+
+
+@user_router.patch(
+    "/me",
+    response_model=UserRead,
+    status_code=status.HTTP_200_OK,
+    summary="Update profile",
+    description="Change the name of the current user.",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Profile updated",
+            "content": {
+                "application/json": {
+                    "example": {"id": 1, "name": "Alice", "email": "alice@example.com"}
+                }
+            },
+        },
+    },
+)
+async def update_me(
+    user_in: UserUpdate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Update profile.
+    """
+    current_user.name = user_in.name
+    # the name shows in expanded history of every chat of the user
+    await version_tracker.bump_user_chats(session, current_user.id)
+    await session.commit()
+    profile_cache.invalidate(current_user.id)
+    replica_router.mark_write(user_ids=(current_user.id,))
+    return current_user
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator
+import anyio
+from app.core.config import settings
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    "Raised when a chunk goes past the declared upload size"
+
+
+class UploadInterrupted(Exception):
+    "Raised when streaming stops early, carries the offset to resume from"
+
+    def __init__(self, received: int):
+        super().__init__(f"Upload interrupted at offset {received}")
+        self.received = received
+
+
+class AttachmentStorage:
+    """
+    Local disk storage for attachments.
+
+    Uploads are appended to uploads/<upload_id>.part while a SHA-256 of the
+    received bytes is kept in memory, so completing an upload needs no second
+    pass over the file. Hash states unused for ATTACHMENT_UPLOAD_TTL_SECONDS
+    are dropped, they are rebuilt from the part file if the upload is
+    resumed. Completed files are stored once per hash under
+    objects/<aa>/<sha256>, identical uploads share the same file.
+
+    Writers to a part file are serialized by the claim on the upload row
+    (see upload_chunk), not here.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        # least recently used first
+        self.hashers: OrderedDict[uuid.UUID, "hashlib._Hash"] = OrderedDict()
+        self.hashed: dict[uuid.UUID, int] = {}
+        self.used_at: dict[uuid.UUID, float] = {}
+
+    def part_path(self, upload_id: uuid.UUID) -> Path:
+        return self.root / "uploads" / f"{upload_id}.part"
+
+    def object_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256
+
+    def _touch(self, upload_id: uuid.UUID):
+        now = time.monotonic()
+        self.hashers.move_to_end(upload_id)
+        self.used_at[upload_id] = now
+        while self.hashers:
+            oldest = next(iter(self.hashers))
+            if now - self.used_at[oldest] < settings.ATTACHMENT_UPLOAD_TTL_SECONDS:
+                break
+            self.forget(oldest)
+
+    async def create(self, upload_id: uuid.UUID):
+        path = self.part_path(upload_id)
+        await anyio.to_thread.run_sync(lambda: path.parent.mkdir(parents=True, exist_ok=True))
+        await anyio.Path(path).touch()
+        self.hashers[upload_id] = hashlib.sha256()
+        self.hashed[upload_id] = 0
+        self._touch(upload_id)
+
+    async def _hasher(self, upload_id: uuid.UUID, received: int) -> "hashlib._Hash":
+        """
+        Hash state of an upload. Rebuilt from the part file after a restart,
+        when the upload was started on another worker or when the in-memory
+        state ran ahead of the recorded offset.
+        """
+        hasher = self.hashers.get(upload_id)
+        if hasher is None or self.hashed.get(upload_id) != received:
+            hasher = hashlib.sha256()
+            async with await anyio.open_file(self.part_path(upload_id), "rb") as file:
+                remaining = received
+                while remaining:
+                    chunk = await file.read(min(HASH_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            self.hashers[upload_id] = hasher
+            self.hashed[upload_id] = received
+        self._touch(upload_id)
+        return hasher
+
+    async def append(
+        self,
+        upload_id: uuid.UUID,
+        offset: int,
+        size: int,
+        chunks: AsyncIterator[bytes],
+        deadline: float,
+    ) -> int:
+        """
+        Stream chunks to the part file starting at offset and return the new
+        offset. Memory use is bounded by the size of one chunk. Bytes received
+        before a disconnect, an oversized chunk or the deadline (a time.time()
+        timestamp, the end of the caller's claim) are kept and reported
+        through UploadInterrupted, so the client can resume from there.
+        """
+        hasher = await self._hasher(upload_id, offset)
+        received = offset
+        async with await anyio.open_file(self.part_path(upload_id), "r+b") as file:
+            await file.truncate(offset)
+            await file.seek(offset)
+            try:
+                with anyio.fail_after(max(deadline - time.time(), 0)):
+                    async for chunk in chunks:
+                        if received + len(chunk) > size:
+                            raise UploadTooLarge
+                        await file.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+                        self.hashed[upload_id] = received
+            except Exception as e:
+                raise UploadInterrupted(received) from e
+        return received
+
+    async def digest(self, upload_id: uuid.UUID, received: int) -> str:
+        "SHA-256 of a finished upload."
+        return (await self._hasher(upload_id, received)).hexdigest()
+
+    async def complete(self, upload_id: uuid.UUID, sha256: str, shared: bool):
+        """
+        Move a finished upload into content-addressed storage. When shared,
+        attachments the caller holds locked already reference the stored
+        content and the new copy is dropped. Otherwise the copy is stored
+        even if the file exists, it may be a file a cleanup is removing.
+        """
+        part = self.part_path(upload_id)
+        target = self.object_path(sha256)
+
+        def store():
+            if shared and target.exists():
+                part.unlink()
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(part, target)
+
+        await anyio.to_thread.run_sync(store)
+        self.forget(upload_id)
+
+    def forget(self, upload_id: uuid.UUID):
+        self.hashers.pop(upload_id, None)
+        self.hashed.pop(upload_id, None)
+        self.used_at.pop(upload_id, None)
+
+
+attachment_storage = AttachmentStorage(settings.ATTACHMENTS_DIR)
@@ -9,7 +9,128 @@ class Settings(BaseSettings):
     DATABASE_URL: str
 
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    # revocations made by other processes are picked up within this interval
+    TOKEN_REVOCATION_SYNC_SECONDS: float = 10.0
     ALGORITHM: str = "HS256"
+    # users allowed to use the /debug endpoints
+    ADMIN_EMAILS: list[str] = []
+
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # pooled connections opened and primed at startup, capped by DB_POOL_SIZE
+    DB_WARMUP_CONNECTIONS: int = 5
+    READINESS_TIMEOUT_SECONDS: float = 2.0
+
+    # read-only endpoints are spread over these, writes go to DATABASE_URL
+    DATABASE_REPLICA_URLS: list[str] = []
+    # how long a writer and the chats it wrote to keep reading from the primary
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    REPLICA_HEALTH_CHECK_SECONDS: float = 5.0
+
+    # messages are spread over these by chat_id, users and chats stay in
+    # DATABASE_URL; empty keeps messages in DATABASE_URL
+    MESSAGE_SHARD_URLS: list[str] = []
+    SHARD_MAP_REFRESH_SECONDS: float = 5.0
+    MESSAGE_ID_BLOCK_SIZE: int = 1000
+
+    ATTACHMENTS_DIR: str = "attachments"
+    ATTACHMENT_MAX_SIZE: int = 50 * 1024 * 1024
+    # serve downloads through nginx sendfile via X-Accel-Redirect when set,
+    # e.g. "/protected-attachments/" mapped to ATTACHMENTS_DIR as internal
+    ATTACHMENTS_ACCEL_REDIRECT_PREFIX: str | None = None
+    # a chunk still streaming after this is cut off, the upload is then free
+    # to be resumed by another request
+    ATTACHMENT_CHUNK_SECONDS: int = 600
+    # uploads not resumed for this long are deleted by maintenance with their
+    # part files
+    ATTACHMENT_UPLOAD_TTL_SECONDS: int = 24 * 60 * 60
+
+    # messages waiting to be written to one WebSocket before it is closed
+    WS_OUTBOX_SIZE: int = 1000
+
+    # append-only file taking messages while the database stalls, off if unset
+    MESSAGE_SPOOL_PATH: str | None = None
+    # a message not committed within this is spooled instead
+    MESSAGE_SPOOL_AFTER_SECONDS: float = 1.0
+    # messages are refused once the spool file reaches this size
+    MESSAGE_SPOOL_MAX_BYTES: int = 64 * 1024 * 1024
+    # spooled messages inserted per statement when draining
+    MESSAGE_SPOOL_BATCH_SIZE: int = 500
+    MESSAGE_SPOOL_RETRY_SECONDS: float = 1.0
+
+    # scheduled messages due within this are kept in a heap in memory, the
+    # database is read again when the window ends
+    SCHEDULER_WINDOW_SECONDS: float = 60.0
+    # most scheduled messages loaded at once, the window shrinks beyond
+    SCHEDULER_MAX_LOADED: int = 10000
+    # delay before a due message is tried again while the database is down
+    SCHEDULER_RETRY_SECONDS: float = 5.0
+    # a message failing to send this many times is kept with failed_at set
+    # and not tried again
+    SCHEDULER_MAX_ATTEMPTS: int = 5
+
+    # workers running post-commit side effects such as fan-out
+    TASK_QUEUE_WORKERS: int = 4
+    # tasks waiting over all workers, producers wait when a worker's share is full
+    TASK_QUEUE_SIZE: int = 10000
+    # time given to queued tasks on shutdown
+    TASK_QUEUE_DRAIN_SECONDS: float = 10.0
+
+    # sender profiles cached for expanded messages, reloaded after the TTL so
+    # changes made through other processes show up
+    PROFILE_CACHE_SIZE: int = 10000
+    PROFILE_CACHE_TTL_SECONDS: float = 60.0
+
+    # reactions are written and their counts fanned out once per interval,
+    # so a message gets at most one count update per interval
+    REACTION_FLUSH_SECONDS: float = 1.0
+    # reaction changes written per transaction
+    REACTION_FLUSH_BATCH_SIZE: int = 1000
+    # REACT is refused while this many changes wait for the flush
+    REACTION_PENDING_MAX: int = 100000
+    # chat of recently reacted messages, spares a query per REACT
+    REACTION_MESSAGE_CACHE_SIZE: int = 10000
+
+    TYPING_THROTTLE_SECONDS: float = 2.0
+    TYPING_TTL_SECONDS: float = 6.0
+    TYPING_SUMMARY_INTERVAL_SECONDS: float = 1.0
+    # online recipients from which typing events are coalesced into summaries
+    TYPING_COALESCE_THRESHOLD: int = 20
+
+    LOG_LEVEL: str = "INFO"
+    # one JSON object per line, plain text when disabled
+    LOG_JSON: bool = True
+    # records waiting for the writer thread, newer ones are dropped when full
+    LOG_QUEUE_SIZE: int = 10000
+    # share of high-volume events that are logged, by event name
+    LOG_SAMPLE_RATES: dict[str, float] = {"message.sent": 0.1, "message.read": 0.1}
+
+    # serve the /debug endpoints (to ADMIN_EMAILS only)
+    DEBUG_ENDPOINTS_ENABLED: bool = False
+    # record spans and queries of each request and WebSocket command
+    TRACING_ENABLED: bool = False
+    # share of traces kept for /debug/traces, flagged traces are always kept
+    TRACE_SAMPLE_RATE: float = 0.1
+    TRACE_BUFFER_SIZE: int = 200
+    # traces with more queries than this are flagged
+    TRACE_QUERY_BUDGET: int = 10
+    # traces running one statement this many times are flagged as N+1
+    TRACE_REPEATED_QUERY_THRESHOLD: int = 5
+    TRACE_SLOW_SECONDS: float = 0.5
+    # sample the stack of requests still running after TRACE_SLOW_SECONDS
+    TRACE_PROFILE_SLOW: bool = False
+    TRACE_PROFILE_INTERVAL_SECONDS: float = 0.01
+
+    # messages older than this are deleted, unless the chat sets its own
+    # retention_days; unset keeps messages forever
+    MESSAGE_RETENTION_DAYS: int | None = None
+    # run retention and orphan cleanup inside the app, enable in one process
+    MAINTENANCE_ENABLED: bool = False
+    MAINTENANCE_INTERVAL_SECONDS: float = 3600.0
+    # rows deleted per transaction and the pause between transactions
+    MAINTENANCE_BATCH_SIZE: int = 1000
+    MAINTENANCE_BATCH_PAUSE_SECONDS: float = 0.1
 
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from app.core.config import settings
+
+event_logger = logging.getLogger("app.events")
+
+# attributes every LogRecord has, anything else was passed through extra
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", (), None))
+) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record. Fields passed through extra, e.g. by
+    log_event, become top-level keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Plain text with fields passed through extra appended as key=value.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [
+            f"{key}={value}"
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES
+        ]
+        if fields:
+            text = f"{text} {' '.join(fields)}"
+        return text
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Puts records on the queue as they are. The stock QueueHandler renders the
+    message on the calling thread, here the writer thread does all formatting.
+    Never blocks: when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # tracebacks reference frames that may change before the writer
+            # gets to them, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: QueueListener | None = None
+_queue_handler: LazyQueueHandler | None = None
+
+
+def setup_logging():
+    """
+    Route the root logger through a bounded queue to a writer thread, so
+    formatting and stream I/O happen off the event loop.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_JSON:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(
+            TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = LazyQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.LOG_LEVEL)
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        if _queue_handler.dropped:
+            sys.stderr.write(f"{_queue_handler.dropped} log records dropped\n")
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """
+    Log a structured event. Events listed in LOG_SAMPLE_RATES are logged at
+    that rate, the rate is attached so counts can be scaled back up. Disabled
+    or skipped events cost one dict lookup and no formatting.
+    """
+    if not event_logger.isEnabledFor(level):
+        return
+    rate = settings.LOG_SAMPLE_RATES.get(event)
+    if rate is not None:
+        if random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+    event_logger.log(level, event, extra=fields)
+
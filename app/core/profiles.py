@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Iterable
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import AsyncLocalSession
+from app.db.models import User
+
+
+class ProfileCache:
+    """
+    Shared LRU of the public profile of users, for messages expanded with
+    their sender.
+
+    load() answers a whole page at once: cached profiles are returned as is
+    and the missing ones are read with one IN query. A profile change in this
+    process invalidates its entry. Entries expire after
+    PROFILE_CACHE_TTL_SECONDS, which bounds how long a change made through
+    another process, or a profile read back from a lagging replica, stays
+    visible; expanded history ETags change with that period for the same
+    reason, see app.core.versions.profile_period.
+    """
+
+    def __init__(self):
+        # user id -> (time.monotonic() of the load, profile)
+        self.entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> dict | None:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        loaded_at, profile = entry
+        if time.monotonic() - loaded_at > settings.PROFILE_CACHE_TTL_SECONDS:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return profile
+
+    def put(self, user_id: int, profile: dict):
+        self.entries[user_id] = (time.monotonic(), profile)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > settings.PROFILE_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        Forget a profile. Call after the change is committed.
+        """
+        self.entries.pop(user_id, None)
+
+    async def load(
+        self, user_ids: Iterable[int], session: AsyncSession | None = None
+    ) -> dict[int, dict]:
+        """
+        Profiles of user_ids by id, users that do not exist are left out.
+        Misses are read through session, or a new primary session if None.
+        """
+        profiles = {}
+        missing = []
+        for user_id in set(user_ids):
+            profile = self.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles[user_id] = profile
+        self.hits += len(profiles)
+        self.misses += len(missing)
+        if not missing:
+            return profiles
+        stmt = select(User.id, User.name).where(User.id.in_(missing))
+        if session is None:
+            async with AsyncLocalSession() as session:
+                rows = (await session.execute(stmt)).all()
+        else:
+            rows = (await session.execute(stmt)).all()
+        for user_id, name in rows:
+            profile = {"id": user_id, "name": name}
+            self.put(user_id, profile)
+            profiles[user_id] = profile
+        return profiles
+
+
+profile_cache = ProfileCache()
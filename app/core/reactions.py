@@ -0,0 +1,272 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from app.core.config import settings
+from app.core.logs import log_event
+from app.core.tasks import task_queue
+from app.core.versions import version_tracker
+from app.core.websocket import ws_manager
+from app.db.base import AsyncLocalSession, insert_ignore, upsert
+from app.db.models import Message, Reaction, ReactionCount
+from app.db.routing import replica_router
+from app.db.sharding import shard_router
+from app.schemas import ReactionNotification
+
+# (message_id, user_id, emoji)
+ReactionKey = tuple[int, int, str]
+
+
+class ReactionStats:
+    "Counters of the reaction aggregator since the process started."
+
+    def __init__(self):
+        self.accepted = 0
+        self.refused = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.notifications = 0
+        self.last_error: str | None = None
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+async def deliver_reactions(notification: ReactionNotification):
+    await ws_manager.send_to_chat(notification.model_dump_json(), notification.chat_id)
+
+
+class ReactionAggregator:
+    """
+    Reactions collected in memory and written in batches.
+
+    REACT only records the latest change of each (message, user, emoji), so
+    toggling a reaction back and forth costs nothing until the next flush.
+    Every REACTION_FLUSH_SECONDS the changes are written per database in
+    transactions of REACTION_FLUSH_BATCH_SIZE, the messages they touched are
+    recounted into reaction_counts, which history pages join, and each of
+    those messages gets one REACT frame with all its counts. However many
+    users react to a hot message, it costs one count query and one fan-out
+    per interval. Changes that failed to be written are retried with the
+    next flush, changes not written yet are lost if the process dies.
+    """
+
+    def __init__(self):
+        # latest change of each reaction: (chat_id, added)
+        self.pending: dict[ReactionKey, tuple[int, bool]] = {}
+        # message_id -> chat_id of messages reacted to recently
+        self.message_chats: OrderedDict[int, int] = OrderedDict()
+        self.stats = ReactionStats()
+        self._task: asyncio.Task | None = None
+        # one flush at a time, the last one runs on stop
+        self._lock = asyncio.Lock()
+
+    async def message_in_chat(self, message_id: int, chat_id: int) -> bool:
+        """
+        Whether the message exists in the chat. The chat of a message never
+        changes, so the answer is cached and a hot message is looked up once.
+        """
+        message_chat_id = self.message_chats.get(message_id)
+        if message_chat_id is None:
+            async with AsyncLocalSession() as session:
+                async with shard_router.session_for(chat_id, session) as message_session:
+                    stmt = select(Message.chat_id).where(Message.id == message_id)
+                    result = await message_session.execute(stmt)
+                    message_chat_id = result.scalar_one_or_none()
+            if message_chat_id is None:
+                return False
+        self.message_chats[message_id] = message_chat_id
+        self.message_chats.move_to_end(message_id)
+        while len(self.message_chats) > settings.REACTION_MESSAGE_CACHE_SIZE:
+            self.message_chats.popitem(last=False)
+        return message_chat_id == chat_id
+
+    def react(self, chat_id: int, message_id: int, user_id: int, emoji: str, added: bool) -> bool:
+        """
+        Record a reaction being added or taken back. False when
+        REACTION_PENDING_MAX changes are waiting already.
+        """
+        key = (message_id, user_id, emoji)
+        if key not in self.pending and len(self.pending) >= settings.REACTION_PENDING_MAX:
+            self.stats.refused += 1
+            return False
+        self.pending[key] = (chat_id, added)
+        self.stats.accepted += 1
+        return True
+
+    async def _write(
+        self, sessionmaker, batch: list[tuple[ReactionKey, int, bool]]
+    ) -> dict[int, tuple[int, dict[str, int]]]:
+        """
+        Apply a batch of changes in one transaction and recount the messages
+        it touched. Returns message_id -> (chat_id, counts by emoji).
+        Reactions that cannot be added are dropped, the others are kept.
+        """
+        added = [
+            {"message_id": message_id, "user_id": user_id, "emoji": emoji, "chat_id": chat_id}
+            for (message_id, user_id, emoji), chat_id, is_added in batch
+            if is_added
+        ]
+        removed = [key for key, _, is_added in batch if not is_added]
+        chats = {key[0]: chat_id for key, chat_id, _ in batch}
+        dropped = 0
+        async with sessionmaker() as session:
+            dialect_name = session.bind.dialect.name
+            stmt = insert_ignore(Reaction.__table__, dialect_name)
+            if added:
+                try:
+                    await session.execute(stmt, added)
+                except IntegrityError:
+                    # e.g. a message deleted since it was reacted to
+                    await session.rollback()
+                    dropped = await self._add_one_by_one(session, stmt, added)
+            if removed:
+                await session.execute(
+                    delete(Reaction)
+                    .where(tuple_(Reaction.message_id, Reaction.user_id, Reaction.emoji).in_(removed))
+                    .execution_options(synchronize_session=False)
+                )
+            count_stmt = (
+                select(Reaction.message_id, Reaction.emoji, func.count())
+                .where(Reaction.message_id.in_(chats))
+                .group_by(Reaction.message_id, Reaction.emoji)
+            )
+            rows = (await session.execute(count_stmt)).all()
+            # emojis nobody reacts with anymore
+            await session.execute(
+                delete(ReactionCount)
+                .where(
+                    ReactionCount.message_id.in_(chats),
+                    tuple_(ReactionCount.message_id, ReactionCount.emoji).not_in(
+                        [(message_id, emoji) for message_id, emoji, _ in rows]
+                    ),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if rows:
+                await session.execute(
+                    upsert(ReactionCount.__table__, dialect_name, ["count"]),
+                    [
+                        {"message_id": message_id, "emoji": emoji, "count": count}
+                        for message_id, emoji, count in rows
+                    ],
+                )
+            await version_tracker.commit_with_bump(session, set(chats.values()))
+        self.stats.written += len(batch) - dropped
+        counts = {message_id: (chat_id, {}) for message_id, chat_id in chats.items()}
+        for message_id, emoji, count in rows:
+            counts[message_id][1][emoji] = count
+        return counts
+
+    async def _add_one_by_one(self, session, stmt, added: list[dict]) -> int:
+        """
+        Add reactions in a savepoint each, dropping those that fail. Returns
+        the number dropped.
+        """
+        dropped = 0
+        for row in added:
+            try:
+                async with session.begin_nested():
+                    await session.execute(stmt, [row])
+            except IntegrityError as e:
+                dropped += 1
+                self.stats.dropped += 1
+                log_event(
+                    "reaction.dropped",
+                    logging.ERROR,
+                    message_id=row["message_id"],
+                    user_id=row["user_id"],
+                    error=str(e.orig),
+                )
+        return dropped
+
+    async def _announce(self, counts: dict[int, tuple[int, dict[str, int]]]):
+        if not counts:
+            return
+        chat_ids = {chat_id for chat_id, _ in counts.values()}
+        replica_router.mark_write(chat_ids=chat_ids)
+        for message_id, (chat_id, reactions) in counts.items():
+            notification = ReactionNotification(
+                chat_id=chat_id, message_id=message_id, reactions=reactions
+            )
+            await task_queue.enqueue("reaction.fanout", deliver_reactions, notification, key=chat_id)
+        self.stats.notifications += len(counts)
+
+    async def _group(
+        self, fence, changes: dict[ReactionKey, tuple[int, bool]]
+    ) -> dict[int | None, list[tuple[ReactionKey, int, bool]]]:
+        """
+        Changes by the shard of their chat, None when not sharded.
+        """
+        shards = {}
+        if shard_router.enabled and changes:
+            # the chats stay locked until the changes are written, so a chat
+            # being moved is written to its new shard
+            chat_ids = {chat_id for chat_id, _ in changes.values()}
+            shards = await shard_router.lock_placement(fence, chat_ids)
+        groups: dict[int | None, list[tuple[ReactionKey, int, bool]]] = {}
+        for key, (chat_id, added) in changes.items():
+            groups.setdefault(shards.get(chat_id), []).append((key, chat_id, added))
+        return groups
+
+    async def flush(self):
+        """
+        Write the pending changes and fan out the new counts of the messages
+        they touched.
+        """
+        async with self._lock:
+            changes, self.pending = self.pending, {}
+            counts = {}
+            try:
+                async with AsyncLocalSession() as fence:
+                    groups = await self._group(fence, changes)
+                    for shard, group in groups.items():
+                        sessionmaker = shard_router.sessionmakers[shard] if shard is not None else AsyncLocalSession
+                        for start in range(0, len(group), settings.REACTION_FLUSH_BATCH_SIZE):
+                            batch = group[start : start + settings.REACTION_FLUSH_BATCH_SIZE]
+                            counts.update(await self._write(sessionmaker, batch))
+                            for key, _, _ in batch:
+                                del changes[key]
+            except BaseException:
+                # retried with the next flush, changes made meanwhile win
+                for key, value in changes.items():
+                    self.pending.setdefault(key, value)
+                raise
+            finally:
+                await self._announce(counts)
+            if groups:
+                self.stats.flushes += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.REACTION_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.stats.last_error = str(e)
+                logging.error(f"Reaction flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the periodic flush and write what is still pending.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Final reaction flush failed, {len(self.pending)} changes lost: {e}")
+
+
+reaction_aggregator = ReactionAggregator()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from sqlalchemy import select, delete
+from app.core.config import settings
+from app.db.base import AsyncLocalSession, insert_ignore
+from app.db.models import RevokedToken, TokenFamily
+
+DAY = 24 * 60 * 60
+# rows are read again this long after their created_at, covering the time
+# between taking created_at and the commit, and clocks of other processes
+# running behind
+SYNC_OVERLAP_SECONDS = 60
+
+
+class RevocationList:
+    """
+    In-memory copy of revoked_tokens, so checking a token family on every
+    authenticated request and refresh is a set lookup instead of a query.
+
+    Every process adds its own revocations at once and picks up the others'
+    every TOKEN_REVOCATION_SYNC_SECONDS, reading only rows created since the
+    last sync, minus SYNC_OVERLAP_SECONDS: ids are not committed in order,
+    so a row with a lower id than one already seen may still show up. Rows
+    are small in number: a family is revoked on logout or when a rotated
+    refresh token is used again, not on every refresh.
+    """
+
+    def __init__(self):
+        # family id -> expiry of its last refresh token, dropped once expired
+        self.revoked: dict[str, int] = {}
+        # start of the last successful sync
+        self.synced_at = 0
+        self._sync_task: asyncio.Task | None = None
+
+    def is_revoked(self, family: str | None) -> bool:
+        return family is not None and family in self.revoked
+
+    async def revoke(self, family: str):
+        """
+        Revoke every token of a family and forget its refresh token.
+        """
+        # no token of the family issued until now outlives this
+        now = int(time.time())
+        expires_at = now + settings.REFRESH_TOKEN_EXPIRE_DAYS * DAY
+        async with AsyncLocalSession() as session:
+            stmt = insert_ignore(RevokedToken.__table__, session.bind.dialect.name).values(
+                family=family, expires_at=expires_at, created_at=now
+            )
+            await session.execute(stmt)
+            await session.execute(delete(TokenFamily).where(TokenFamily.id == family))
+            await session.commit()
+        self.revoked[family] = expires_at
+
+    def prune(self):
+        now = int(time.time())
+        for family in [f for f, expires_at in self.revoked.items() if expires_at <= now]:
+            del self.revoked[family]
+
+    async def sync(self):
+        """
+        Load revocations added since the last sync and drop expired ones.
+        """
+        started_at = int(time.time())
+        stmt = select(RevokedToken.family, RevokedToken.expires_at).where(
+            RevokedToken.created_at >= self.synced_at - SYNC_OVERLAP_SECONDS
+        )
+        async with AsyncLocalSession() as session:
+            result = await session.execute(stmt)
+            for family, expires_at in result:
+                self.revoked[family] = expires_at
+        self.synced_at = started_at
+        self.prune()
+
+    async def _sync_periodically(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"Failed to sync revoked tokens: {e}")
+            await asyncio.sleep(settings.TOKEN_REVOCATION_SYNC_SECONDS)
+
+    def start(self):
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_periodically())
+
+    async def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+
+
+revocation_list = RevocationList()
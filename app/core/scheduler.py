@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable
+from sqlalchemy import case, select, delete, update
+from app.core.config import settings
+from app.core.spool import DATABASE_UNAVAILABLE
+from app.db.base import AsyncLocalSession
+from app.db.models import ScheduledMessage
+
+
+class SchedulerStats:
+    "Counters of the message scheduler since the process started."
+
+    def __init__(self):
+        self.loads = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_error: str | None = None
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class MessageScheduler:
+    """
+    Sends scheduled messages when they come due, without polling.
+
+    Only the messages due before loaded_until, SCHEDULER_WINDOW_SECONDS
+    ahead or fewer when more than SCHEDULER_MAX_LOADED are due, are read
+    into a heap. The scheduler sleeps until the earliest of them or the end
+    of the window, when it reads the next one. Messages scheduled through
+    this process within the window are pushed on the heap at once, those
+    scheduled through another process are picked up with the next window.
+
+    A due message is sent through send and its row deleted afterwards.
+    send skips client_message_ids already stored, so a message sent right
+    before a crash, or by another process, is not sent twice. A message
+    whose send fails is tried again with the next window, up to
+    SCHEDULER_MAX_ATTEMPTS times, then kept with failed_at set and no longer
+    loaded, so failing messages cannot fill the window.
+    """
+
+    def __init__(self):
+        # (send_at, id) of loaded messages
+        self.heap: list[tuple[int, int]] = []
+        self.loaded: set[int] = set()
+        self.loaded_until = 0.0
+        self.stats = SchedulerStats()
+        self.send: Callable[[ScheduledMessage], Awaitable[None]] | None = None
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _push(self, send_at: int, scheduled_id: int):
+        if scheduled_id not in self.loaded:
+            self.loaded.add(scheduled_id)
+            heapq.heappush(self.heap, (send_at, scheduled_id))
+
+    def add(self, scheduled: ScheduledMessage):
+        """
+        Take a newly committed scheduled message into account.
+        """
+        if self._task is not None and scheduled.send_at < self.loaded_until:
+            self._push(scheduled.send_at, scheduled.id)
+            self._wakeup.set()
+
+    async def _load(self, now: float):
+        horizon = now + settings.SCHEDULER_WINDOW_SECONDS
+        stmt = (
+            select(ScheduledMessage.send_at, ScheduledMessage.id)
+            .where(ScheduledMessage.send_at < horizon, ScheduledMessage.failed_at.is_(None))
+            .order_by(ScheduledMessage.send_at)
+            .limit(settings.SCHEDULER_MAX_LOADED)
+        )
+        async with AsyncLocalSession() as session:
+            rows = (await session.execute(stmt)).all()
+        for send_at, scheduled_id in rows:
+            self._push(send_at, scheduled_id)
+        if len(rows) == settings.SCHEDULER_MAX_LOADED:
+            # the rest is due later than the last loaded one
+            horizon = max(rows[-1][0], now + settings.SCHEDULER_RETRY_SECONDS)
+        self.loaded_until = horizon
+        self.stats.loads += 1
+
+    def _retry(self, scheduled_ids: list[int]):
+        send_at = int(time.time() + settings.SCHEDULER_RETRY_SECONDS)
+        for scheduled_id in scheduled_ids:
+            self._push(send_at, scheduled_id)
+        self.stats.retried += len(scheduled_ids)
+
+    async def _send_due(self, due_ids: list[int]):
+        self.loaded.difference_update(due_ids)
+        try:
+            async with AsyncLocalSession() as session:
+                stmt = (
+                    select(ScheduledMessage)
+                    .where(ScheduledMessage.id.in_(due_ids))
+                    .order_by(ScheduledMessage.send_at, ScheduledMessage.id)
+                )
+                # rows of cancelled messages are gone
+                due = (await session.execute(stmt)).scalars().all()
+        except DATABASE_UNAVAILABLE as e:
+            self.stats.last_error = str(e)
+            self._retry(due_ids)
+            return
+        sent, failed = [], []
+        for scheduled in due:
+            try:
+                await self.send(scheduled)
+            except DATABASE_UNAVAILABLE as e:
+                self.stats.last_error = str(e)
+                self._retry([scheduled.id])
+                continue
+            except Exception as e:
+                # the row stays, it is tried again with the next window
+                self.stats.last_error = str(e)
+                logging.error(f"Failed to send scheduled message {scheduled.id}: {e}")
+                failed.append(scheduled.id)
+                continue
+            sent.append(scheduled.id)
+        if not sent and not failed:
+            return
+        async with AsyncLocalSession() as session:
+            if sent:
+                await session.execute(
+                    delete(ScheduledMessage)
+                    .where(ScheduledMessage.id.in_(sent))
+                    .execution_options(synchronize_session=False)
+                )
+            given_up = await self._count_failures(session, failed) if failed else []
+            await session.commit()
+        self.stats.sent += len(sent)
+        self.stats.failed += len(given_up)
+        for scheduled_id in given_up:
+            logging.error(f"Gave up sending scheduled message {scheduled_id}")
+
+    async def _count_failures(self, session, failed_ids: list[int]) -> list[int]:
+        """
+        Count a failed attempt of each message. Returns the ids of messages
+        that reached SCHEDULER_MAX_ATTEMPTS and are not tried again.
+        """
+        attempts = ScheduledMessage.attempts + 1
+        result = await session.execute(
+            update(ScheduledMessage)
+            .where(ScheduledMessage.id.in_(failed_ids))
+            .values(
+                attempts=attempts,
+                failed_at=case(
+                    (attempts >= settings.SCHEDULER_MAX_ATTEMPTS, int(time.time())),
+                    else_=None,
+                ),
+            )
+            .returning(ScheduledMessage.id, ScheduledMessage.failed_at)
+            .execution_options(synchronize_session=False)
+        )
+        return [scheduled_id for scheduled_id, failed_at in result if failed_at is not None]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            try:
+                if now >= self.loaded_until:
+                    await self._load(now)
+                due_ids = []
+                while self.heap and self.heap[0][0] <= now:
+                    due_ids.append(heapq.heappop(self.heap)[1])
+                if due_ids:
+                    await self._send_due(due_ids)
+            except Exception as e:
+                self.stats.last_error = str(e)
+                logging.error(f"Message scheduler failed: {e}")
+                # read the window again, it holds the messages popped meanwhile
+                self.loaded_until = now + settings.SCHEDULER_RETRY_SECONDS
+            next_at = min(self.heap[0][0], self.loaded_until) if self.heap else self.loaded_until
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(next_at - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, send: Callable[[ScheduledMessage], Awaitable[None]]):
+        if self._task is None:
+            self.send = send
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop sending. Loaded messages stay in the database for the next start.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.heap.clear()
+        self.loaded.clear()
+        self.loaded_until = 0.0
+
+
+message_scheduler = MessageScheduler()
@@ -1,27 +1,41 @@
 import logging
+import uuid
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
-from jose import jwt
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core import settings
 from app.db.models import User
 
-ph = PasswordHasher()
+# argon2 and jose are imported lazily to keep them off the app import path;
+# the startup warm-up imports them before the app reports ready.
+
+REFRESH_TOKEN_TYPE = "refresh"
+
+
+@lru_cache(maxsize=1)
+def get_password_hasher():
+    """
+    Get the shared Argon2 password hasher.
+    """
+    from argon2 import PasswordHasher
+
+    return PasswordHasher()
 
 def hash_password(password: str) -> str:
     """
     Hash a password using Argon2.
     """
-    return ph.hash(password)
+    return get_password_hasher().hash(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
     """
     Verify a password against a hashed password.
     """
+    from argon2.exceptions import VerifyMismatchError
+
     try:
-        ph.verify(hashed_password, password)
+        get_password_hasher().verify(hashed_password, password)
         return True
     except VerifyMismatchError:
         return False
@@ -33,11 +47,62 @@ def create_access_token(data: dict) -> str:
     """
     Create access token
     """
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
+def create_refresh_token(data: dict, family: str | None = None) -> tuple[str, dict]:
+    """
+    Create refresh token, returned with its claims. Tokens rotated from the
+    same login share its family id, so reuse of a rotated token can revoke
+    the whole chain.
+    """
+    from jose import jwt
+
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    token_id = uuid.uuid4().hex
+    to_encode.update(
+        {
+            "exp": int(expire.timestamp()),
+            "type": REFRESH_TOKEN_TYPE,
+            "jti": token_id,
+            "fam": family or token_id,
+        }
+    )
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM), to_encode
+
+def _decode_token(token: str) -> dict | None:
+    from jose import jwt, JWTError
+
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError as e:
+        logging.error(f"JWTError: {e}")
+        return None
+
+def decode_access_token(token: str) -> dict | None:
+    """
+    Decode and verify access token. Returns None if the token is invalid.
+    """
+    payload = _decode_token(token)
+    if payload is None or payload.get("type") == REFRESH_TOKEN_TYPE:
+        return None
+    return payload
+
+def decode_refresh_token(token: str) -> dict | None:
+    """
+    Decode and verify refresh token. Returns None if the token is invalid.
+    Revocation is checked by the caller.
+    """
+    payload = _decode_token(token)
+    if payload is None or payload.get("type") != REFRESH_TOKEN_TYPE:
+        return None
+    return payload
+
 async def authenticate_user(session: AsyncSession, email: str, password: str) -> User | None:
     """
     Authenticate a user by email and password.
@@ -47,4 +112,4 @@ async def authenticate_user(session: AsyncSession, email: str, password: str) ->
     user = result.scalars().first()
     if not user or not verify_password(password, user.hashed_password):
         return None
-    return user
\ No newline at end of file
+    return user
@@ -0,0 +1,125 @@
+import uuid
+from typing_extensions import TypedDict
+from fastapi import Response
+from pydantic import TypeAdapter
+from sqlalchemy import Select, select
+from app.db.models import Chat, Message, ReactionCount
+from app.schemas import ClientFrame
+
+
+class ChatRow(TypedDict):
+    "Serialization-only mirror of ChatRead, keys in the same order"
+    name: str
+    is_group: bool
+    id: int
+
+
+class MessageRow(TypedDict):
+    "Serialization-only mirror of MessageResponse, keys in the same order"
+    chat_id: int
+    sender_id: int
+    text: str
+    client_message_id: uuid.UUID
+    attachment_id: int | None
+    id: int
+    timestamp: int
+    is_read: bool
+    reactions: dict[str, int]
+
+
+class SenderRow(TypedDict):
+    "Serialization-only mirror of SenderProfile"
+    id: int
+    name: str
+
+
+class ExpandedMessageRow(MessageRow):
+    "Serialization-only mirror of MessageExpanded"
+    sender: SenderRow | None
+
+
+class HistoryBatchRow(TypedDict):
+    "Serialization-only mirror of HistoryBatchPage"
+    chat_id: int
+    messages: list[MessageRow]
+    next_cursor: str | None
+
+
+CHAT_COLUMNS = (Chat.name, Chat.is_group, Chat.id)
+MESSAGE_COLUMNS = (
+    Message.chat_id,
+    Message.sender_id,
+    Message.text,
+    Message.client_message_id,
+    Message.attachment_id,
+    Message.id,
+    Message.timestamp,
+    Message.is_read,
+)
+
+chat_rows_adapter = TypeAdapter(list[ChatRow])
+message_rows_adapter = TypeAdapter(list[MessageRow])
+expanded_message_rows_adapter = TypeAdapter(list[ExpandedMessageRow])
+history_batch_row_adapter = TypeAdapter(HistoryBatchRow)
+# parses a raw WebSocket frame straight into the frame model of its command
+client_frame_adapter = TypeAdapter(ClientFrame)
+
+
+def with_reactions(page) -> Select:
+    """
+    Rows of page, a subquery of MESSAGE_COLUMNS, outer joined with the
+    reaction counts of each message: one row per emoji, or one without
+    reactions. Order them by message and merge them with fold_reaction.
+    """
+    return select(
+        *(page.c[column.key] for column in MESSAGE_COLUMNS),
+        ReactionCount.emoji.label("reaction_emoji"),
+        ReactionCount.count.label("reaction_count"),
+    ).outerjoin(ReactionCount, ReactionCount.message_id == page.c.id)
+
+
+def history_page_stmt(chat_id: int, limit: int, offset: int) -> Select:
+    """
+    A page of the history of a chat, oldest first, with_reactions.
+    """
+    page = (
+        select(*MESSAGE_COLUMNS)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.timestamp.asc())
+        .offset(offset)
+        .limit(limit)
+        .subquery()
+    )
+    return with_reactions(page).order_by(page.c.timestamp, page.c.id)
+
+
+def fold_reaction(messages: list[dict], row: dict):
+    """
+    Append a row of a with_reactions select to messages, or add its count
+    to the last message when the row is another emoji of it.
+    """
+    emoji, count = row.pop("reaction_emoji"), row.pop("reaction_count")
+    if messages and messages[-1]["id"] == row["id"]:
+        message = messages[-1]
+    else:
+        message = row
+        message["reactions"] = {}
+        messages.append(message)
+    if emoji is not None:
+        message["reactions"][emoji] = count
+
+
+def rows_to_dicts(result) -> list[dict]:
+    """
+    Turn a column-select result into plain dicts for the row adapters.
+    """
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def json_response(content: bytes, headers: dict[str, str] | None = None) -> Response:
+    """
+    Response for pre-serialized JSON. FastAPI returns it as is, skipping
+    response_model validation, so rows must come from trusted DB columns.
+    """
+    return Response(content=content, media_type="application/json", headers=headers)
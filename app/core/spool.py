@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from itertools import islice
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.core.config import settings
+from app.core.logs import log_event
+from app.core.tasks import task_queue
+from app.core.versions import version_tracker
+from app.core.websocket import ws_manager
+from app.db.base import AsyncLocalSession, insert_ignore
+from app.db.models import Message
+from app.db.routing import replica_router
+from app.db.sharding import shard_router
+from app.schemas import MessageStored
+
+# errors meaning the database does not take writes right now
+DATABASE_UNAVAILABLE = (OperationalError, InterfaceError, PoolTimeoutError, OSError, TimeoutError)
+
+
+class SpoolFullError(Exception):
+    "The spool file reached MESSAGE_SPOOL_MAX_BYTES."
+
+
+class SpoolStats:
+    "Counters of the spool since the process started."
+
+    def __init__(self):
+        self.spooled = 0
+        self.recovered = 0
+        self.stored = 0
+        self.dropped = 0
+        self.fsyncs = 0
+        self.last_error: str | None = None
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+async def deliver_stored(notification: MessageStored):
+    await ws_manager.send_to_chat(notification.model_dump_json(), notification.chat_id)
+
+
+class MessageSpool:
+    """
+    Append-only local file taking messages while the database stalls.
+
+    A message counts as sent once its line is on disk. Appends queue their
+    line and wait for the next fsync, one fsync covers every line queued
+    meanwhile, so concurrent senders share it. A flusher inserts spooled
+    messages into messages in spool order once the database answers again,
+    skipping client_message_ids already stored: replaying after a crash, or
+    a message whose commit landed after it was spooled, stores it once. The
+    chat is then told the id with MESSAGE_STORED. The file is truncated once
+    everything in it is stored, and replayed on startup.
+    """
+
+    def __init__(self):
+        # spooled and on disk, not yet stored, in spool order
+        self.pending: deque[dict] = deque()
+        # client_message_id of pending and queued messages
+        self.pending_ids: set[str] = set()
+        # bytes in the file, queued lines included
+        self.size = 0
+        self.stats = SpoolStats()
+        self._file = None
+        # (record, line, future) waiting for the writer
+        self._queue: list[tuple[dict, bytes, asyncio.Future]] = []
+        self._writer: asyncio.Task | None = None
+        self._flusher: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        # held while the file is written or truncated
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def has_pending(self) -> bool:
+        """
+        True while messages are spooled or being spooled. New messages must
+        be spooled too meanwhile, to be stored after them.
+        """
+        return bool(self.pending or self._queue)
+
+    def is_pending(self, client_message_id: str) -> bool:
+        return client_message_id in self.pending_ids
+
+    async def append(self, record: dict):
+        """
+        Spool a message record and return once it is on disk. Raises
+        SpoolFullError when there is no room, OSError when the write failed.
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        if self.size + len(line) > settings.MESSAGE_SPOOL_MAX_BYTES:
+            raise SpoolFullError()
+        self.size += len(line)
+        self.pending_ids.add(record["client_message_id"])
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((record, line, future))
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+        await future
+
+    def _write_sync(self, data: bytes):
+        # not tell(): truncating after a drain leaves the offset where it was
+        position = os.fstat(self._file.fileno()).st_size
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            # a torn line would corrupt the next one
+            self._file.truncate(position)
+            raise
+
+    async def _write(self):
+        try:
+            while self._queue:
+                try:
+                    async with self._lock:
+                        # taken under the lock, so queued lines count as
+                        # pending until they are written
+                        batch, self._queue = self._queue, []
+                        data = b"".join(line for _, line, _ in batch)
+                        await asyncio.to_thread(self._write_sync, data)
+                except OSError as e:
+                    logging.error(f"Failed to write message spool: {e}")
+                    self.stats.last_error = str(e)
+                    for record, line, future in batch:
+                        self.size -= len(line)
+                        self.pending_ids.discard(record["client_message_id"])
+                        future.set_exception(e)
+                    continue
+                self.stats.fsyncs += 1
+                self.stats.spooled += len(batch)
+                # in file order, before any sender resumes
+                self.pending.extend(record for record, _, _ in batch)
+                for _, _, future in batch:
+                    future.set_result(None)
+                self._wakeup.set()
+        finally:
+            self._writer = None
+
+    async def _store(self, records: list[dict]) -> list[tuple[dict, int]]:
+        """
+        Insert records, skipping client_message_ids already stored, and
+        return each record with its message id.
+        """
+        async with AsyncLocalSession() as fence:
+            shards = {}
+            if shard_router.enabled:
+                # the chats stay locked until the inserts are committed, so
+                # a chat being moved is written to its new shard
+                chat_ids = {record["chat_id"] for record in records}
+                shards = await shard_router.lock_placement(fence, chat_ids)
+            groups: dict[int | None, list[dict]] = {}
+            for record in records:
+                groups.setdefault(shards.get(record["chat_id"]), []).append(record)
+            stored = []
+            for shard, group in groups.items():
+                stored += await self._store_group(shard, group)
+        return stored
+
+    async def _store_group(self, shard: int | None, group: list[dict]) -> list[tuple[dict, int]]:
+        rows = []
+        for record in group:
+            row = {**record, "client_message_id": uuid.UUID(record["client_message_id"])}
+            if shard is not None:
+                row["id"] = await shard_router.allocate_message_id()
+            rows.append(row)
+        sessionmaker = shard_router.sessionmakers[shard] if shard is not None else AsyncLocalSession
+        async with sessionmaker() as session:
+            stmt = insert_ignore(Message.__table__, session.bind.dialect.name)
+            try:
+                await session.execute(stmt, rows)
+            except IntegrityError:
+                # e.g. the chat was deleted meanwhile, keep the others
+                await session.rollback()
+                rows = await self._store_one_by_one(session, stmt, rows)
+            ids_stmt = select(Message.client_message_id, Message.id).where(
+                Message.client_message_id.in_([row["client_message_id"] for row in rows])
+            )
+            ids = dict((await session.execute(ids_stmt)).all())
+            await version_tracker.commit_with_bump(session, {row["chat_id"] for row in rows})
+        stored = []
+        for record in group:
+            message_id = ids.get(uuid.UUID(record["client_message_id"]))
+            if message_id is not None:
+                stored.append((record, message_id))
+        return stored
+
+    async def _store_one_by_one(self, session, stmt, rows: list[dict]) -> list[dict]:
+        kept = []
+        for row in rows:
+            try:
+                async with session.begin_nested():
+                    await session.execute(stmt, [row])
+                kept.append(row)
+            except IntegrityError as e:
+                self.stats.dropped += 1
+                log_event(
+                    "spool.dropped",
+                    logging.ERROR,
+                    chat_id=row["chat_id"],
+                    sender_id=row["sender_id"],
+                    error=str(e.orig),
+                )
+        return kept
+
+    async def _announce(self, stored: list[tuple[dict, int]]):
+        chat_ids = {record["chat_id"] for record, _ in stored}
+        replica_router.mark_write(chat_ids=chat_ids)
+        for record, message_id in stored:
+            notification = MessageStored(
+                chat_id=record["chat_id"],
+                client_message_id=record["client_message_id"],
+                id=message_id,
+            )
+            await task_queue.enqueue(
+                "message.stored_notification",
+                deliver_stored,
+                notification,
+                key=record["chat_id"],
+            )
+
+    async def _drain(self):
+        while self.pending:
+            batch = list(islice(self.pending, settings.MESSAGE_SPOOL_BATCH_SIZE))
+            try:
+                stored = await self._store(batch)
+            except DATABASE_UNAVAILABLE as e:
+                self.stats.last_error = str(e)
+                logging.warning(f"Database unavailable, {len(self.pending)} messages stay spooled: {e}")
+                await asyncio.sleep(settings.MESSAGE_SPOOL_RETRY_SECONDS)
+                continue
+            for _ in batch:
+                record = self.pending.popleft()
+                self.pending_ids.discard(record["client_message_id"])
+            self.stats.stored += len(stored)
+            await self._announce(stored)
+        async with self._lock:
+            if not self.has_pending():
+                await asyncio.to_thread(self._file.truncate, 0)
+                self.size = 0
+
+    async def _flush_when_woken(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._drain()
+            except Exception as e:
+                self.stats.last_error = str(e)
+                logging.error(f"Failed to drain message spool: {e}")
+                await asyncio.sleep(settings.MESSAGE_SPOOL_RETRY_SECONDS)
+                self._wakeup.set()
+
+    def _recover(self, path: str):
+        """
+        Load the records left in the file by the previous run. A line torn
+        by a crash can only be the last one, it is cut off.
+        """
+        if not os.path.exists(path):
+            return
+        end = 0
+        with open(path, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                end += len(line)
+                if record["client_message_id"] not in self.pending_ids:
+                    self.pending.append(record)
+                    self.pending_ids.add(record["client_message_id"])
+        if end != os.path.getsize(path):
+            logging.warning(f"Cutting torn record off message spool {path}")
+            os.truncate(path, end)
+        self.size = end
+        self.stats.recovered = len(self.pending)
+
+    def start(self):
+        if settings.MESSAGE_SPOOL_PATH is None or self._file is not None:
+            return
+        self._recover(settings.MESSAGE_SPOOL_PATH)
+        self._file = open(settings.MESSAGE_SPOOL_PATH, "ab")
+        self._flusher = asyncio.create_task(self._flush_when_woken())
+        if self.pending:
+            logging.info(f"Recovered {len(self.pending)} spooled messages")
+            self._wakeup.set()
+
+    async def stop(self):
+        """
+        Finish the write in progress. Messages not stored yet stay in the
+        file for the next start.
+        """
+        if self._writer:
+            await asyncio.gather(self._writer, return_exceptions=True)
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+message_spool = MessageSpool()
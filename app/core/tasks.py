@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+from app.core.config import settings
+from app.core.logs import log_event
+
+
+class TaskStats:
+    "Counters of one task type since the process started."
+
+    def __init__(self):
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        # enqueues that had to wait for room in a full queue
+        self.blocked = 0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def to_dict(self) -> dict:
+        stats = dict(vars(self))
+        stats["pending"] = self.enqueued - self.completed - self.failed
+        return stats
+
+
+class TaskQueue:
+    """
+    In-process queue for side effects that run after a write is committed,
+    such as WebSocket fan-out and event logging, so the caller only waits for
+    the durable write.
+
+    Tasks are spread over TASK_QUEUE_WORKERS workers, each with its own
+    bounded queue. Tasks with the same key always go to the same worker and
+    run in the order they were queued, e.g. the messages of a chat. When the
+    queue of a worker is full, enqueue waits for room, which slows down the
+    producers instead of buffering without limit. Before start and after stop
+    tasks run inline.
+    """
+
+    def __init__(self):
+        self.stats: dict[str, TaskStats] = {}
+        self._queues: list[asyncio.Queue] = []
+        self._workers: list[asyncio.Task] = []
+        self._next = 0
+
+    async def enqueue(
+        self,
+        name: str,
+        func: Callable[..., Awaitable],
+        *args,
+        key: Hashable | None = None,
+    ):
+        """
+        Queue func(*args) under the task type name.
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = TaskStats()
+        stats.enqueued += 1
+        if not self._workers:
+            await self._run(stats, name, func, args, time.perf_counter())
+            return
+        if key is None:
+            index = self._next
+            self._next = (index + 1) % len(self._queues)
+        else:
+            index = hash(key) % len(self._queues)
+        queue = self._queues[index]
+        if queue.full():
+            stats.blocked += 1
+        await queue.put((stats, name, func, args, time.perf_counter()))
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _run(self, stats: TaskStats, name: str, func, args, queued_at: float):
+        started = time.perf_counter()
+        stats.max_wait_seconds = max(stats.max_wait_seconds, started - queued_at)
+        try:
+            await func(*args)
+            stats.completed += 1
+        except Exception as e:
+            stats.failed += 1
+            log_event("task.failed", logging.ERROR, task=name, error=str(e))
+        finally:
+            stats.run_seconds += time.perf_counter() - started
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self._run(*item)
+            finally:
+                queue.task_done()
+
+    def to_dict(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "depth": self.depth(),
+            "tasks": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+    def start(self):
+        if self._workers:
+            return
+        workers = max(1, settings.TASK_QUEUE_WORKERS)
+        size = max(1, settings.TASK_QUEUE_SIZE // workers)
+        self._queues = [asyncio.Queue(size) for _ in range(workers)]
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """
+        Run the queued tasks for up to TASK_QUEUE_DRAIN_SECONDS, then stop the
+        workers. Tasks queued meanwhile run inline.
+        """
+        workers, self._workers = self._workers, []
+        if not workers:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                settings.TASK_QUEUE_DRAIN_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            logging.warning(f"Task queue not drained, {self.depth()} tasks dropped")
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues = []
+
+
+task_queue = TaskQueue()
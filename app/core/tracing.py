@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import heapq
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.core.config import settings
+from app.core.logs import log_event
+
+SLOWEST_STATEMENTS = 5
+PROFILE_FRAMES = 4
+PROFILE_TOP = 10
+
+current_trace: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+recent_traces: deque["Trace"] = deque(maxlen=settings.TRACE_BUFFER_SIZE)
+
+
+class Trace:
+    """
+    Spans and database queries of one HTTP request or WebSocket command.
+    Statements are kept without parameters.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status: int | None = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: list[tuple[str, float, float]] = []
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements: Counter[str] = Counter()
+        # min-heap of (duration, statement)
+        self.slowest: list[tuple[float, str]] = []
+        self.profile: Counter[str] = Counter()
+        self.flags: list[str] = []
+
+    def add_query(self, statement: str, duration: float):
+        self.queries += 1
+        self.db_time += duration
+        self.statements[statement] += 1
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (duration, statement))
+        else:
+            heapq.heappushpop(self.slowest, (duration, statement))
+
+    def repeated(self) -> list[tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= settings.TRACE_REPEATED_QUERY_THRESHOLD
+        ]
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        if self.queries > settings.TRACE_QUERY_BUDGET:
+            self.flags.append("query_budget")
+        if self.repeated():
+            self.flags.append("n_plus_one")
+        if self.duration >= settings.TRACE_SLOW_SECONDS:
+            self.flags.append("slow")
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1e3, 3),
+            "queries": self.queries,
+            "db_ms": round(self.db_time * 1e3, 3),
+            "flags": self.flags,
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": round(start * 1e3, 3),
+                    "duration_ms": round(duration * 1e3, 3),
+                }
+                for name, start, duration in self.spans
+            ],
+            "slowest": [
+                {"duration_ms": round(duration * 1e3, 3), "statement": statement}
+                for duration, statement in sorted(self.slowest, reverse=True)
+            ],
+            "repeated": [
+                {"statement": statement, "count": count}
+                for statement, count in self.repeated()
+            ],
+            "profile": [
+                {"stack": stack, "samples": samples}
+                for stack, samples in self.profile.most_common(PROFILE_TOP)
+            ],
+        }
+
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    Count the queries of an engine against the trace of the running request.
+    Costs one context variable lookup per query while no trace is active.
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_trace.get() is not None:
+            conn.info.setdefault("trace_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace.get()
+        starts = conn.info.get("trace_query_start")
+        if trace is not None and starts:
+            trace.add_query(statement, time.perf_counter() - starts.pop())
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a block as a span of the running trace, if any.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, start - trace.start, time.perf_counter() - start))
+
+
+def _suspended_frames(coro) -> list:
+    """
+    Frames of a suspended coroutine chain, outermost first. Task.get_stack
+    only returns the outermost frame of a coroutine.
+    """
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+def _format_stack(frames) -> str:
+    return " > ".join(
+        f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        for frame in frames[-PROFILE_FRAMES:]
+    )
+
+
+async def _profile(task: asyncio.Task, trace: Trace):
+    """
+    Sample where a slow task is suspended until the trace finishes.
+    """
+    await asyncio.sleep(settings.TRACE_SLOW_SECONDS)
+    while not task.done():
+        frames = _suspended_frames(task.get_coro())
+        if frames:
+            trace.profile[_format_stack(frames)] += 1
+        await asyncio.sleep(settings.TRACE_PROFILE_INTERVAL_SECONDS)
+
+
+def finish_trace(trace: Trace):
+    trace.finish()
+    if trace.flags:
+        repeated = trace.repeated()
+        log_event(
+            "trace.flagged",
+            logging.WARNING,
+            trace=trace.name,
+            flags=trace.flags,
+            queries=trace.queries,
+            db_ms=round(trace.db_time * 1e3, 3),
+            duration_ms=round(trace.duration * 1e3, 3),
+            repeated_statement=repeated[0][0] if repeated else None,
+        )
+    if trace.flags or random.random() < settings.TRACE_SAMPLE_RATE:
+        recent_traces.append(trace)
+
+
+@asynccontextmanager
+async def traced(name: str):
+    """
+    Trace the enclosed block. Yields None when tracing is disabled.
+    """
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+    trace = Trace(name)
+    token = current_trace.set(trace)
+    profiler = None
+    if settings.TRACE_PROFILE_SLOW:
+        profiler = asyncio.create_task(_profile(asyncio.current_task(), trace))
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        if profiler:
+            profiler.cancel()
+        finish_trace(trace)
+
+
+class TracingMiddleware:
+    """
+    Trace every HTTP request, named after the matched route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        async with traced(scope["path"]) as trace:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    trace.status = message["status"]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # the router stores the matched route in the scope
+                route = scope.get("route")
+                if route is not None:
+                    trace.name = f"{scope['method']} {route.path}"
+                else:
+                    trace.name = f"{scope['method']} {scope['path']}"
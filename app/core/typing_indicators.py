@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from app.core.config import settings
+from app.core.websocket import WebSocketManager, ws_manager
+from app.schemas import TypingNotification
+
+
+class TypingTracker:
+    """
+    Ephemeral "user is typing" state. Never touches the database.
+
+    Typing events are throttled per (user, chat). In chats with fewer than
+    TYPING_COALESCE_THRESHOLD online recipients each accepted event is fanned
+    out at once. In larger chats typing users are collected and one summary
+    frame per chat is sent every TYPING_SUMMARY_INTERVAL_SECONDS while the
+    set changes. Entries expire after TYPING_TTL_SECONDS, so memory is bounded
+    by the users currently typing.
+    """
+
+    def __init__(self, manager: WebSocketManager):
+        self.manager = manager
+        self.last_accepted: dict[tuple[int, int], float] = {}
+        # chat_id -> user_id -> expiry, only for coalesced chats
+        self.typing_users: dict[int, dict[int, float]] = {}
+        self.dirty: set[int] = set()
+        self._task: asyncio.Task | None = None
+
+    async def typing(self, user_id: int, chat_id: int):
+        now = time.monotonic()
+        key = (user_id, chat_id)
+        last = self.last_accepted.get(key)
+        if last is not None and now - last < settings.TYPING_THROTTLE_SECONDS:
+            return
+        self.last_accepted[key] = now
+        # connections of the chat other than the typing one
+        recipients = self.manager.online_count(chat_id) - 1
+        if recipients <= 0:
+            return
+        if recipients >= settings.TYPING_COALESCE_THRESHOLD:
+            self.typing_users.setdefault(chat_id, {})[user_id] = (
+                now + settings.TYPING_TTL_SECONDS
+            )
+            self.dirty.add(chat_id)
+            return
+        frame = TypingNotification(chat_id=chat_id, user_ids=[user_id])
+        await self.manager.send_to_chat(
+            frame.model_dump_json(), chat_id, exclude_user=user_id
+        )
+
+    def expire(self, now: float):
+        for chat_id in list(self.typing_users):
+            users = self.typing_users[chat_id]
+            expired = [user_id for user_id, expires in users.items() if expires <= now]
+            for user_id in expired:
+                del users[user_id]
+            if expired:
+                self.dirty.add(chat_id)
+        cutoff = now - settings.TYPING_TTL_SECONDS
+        stale = [key for key, accepted in self.last_accepted.items() if accepted <= cutoff]
+        for key in stale:
+            del self.last_accepted[key]
+
+    async def flush(self):
+        """
+        Send one summary frame per changed chat. An empty user list tells
+        clients that nobody is typing anymore.
+        """
+        self.expire(time.monotonic())
+        dirty, self.dirty = self.dirty, set()
+        for chat_id in dirty:
+            users = self.typing_users.get(chat_id, {})
+            if not users:
+                self.typing_users.pop(chat_id, None)
+            frame = TypingNotification(chat_id=chat_id, user_ids=sorted(users))
+            await self.manager.send_to_chat(frame.model_dump_json(), chat_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.TYPING_SUMMARY_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Typing summary flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+typing_tracker = TypingTracker(ws_manager)
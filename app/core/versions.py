@@ -0,0 +1,164 @@
+import time
+from fastapi import Request, Response, status
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import AsyncLocalSession, async_engine
+from app.db.models import Chat, User, UserChat
+
+CACHE_CONTROL = "private, no-cache"
+
+chats = Chat.__table__
+users = User.__table__
+
+
+class VersionTracker:
+    """
+    Version counters stored in the database, used to build ETags for polled
+    endpoints.
+
+    chats.version changes when the message pages of a chat change (new
+    messages, reads, reactions, deletions, a new name of a sender).
+    users.chats_version changes when the chat list of a user changes
+    (membership changes). Whichever process or CLI makes a change bumps the
+    counter, and endpoints read it from the session they read the data from,
+    so every worker answers with the same tag and none keeps answering 304
+    after a change made elsewhere.
+
+    Bump in the transaction of the change when it is written to the primary,
+    or right after its commit when it is written to a message shard. Rows
+    are bumped in id order, so concurrent bumps of several chats cannot
+    deadlock.
+    """
+
+    async def bump_chats(self, session: AsyncSession, chat_ids):
+        """
+        Bump chat versions in session, committed with it.
+        """
+        if chat_ids:
+            await session.execute(
+                update(chats)
+                .where(chats.c.id == bindparam("chat_id"))
+                .values(version=chats.c.version + 1),
+                [{"chat_id": chat_id} for chat_id in sorted(set(chat_ids))],
+            )
+
+    async def bump_chats_committed(self, chat_ids):
+        """
+        Bump chat versions in a transaction of their own. Call after the
+        change is committed.
+        """
+        if chat_ids:
+            async with AsyncLocalSession() as session:
+                await self.bump_chats(session, chat_ids)
+                await session.commit()
+
+    async def commit_with_bump(
+        self, message_session: AsyncSession, chat_ids, session: AsyncSession | None = None
+    ):
+        """
+        Commit a change of messages and bump the versions of their chats: in
+        the same transaction when message_session is on the primary, right
+        after its commit when it is on a message shard, through session if
+        given or a session of its own.
+        """
+        if message_session.bind is async_engine:
+            await self.bump_chats(message_session, chat_ids)
+            await message_session.commit()
+            return
+        await message_session.commit()
+        if session is None:
+            await self.bump_chats_committed(chat_ids)
+        else:
+            await self.bump_chats(session, chat_ids)
+            await session.commit()
+
+    async def bump_user_chats(self, session: AsyncSession, user_id: int):
+        """
+        Bump the versions of every chat of a user, e.g. after a profile
+        change shown in expanded history.
+        """
+        member_of = select(UserChat.chat_id).where(UserChat.user_id == user_id)
+        chat_ids = (await session.execute(member_of)).scalars().all()
+        await self.bump_chats(session, chat_ids)
+
+    async def bump_users(self, session: AsyncSession, *user_ids: int):
+        """
+        Bump chat list versions in session, committed with it.
+        """
+        if user_ids:
+            await session.execute(
+                update(users)
+                .where(users.c.id == bindparam("user_id"))
+                .values(chats_version=users.c.chats_version + 1),
+                [{"user_id": user_id} for user_id in sorted(set(user_ids))],
+            )
+
+    async def chats_version(self, session: AsyncSession, user_id: int) -> int | None:
+        """
+        Chat list version of a user, None if the user does not exist.
+        """
+        stmt = select(User.chats_version).where(User.id == user_id)
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    def chat_etag(self, chat_id: int, version: int, *parts) -> str:
+        """
+        Strong ETag for a message page of a chat. Read the version before
+        running the query: a concurrent commit can then only make the tag
+        stale, never attach an old tag to new data.
+        """
+        suffix = "".join(f"-{part}" for part in parts)
+        return f'"c{chat_id}-{version}{suffix}"'
+
+    def user_etag(self, user_id: int, version: int) -> str:
+        """
+        Strong ETag for the chat list of a user.
+        """
+        return f'"u{user_id}-{version}"'
+
+
+def profile_period() -> int:
+    """
+    Part of the ETag of pages with sender profiles. Profiles are cached per
+    process for PROFILE_CACHE_TTL_SECONDS, so the tag changes once per TTL
+    and a page cached before a profile change elsewhere is not kept longer
+    than the profile cache itself.
+    """
+    return int(time.time() // settings.PROFILE_CACHE_TTL_SECONDS)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Check the If-None-Match header against an ETag (weak comparison, RFC 9110).
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def etag_headers(etag: str) -> dict[str, str]:
+    """
+    Caching headers sent with every response of a versioned endpoint.
+    """
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Empty 304 response carrying the current ETag.
+    """
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag)
+    )
+
+
+version_tracker = VersionTracker()
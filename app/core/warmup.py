@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import uuid
+from contextlib import AsyncExitStack
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.core import settings
+from app.core.security import get_password_hasher, create_access_token, decode_access_token
+from app.core.serialization import (
+    CHAT_COLUMNS,
+    chat_rows_adapter,
+    message_rows_adapter,
+    history_page_stmt,
+)
+from app.db.models import Chat, Message, User, UserChat
+from app.schemas import MessageCreate, MessageResponse
+
+# Mirrors of the statements run on every request. Running them once per pooled
+# connection fills the SQLAlchemy compiled cache and the driver's per-connection
+# prepared statement cache. Keep them in sync with the endpoints.
+HOT_STATEMENTS = (
+    lambda: select(User).where(User.email == ""),
+    lambda: select(UserChat).where(UserChat.chat_id == -1, UserChat.user_id == -1),
+    lambda: select(*CHAT_COLUMNS).select_from(Chat).join(UserChat).where(UserChat.user_id == -1),
+    lambda: history_page_stmt(-1, 1, 0),
+    lambda: select(Chat).where(Chat.id == -1),
+    lambda: select(Message).where(Message.client_message_id == uuid.UUID(int=0)),
+    lambda: select(Message).where(Message.id == -1),
+    lambda: select(UserChat).where(UserChat.chat_id == -1),
+)
+
+RETRY_DELAY_SECONDS = 2.0
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+class Readiness:
+    "Startup state reported by the readiness probe"
+
+    def __init__(self):
+        self.warmed = False
+        self.warmed_connections = 0
+
+
+readiness = Readiness()
+
+
+async def warm_up_pool(engine: AsyncEngine, connections: int) -> int:
+    """
+    Open connections at the same time so the pool keeps all of them, and run
+    the hot statements on each one. Returns the number of connections warmed.
+    """
+    async with AsyncExitStack() as stack:
+        opened = [
+            await stack.enter_async_context(engine.connect())
+            for _ in range(max(connections, 1))
+        ]
+        for connection in opened:
+            await connection.execute(text("SELECT 1"))
+            for build_statement in HOT_STATEMENTS:
+                await connection.execute(build_statement())
+            await connection.rollback()
+        return len(opened)
+
+
+def warm_up_caches():
+    """
+    Import lazily loaded modules and build serializers before the first request.
+    """
+    get_password_hasher()
+    decode_access_token(create_access_token({"sub": "warmup"}))
+    chat_rows_adapter.dump_json([])
+    message_rows_adapter.dump_json([])
+    MessageCreate.model_json_schema()
+    MessageResponse.model_json_schema()
+
+
+async def warm_up(engine: AsyncEngine):
+    """
+    Warm up the connection pool and caches, then mark the app ready.
+    """
+    warm_up_caches()
+    connections = min(settings.DB_WARMUP_CONNECTIONS, settings.DB_POOL_SIZE)
+    readiness.warmed_connections = await warm_up_pool(engine, connections)
+    readiness.warmed = True
+    logging.info(f"Warm-up finished with {readiness.warmed_connections} connections")
+
+
+async def warm_up_until_ready(engine: AsyncEngine):
+    """
+    Retry warm-up with backoff until the database is reachable.
+    """
+    delay = RETRY_DELAY_SECONDS
+    while not readiness.warmed:
+        try:
+            await warm_up(engine)
+        except Exception as e:
+            logging.error(f"Warm-up failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+
+
+async def check_database(engine: AsyncEngine) -> bool:
+    """
+    Check that the database answers within the readiness timeout.
+    """
+    try:
+        async with asyncio.timeout(settings.READINESS_TIMEOUT_SECONDS):
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logging.warning(f"Readiness check failed: {e}")
+        return False
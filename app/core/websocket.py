@@ -1,51 +1,235 @@
+import asyncio
 import logging
-import json
-from fastapi import WebSocket
+import time
+from collections import deque
+from fastapi import WebSocket, status
+from app.core.config import settings
+from app.core.revocation import revocation_list
+
+
+class Connection:
+    """
+    State of one open WebSocket.
+
+    Outgoing messages are queued in outbox and written by a sender task that
+    only exists while the queue is not empty, so an idle connection holds no
+    task, no buffer and no database session, only this record.
+    """
+
+    __slots__ = (
+        "websocket",
+        "user_id",
+        "chats",
+        "outbox",
+        "sender",
+        "connected_at",
+        "last_seen",
+        "expires_at",
+        "family",
+        "expand",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        chats: set[int],
+        expires_at: int | None = None,
+        expand: bool = False,
+        family: str | None = None,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # subscriptions, the set is shared by the connections of the user
+        self.chats = chats
+        self.outbox: deque[str] | None = None
+        self.sender: asyncio.Task | None = None
+        # time.monotonic() of the connect and of the last received frame
+        self.connected_at = self.last_seen = time.monotonic()
+        # unix time the token expires, renewed in-band by AUTH
+        self.expires_at = expires_at
+        # token family, revoking it ends the connection
+        self.family = family
+        # receives messages with the sender profile
+        self.expand = expand
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    def revoked(self) -> bool:
+        return revocation_list.is_revoked(self.family)
+
 
 class WebSocketManager:
-    
+    """
+    Registry of open WebSockets, indexed by user and by chat room.
+
+    Rooms hold the online connections of a chat, so fan-out only touches
+    subscribers that are actually connected. Rooms are filled on connect from
+    the chats of the user and kept in sync through join/leave on membership
+    changes. All add/remove operations are set operations.
+
+    Sending only queues the message on each connection, a slow client delays
+    nobody else. A connection with more than WS_OUTBOX_SIZE messages waiting
+    is closed, and so is a connection whose token expired or was revoked
+    since its last command, instead of receiving the message.
+    """
+
     def __init__(self):
-        self.active_connections: dict[int, list[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, user_id: int):
+        self.active_connections: dict[int, set[Connection]] = {}
+        # chats of online users
+        self.user_chats: dict[int, set[int]] = {}
+        # online connections by chat
+        self.rooms: dict[int, set[Connection]] = {}
+        # closes of lagging connections, referenced until done
+        self.closing: set[asyncio.Task] = set()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        chat_ids=(),
+        expires_at: int | None = None,
+        expand: bool = False,
+        family: str | None = None,
+    ) -> Connection:
         await websocket.accept()
         if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            user_connections = self.active_connections[user_id]
-            if websocket in user_connections:
-                user_connections.remove(websocket)
-                if not user_connections:
-                    del self.active_connections[user_id]
-
-    async def send_to_chat(self, message: str, user_ids: list[int]):
-        """
-        Sends a message to all users in a chat. Send yourself as confirmation.
-        """
-        for user_id in user_ids:
-            if user_id in self.active_connections:
-                websockets = self.active_connections[user_id]
-                for connection in list(websockets):
-                    try:
-                        await connection.send_text(message)
-                    except Exception as e:
-                        logging.error(f"Error sending message to user {user_id}: {e}. Removing connection.")
-                        self.disconnect(connection, user_id)
-    
+            self.active_connections[user_id] = set()
+            self.user_chats[user_id] = set(chat_ids)
+        connection = Connection(
+            websocket, user_id, self.user_chats[user_id], expires_at, expand, family
+        )
+        self.active_connections[user_id].add(connection)
+        for chat_id in connection.chats:
+            self.rooms.setdefault(chat_id, set()).add(connection)
+        return connection
+
+    def _remove_from_room(self, chat_id: int, connection: Connection):
+        room = self.rooms.get(chat_id)
+        if room is not None:
+            room.discard(connection)
+            if not room:
+                del self.rooms[chat_id]
+
+    def disconnect(self, connection: Connection):
+        user_id = connection.user_id
+        user_connections = self.active_connections.get(user_id)
+        if not user_connections or connection not in user_connections:
+            return
+        user_connections.discard(connection)
+        for chat_id in connection.chats:
+            self._remove_from_room(chat_id, connection)
+        if not user_connections:
+            del self.active_connections[user_id]
+            del self.user_chats[user_id]
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+        connection.outbox = None
+
+    def join(self, user_id: int, chat_id: int):
+        """
+        Subscribe the online connections of a user to a chat they joined.
+        """
+        if user_id not in self.active_connections:
+            return
+        self.user_chats[user_id].add(chat_id)
+        room = self.rooms.setdefault(chat_id, set())
+        room.update(self.active_connections[user_id])
+
+    def leave(self, user_id: int, chat_id: int):
+        """
+        Unsubscribe the online connections of a user from a chat they left.
+        """
+        if user_id not in self.active_connections:
+            return
+        self.user_chats[user_id].discard(chat_id)
+        for connection in self.active_connections[user_id]:
+            self._remove_from_room(chat_id, connection)
+
+    def is_chat_member(self, user_id: int, chat_id: int) -> bool:
+        """
+        Membership check against the in-memory subscriptions, without the DB.
+        """
+        return chat_id in self.user_chats.get(user_id, ())
+
+    def online_count(self, chat_id: int) -> int:
+        return len(self.rooms.get(chat_id, ()))
+
+    def wants_expanded(self, chat_id: int) -> bool:
+        return any(connection.expand for connection in self.rooms.get(chat_id, ()))
+
+    def send(self, connection: Connection, message: str):
+        """
+        Queue a message on a connection, starting its sender if idle.
+        """
+        if connection.expired() or connection.revoked():
+            self.disconnect(connection)
+            self._close_soon(
+                connection, status.WS_1008_POLICY_VIOLATION, "Token expired or revoked"
+            )
+            return
+        if connection.outbox is None:
+            connection.outbox = deque()
+        elif len(connection.outbox) >= settings.WS_OUTBOX_SIZE:
+            logging.warning(
+                f"User {connection.user_id} does not keep up with its messages. Closing connection."
+            )
+            self.disconnect(connection)
+            self._close_soon(connection, status.WS_1013_TRY_AGAIN_LATER)
+            return
+        connection.outbox.append(message)
+        if connection.sender is None:
+            connection.sender = asyncio.create_task(self._drain(connection))
+
+    async def _drain(self, connection: Connection):
+        try:
+            while connection.outbox:
+                await connection.websocket.send_text(connection.outbox.popleft())
+        except Exception as e:
+            logging.error(f"Error sending message to user {connection.user_id}: {e}. Removing connection.")
+            self.disconnect(connection)
+        finally:
+            connection.sender = None
+            connection.outbox = None
+
+    def _close_soon(self, connection: Connection, code: int, reason: str | None = None):
+        task = asyncio.create_task(self._close(connection, code, reason))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    async def _close(self, connection: Connection, code: int, reason: str | None = None):
+        try:
+            await connection.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def send_to_chat(
+        self,
+        message: str,
+        chat_id: int,
+        exclude_user: int | None = None,
+        expanded: str | None = None,
+    ):
+        """
+        Sends a message to the online members of a chat. Send yourself as confirmation.
+        Connections asking for expanded messages get expanded instead, if given.
+        """
+        for connection in list(self.rooms.get(chat_id, ())):
+            if connection.user_id != exclude_user:
+                if expanded is not None and connection.expand:
+                    self.send(connection, expanded)
+                else:
+                    self.send(connection, message)
+
     async def send_to_user(self, message: str, user_id: int):
         """
         Sends a read notification to a specific user.
         """
-        if user_id in self.active_connections:
-            websockets = self.active_connections[user_id]
-            for connection in list(websockets):
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logging.error(f"Error sending read notification to user {user_id}: {e}. Removing connection.")
-                    self.disconnect(connection, user_id)
+        for connection in list(self.active_connections.get(user_id, ())):
+            self.send(connection, message)
 
-ws_manager = WebSocketManager()
\ No newline at end of file
+ws_manager = WebSocketManager()
@@ -1,12 +1,67 @@
 import logging
 from typing import AsyncGenerator
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    async_sessionmaker,
+    AsyncSession,
+    AsyncEngine,
+)
 from app.core.config import settings
+from app.core.tracing import instrument_engine
 
 Base = declarative_base()
 
-async_engine = create_async_engine(settings.DATABASE_URL)
+
+def make_engine(url: str) -> AsyncEngine:
+    """
+    Create an async engine with the configured pool settings, instrumented
+    for tracing when enabled.
+    """
+    if url.startswith("sqlite"):
+        # SQLite picks its own pool class, which may not take sizing options
+        engine = create_async_engine(url)
+    else:
+        engine = create_async_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+    if settings.TRACING_ENABLED:
+        instrument_engine(engine)
+    return engine
+
+
+def insert_ignore(table, dialect_name: str):
+    """
+    INSERT statement that skips rows violating a unique constraint.
+    """
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    raise NotImplementedError(f"insert_ignore is not supported for {dialect_name}")
+
+
+def upsert(table, dialect_name: str, update_columns: list[str]):
+    """
+    INSERT statement that overwrites update_columns of the row with the same
+    primary key instead of failing.
+    """
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(table)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(table)
+    else:
+        raise NotImplementedError(f"upsert is not supported for {dialect_name}")
+    return stmt.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={name: stmt.excluded[name] for name in update_columns},
+    )
+
+
+async_engine = make_engine(settings.DATABASE_URL)
 
 AsyncLocalSession = async_sessionmaker(
     bind=async_engine,
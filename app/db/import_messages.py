@@ -0,0 +1,275 @@
+"""
+Bulk import of message history from a JSONL file.
+
+    python -m app.db.import_messages FILE [--batch-size N] [--restart]
+
+Each line is a JSON object with the fields of MessageImport: chat_id,
+sender_id, text, client_message_id and optionally timestamp, is_read and
+attachment_id. Lines are validated and written in batches, on PostgreSQL
+through COPY into a staging table, elsewhere with multi-row inserts.
+Messages whose client_message_id already exists are skipped, so a file can be
+imported more than once. Invalid lines and lines referring to unknown chats,
+users or attachments are appended to FILE.rejected with the reason.
+
+After every batch the byte offset reached is saved to FILE.checkpoint. A
+crashed or interrupted import continues from there when run again, batches
+written before the crash are deduplicated. Memory use is bounded by one
+batch whatever the size of the file.
+
+The versions of the chats written to are bumped with every batch, so the
+app serves fresh history pages instead of 304s to clients holding old ones.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from pydantic import ValidationError
+from sqlalchemy import select, text
+from app.core.versions import version_tracker
+from app.db.base import AsyncLocalSession, insert_ignore
+from app.db.models import Attachment, Chat, Message, User
+from app.db.models.message import current_timestamp
+from app.db.sharding import shard_router
+from app.schemas import MessageImport
+
+BATCH_SIZE = 5000
+STAGING_TABLE = "message_import"
+
+
+def load_checkpoint(path: str, source: str) -> dict:
+    if not os.path.exists(path):
+        return {"source": source, "offset": 0, "line": 0, "imported": 0, "duplicates": 0, "rejected": 0}
+    with open(path) as file:
+        state = json.load(file)
+    if state["source"] != source:
+        raise SystemExit(f"{path} belongs to {state['source']}, pass --restart to start over")
+    return state
+
+
+def save_checkpoint(path: str, state: dict):
+    """
+    Replace the checkpoint atomically, so a crash leaves the old or the new one.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_batches(path: str, offset: int, line: int, batch_size: int):
+    """
+    Yield ([(line number, raw line)], offset after the batch, last line number).
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        batch = []
+        for raw in file:
+            offset += len(raw)
+            line += 1
+            if raw.strip():
+                batch.append((line, raw))
+            if len(batch) >= batch_size:
+                yield batch, offset, line
+                batch = []
+        if batch:
+            yield batch, offset, line
+
+
+def validate(batch: list) -> tuple[list, list]:
+    """
+    Parse a batch. Returns (line number, MessageImport) pairs with duplicate
+    client_message_ids dropped and (line number, reason, raw line) rejects.
+    """
+    messages, rejected, seen = [], [], set()
+    for line, raw in batch:
+        try:
+            message = MessageImport.model_validate_json(raw)
+        except ValidationError as e:
+            reasons = "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+            )
+            rejected.append((line, reasons, raw))
+            continue
+        if message.client_message_id in seen:
+            continue
+        seen.add(message.client_message_id)
+        messages.append((line, message))
+    return messages, rejected
+
+
+async def check_references(messages: list) -> tuple[list, list]:
+    """
+    Reject messages of unknown chats or senders and attachments of other chats,
+    with one query per kind for the whole batch.
+    """
+    chat_ids = {message.chat_id for _, message in messages}
+    sender_ids = {message.sender_id for _, message in messages}
+    attachment_ids = {message.attachment_id for _, message in messages if message.attachment_id}
+    async with AsyncLocalSession() as session:
+        chats = set((await session.execute(select(Chat.id).where(Chat.id.in_(chat_ids)))).scalars())
+        users = set((await session.execute(select(User.id).where(User.id.in_(sender_ids)))).scalars())
+        attachments = {}
+        if attachment_ids:
+            stmt = select(Attachment.id, Attachment.chat_id).where(Attachment.id.in_(attachment_ids))
+            attachments = dict((await session.execute(stmt)).all())
+    valid, rejected = [], []
+    for line, message in messages:
+        if message.chat_id not in chats:
+            rejected.append((line, f"chat {message.chat_id} not found", message))
+        elif message.sender_id not in users:
+            rejected.append((line, f"user {message.sender_id} not found", message))
+        elif message.attachment_id and attachments.get(message.attachment_id) != message.chat_id:
+            rejected.append((line, f"attachment {message.attachment_id} not found in this chat", message))
+        else:
+            valid.append(message)
+    return valid, rejected
+
+
+async def to_rows(messages: list) -> list[dict]:
+    now = current_timestamp()
+    rows = []
+    for message in messages:
+        row = message.model_dump()
+        if row["timestamp"] is None:
+            row["timestamp"] = now
+        message_id = await shard_router.allocate_message_id()
+        if message_id is not None:
+            row["id"] = message_id
+        rows.append(row)
+    return rows
+
+
+async def copy_rows(session, rows: list[dict]) -> int:
+    """
+    COPY rows into a staging table and move the new ones into messages.
+    """
+    columns = list(rows[0])
+    column_list = ", ".join(columns)
+    # the statement also starts the transaction the COPY below runs in
+    await session.execute(
+        text(
+            f"CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS "
+            f"SELECT {column_list} FROM messages WITH NO DATA"
+        )
+    )
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        STAGING_TABLE,
+        records=[tuple(row[column] for column in columns) for row in rows],
+        columns=columns,
+    )
+    result = await session.execute(
+        text(
+            f"INSERT INTO messages ({column_list}) SELECT {column_list} "
+            f"FROM {STAGING_TABLE} ON CONFLICT DO NOTHING"
+        )
+    )
+    return result.rowcount
+
+
+async def write_rows(session, rows: list[dict]) -> int:
+    """
+    Insert rows skipping existing client_message_ids. Returns the count written.
+    """
+    dialect_name = session.bind.dialect.name
+    if dialect_name == "postgresql":
+        inserted = await copy_rows(session, rows)
+    else:
+        stmt = insert_ignore(Message.__table__, dialect_name).returning(Message.__table__.c.id)
+        inserted = len((await session.execute(stmt, rows)).all())
+    # cached history pages of the chats are stale now, in every app process
+    await version_tracker.commit_with_bump(session, {row["chat_id"] for row in rows})
+    return inserted
+
+
+def store_session(shard: int | None):
+    if shard is None:
+        return AsyncLocalSession()
+    return shard_router.sessionmakers[shard]()
+
+
+async def import_batch(messages: list) -> int:
+    inserted = 0
+    async with AsyncLocalSession() as fence:
+        shards = {}
+        if shard_router.enabled:
+            # held until the rows are written, so a chat being moved is
+            # written to its new shard
+            chat_ids = {message.chat_id for message in messages}
+            shards = await shard_router.lock_placement(fence, chat_ids)
+        by_store = defaultdict(list)
+        for message in messages:
+            by_store[shards.get(message.chat_id)].append(message)
+        for shard, store_messages in by_store.items():
+            rows = await to_rows(store_messages)
+            async with store_session(shard) as session:
+                inserted += await write_rows(session, rows)
+    return inserted
+
+
+def write_rejects(file, rejected: list):
+    for line, reason, source in rejected:
+        if isinstance(source, MessageImport):
+            source = source.model_dump_json()
+        elif isinstance(source, bytes):
+            source = source.decode(errors="replace").rstrip("\n")
+        file.write(json.dumps({"line": line, "reason": reason, "row": source}) + "\n")
+    file.flush()
+
+
+async def import_file(path: str, batch_size: int, restart: bool):
+    source = os.path.realpath(path)
+    checkpoint_path = path + ".checkpoint"
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    state = load_checkpoint(checkpoint_path, source)
+    if state["offset"]:
+        logging.info(f"Resuming at line {state['line'] + 1}")
+    if shard_router.enabled:
+        await shard_router.load_overrides()
+    start = time.perf_counter()
+    with open(path + ".rejected", "a") as rejects:
+        for batch, offset, line in read_batches(path, state["offset"], state["line"], batch_size):
+            messages, rejected = validate(batch)
+            valid, missing = await check_references(messages)
+            rejected += missing
+            inserted = await import_batch(valid) if valid else 0
+            write_rejects(rejects, rejected)
+            state["offset"], state["line"] = offset, line
+            state["imported"] += inserted
+            state["duplicates"] += len(batch) - len(rejected) - inserted
+            state["rejected"] += len(rejected)
+            save_checkpoint(checkpoint_path, state)
+            rate = state["imported"] / max(time.perf_counter() - start, 1e-9)
+            logging.info(
+                f"Line {line}: {state['imported']} imported, {state['duplicates']} duplicates, "
+                f"{state['rejected']} rejected ({rate:.0f} messages/s)"
+            )
+    logging.info(f"Import of {path} finished")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import of messages from JSONL")
+    parser.add_argument("file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+    try:
+        await import_file(args.file, args.batch_size, args.restart)
+    finally:
+        await shard_router.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
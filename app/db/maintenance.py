@@ -0,0 +1,454 @@
+"""
+Retention and cleanup of old rows.
+
+    python -m app.db.maintenance run
+        Run every job once.
+    python -m app.db.maintenance retention
+        Delete messages older than MESSAGE_RETENTION_DAYS or the
+        retention_days of their chat.
+    python -m app.db.maintenance orphans
+        Delete chats nobody is a member of, with their messages and
+        attachments.
+    python -m app.db.maintenance tokens
+        Delete refresh token families and revocations that expired.
+    python -m app.db.maintenance uploads
+        Delete attachment uploads not resumed for
+        ATTACHMENT_UPLOAD_TTL_SECONDS with their part files.
+
+With MAINTENANCE_ENABLED the app runs every job each
+MAINTENANCE_INTERVAL_SECONDS instead. Rows are deleted in transactions of
+MAINTENANCE_BATCH_SIZE with a pause in between, so locks are short and the
+message write path keeps its share of the database.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+import anyio
+from sqlalchemy import select, delete, exists, func
+from app.core.config import settings
+from app.core.attachments import attachment_storage
+from app.core.logs import log_event
+from app.core.versions import version_tracker
+from app.db.base import AsyncLocalSession
+from app.db.models import (
+    Attachment,
+    AttachmentUpload,
+    Chat,
+    ChatShard,
+    Message,
+    Reaction,
+    ReactionCount,
+    RevokedToken,
+    ScheduledMessage,
+    TokenFamily,
+    UserChat,
+)
+from app.db.models.message import current_timestamp
+from app.db.routing import replica_router
+from app.db.sharding import shard_router
+
+DAY = 24 * 60 * 60
+JOBS = ("retention", "orphans", "tokens", "uploads")
+
+
+class MaintenanceStats:
+    "Progress counters of the maintenance jobs since the process started."
+
+    def __init__(self):
+        self.runs = 0
+        self.running_job: str | None = None
+        self.last_started_at: float | None = None
+        self.last_duration_seconds: float | None = None
+        self.last_error: str | None = None
+        self.batches = 0
+        self.messages_deleted = 0
+        self.chats_deleted = 0
+        self.attachments_deleted = 0
+        self.tokens_deleted = 0
+        self.uploads_deleted = 0
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def message_sessionmakers() -> list:
+    "Every database holding messages."
+    if shard_router.enabled:
+        return shard_router.sessionmakers
+    return [AsyncLocalSession]
+
+
+def chat_message_sessionmaker(chat_id: int):
+    "The database holding the messages of a chat."
+    if shard_router.enabled:
+        return shard_router.sessionmakers[shard_router.shard_for(chat_id)]
+    return AsyncLocalSession
+
+
+def unlink_files(paths: list):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def old_part_files(cutoff: int) -> dict:
+    "Part files not written to since cutoff, by upload id."
+    found = {}
+    for path in (attachment_storage.root / "uploads").glob("*.part"):
+        try:
+            upload_id = uuid.UUID(path.stem)
+            if path.stat().st_mtime < cutoff:
+                found[upload_id] = path
+        except (ValueError, FileNotFoundError):
+            continue
+    return found
+
+
+class Maintenance:
+    """
+    Batched deletes of expired messages, orphan chats and expired tokens.
+
+    Each batch is its own short transaction, followed by a pause. Chats that
+    lost messages get their history version bumped, so cached pages are not
+    served with deleted messages.
+    """
+
+    def __init__(self):
+        self.stats = MaintenanceStats()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def _pause(self):
+        await asyncio.sleep(settings.MAINTENANCE_BATCH_PAUSE_SECONDS)
+
+    async def delete_messages(self, sessionmaker, condition) -> int:
+        """
+        Delete messages matching condition batch by batch, with their
+        reactions. Returns the count.
+        """
+        deleted = 0
+        while True:
+            async with sessionmaker() as session:
+                batch_stmt = (
+                    select(Message.id)
+                    .where(condition)
+                    .limit(settings.MAINTENANCE_BATCH_SIZE)
+                )
+                # read once, a LIMIT without ORDER BY may pick other rows twice
+                batch = (await session.execute(batch_stmt)).scalars().all()
+                if not batch:
+                    return deleted
+                for model in (Reaction, ReactionCount):
+                    await session.execute(
+                        delete(model)
+                        .where(model.message_id.in_(batch))
+                        .execution_options(synchronize_session=False)
+                    )
+                result = await session.execute(
+                    delete(Message)
+                    .where(Message.id.in_(batch))
+                    .returning(Message.chat_id)
+                    .execution_options(synchronize_session=False)
+                )
+                chat_ids = result.scalars().all()
+                changed = set(chat_ids)
+                await version_tracker.commit_with_bump(session, changed)
+            if not chat_ids:
+                return deleted
+            replica_router.mark_write(chat_ids=changed)
+            deleted += len(chat_ids)
+            self.stats.batches += 1
+            self.stats.messages_deleted += len(chat_ids)
+            await self._pause()
+
+    async def expire_messages(self) -> int:
+        """
+        Delete messages past the retention of their chat.
+        """
+        now = current_timestamp()
+        default_days = settings.MESSAGE_RETENTION_DAYS
+        async with AsyncLocalSession() as session:
+            stmt = select(Chat.id, Chat.retention_days).where(
+                Chat.retention_days.is_not(None)
+            )
+            custom = (await session.execute(stmt)).all()
+        deleted = 0
+        if default_days is not None:
+            # chats keeping messages longer are left to the per-chat pass,
+            # chats with a shorter retention are finished there
+            keep_longer = [chat_id for chat_id, days in custom if days > default_days]
+            condition = Message.timestamp < now - default_days * DAY
+            if keep_longer:
+                condition = condition & Message.chat_id.not_in(keep_longer)
+            for sessionmaker in message_sessionmakers():
+                deleted += await self.delete_messages(sessionmaker, condition)
+        for chat_id, days in custom:
+            if days == default_days:
+                continue
+            condition = (Message.chat_id == chat_id) & (
+                Message.timestamp < now - days * DAY
+            )
+            deleted += await self.delete_messages(
+                chat_message_sessionmaker(chat_id), condition
+            )
+        return deleted
+
+    async def expire_tokens(self) -> int:
+        """
+        Delete token families and revocations whose tokens have all expired.
+        """
+        now = current_timestamp()
+        deleted = 0
+        for model in (TokenFamily, RevokedToken):
+            while True:
+                async with AsyncLocalSession() as session:
+                    batch = (
+                        select(model.id)
+                        .where(model.expires_at <= now)
+                        .limit(settings.MAINTENANCE_BATCH_SIZE)
+                    )
+                    result = await session.execute(
+                        delete(model)
+                        .where(model.id.in_(batch))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await session.commit()
+                if not result.rowcount:
+                    break
+                deleted += result.rowcount
+                self.stats.batches += 1
+                self.stats.tokens_deleted += result.rowcount
+                await self._pause()
+        return deleted
+
+    async def expire_uploads(self) -> int:
+        """
+        Delete uploads not resumed within ATTACHMENT_UPLOAD_TTL_SECONDS and
+        their part files, then part files left behind without an upload.
+        """
+        cutoff = current_timestamp() - settings.ATTACHMENT_UPLOAD_TTL_SECONDS
+        deleted = 0
+        while True:
+            async with AsyncLocalSession() as session:
+                batch = (
+                    select(AttachmentUpload.id)
+                    .where(
+                        AttachmentUpload.created_at < cutoff,
+                        func.coalesce(AttachmentUpload.claimed_until, 0) < cutoff,
+                    )
+                    .limit(settings.MAINTENANCE_BATCH_SIZE)
+                )
+                result = await session.execute(
+                    delete(AttachmentUpload)
+                    .where(AttachmentUpload.id.in_(batch))
+                    .returning(AttachmentUpload.id)
+                    .execution_options(synchronize_session=False)
+                )
+                upload_ids = result.scalars().all()
+                await session.commit()
+            if not upload_ids:
+                break
+            for upload_id in upload_ids:
+                attachment_storage.forget(upload_id)
+            paths = [attachment_storage.part_path(upload_id) for upload_id in upload_ids]
+            await anyio.to_thread.run_sync(unlink_files, paths)
+            deleted += len(upload_ids)
+            self.stats.batches += 1
+            self.stats.uploads_deleted += len(upload_ids)
+            await self._pause()
+        # e.g. a process stopped between deleting a row and its file
+        parts = await anyio.to_thread.run_sync(old_part_files, cutoff)
+        upload_ids = list(parts)
+        for start in range(0, len(upload_ids), settings.MAINTENANCE_BATCH_SIZE):
+            batch = upload_ids[start : start + settings.MAINTENANCE_BATCH_SIZE]
+            async with AsyncLocalSession() as session:
+                stmt = select(AttachmentUpload.id).where(AttachmentUpload.id.in_(batch))
+                live = set((await session.execute(stmt)).scalars().all())
+            stray = [parts[upload_id] for upload_id in batch if upload_id not in live]
+            await anyio.to_thread.run_sync(unlink_files, stray)
+        return deleted
+
+    async def _remove_attachments(self, session, chat_id: int) -> tuple[int, list, list]:
+        """
+        Delete the attachment rows of a chat inside the transaction removing
+        the chat. Returns their count, the stored files nobody else
+        references, to unlink before commit, and the upload parts, to unlink
+        after.
+        """
+        attachments = (
+            await session.execute(
+                delete(Attachment)
+                .where(Attachment.chat_id == chat_id)
+                .returning(Attachment.sha256)
+            )
+        ).scalars().all()
+        uploads = (
+            await session.execute(
+                delete(AttachmentUpload)
+                .where(AttachmentUpload.chat_id == chat_id)
+                .returning(AttachmentUpload.id)
+            )
+        ).scalars().all()
+        parts = [attachment_storage.part_path(upload_id) for upload_id in uploads]
+        for upload_id in uploads:
+            # in-memory hash state only, rebuilt from the part file if needed
+            attachment_storage.forget(upload_id)
+        objects = []
+        for sha256 in set(attachments):
+            # identical files are stored once, keep those still referenced
+            shared = await session.execute(
+                select(Attachment.id).where(Attachment.sha256 == sha256).limit(1)
+            )
+            if shared.scalar_one_or_none() is None:
+                objects.append(attachment_storage.object_path(sha256))
+        return len(attachments), objects, parts
+
+    async def remove_orphan_chats(self) -> int:
+        """
+        Delete chats without members: their messages on every database that
+        may hold them, scheduled messages, attachments, shard pin and finally
+        the chat row.
+        """
+        removed = 0
+        after_id = 0
+        while True:
+            async with AsyncLocalSession() as session:
+                stmt = (
+                    select(Chat.id)
+                    .where(
+                        Chat.id > after_id,
+                        ~exists().where(UserChat.chat_id == Chat.id),
+                    )
+                    .order_by(Chat.id)
+                    .limit(settings.MAINTENANCE_BATCH_SIZE)
+                )
+                orphan_ids = (await session.execute(stmt)).scalars().all()
+            if not orphan_ids:
+                return removed
+            for chat_id in orphan_ids:
+                sessionmakers = {chat_message_sessionmaker(chat_id), AsyncLocalSession}
+                for sessionmaker in sessionmakers:
+                    await self.delete_messages(sessionmaker, Message.chat_id == chat_id)
+                async with AsyncLocalSession() as session:
+                    await session.execute(
+                        delete(ScheduledMessage).where(ScheduledMessage.chat_id == chat_id)
+                    )
+                    attachments, objects, parts = await self._remove_attachments(
+                        session, chat_id
+                    )
+                    await session.execute(delete(ChatShard).where(ChatShard.chat_id == chat_id))
+                    result = await session.execute(
+                        delete(Chat).where(
+                            Chat.id == chat_id,
+                            ~exists().where(UserChat.chat_id == chat_id),
+                        )
+                    )
+                    if result.rowcount:
+                        # while the deleted rows are locked: an upload of the
+                        # same content completing meanwhile waits for them,
+                        # then stores its own copy (see upload_chunk)
+                        await anyio.to_thread.run_sync(unlink_files, objects)
+                        await session.commit()
+                        await anyio.to_thread.run_sync(unlink_files, parts)
+                        removed += 1
+                        self.stats.chats_deleted += 1
+                        self.stats.attachments_deleted += attachments
+                    else:
+                        await session.rollback()
+                await self._pause()
+            after_id = orphan_ids[-1]
+
+    async def _job(self, name: str, job) -> int:
+        self.stats.running_job = name
+        start = time.perf_counter()
+        count = await job()
+        log_event(
+            f"maintenance.{name}",
+            deleted=count,
+            duration_ms=round((time.perf_counter() - start) * 1e3, 3),
+        )
+        return count
+
+    async def run(self, jobs: tuple[str, ...] = JOBS):
+        """
+        Run the given jobs once. Skipped while a previous run is in progress.
+        """
+        if self._lock.locked():
+            return
+        async with self._lock:
+            self.stats.runs += 1
+            self.stats.last_started_at = time.time()
+            start = time.perf_counter()
+            try:
+                if "retention" in jobs:
+                    await self._job("retention", self.expire_messages)
+                if "orphans" in jobs:
+                    await self._job("orphans", self.remove_orphan_chats)
+                if "tokens" in jobs:
+                    await self._job("tokens", self.expire_tokens)
+                if "uploads" in jobs:
+                    await self._job("uploads", self.expire_uploads)
+                self.stats.last_error = None
+            except Exception as e:
+                logging.error(f"Maintenance run failed: {e}")
+                self.stats.last_error = str(e)
+            finally:
+                self.stats.running_job = None
+                self.stats.last_duration_seconds = time.perf_counter() - start
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(settings.MAINTENANCE_INTERVAL_SECONDS)
+            await self.run()
+
+    def start(self):
+        if settings.MAINTENANCE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+maintenance = Maintenance()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Retention and cleanup of old rows")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run")
+    commands.add_parser("retention")
+    commands.add_parser("orphans")
+    commands.add_parser("tokens")
+    commands.add_parser("uploads")
+    args = parser.parse_args()
+    jobs = JOBS if args.command == "run" else (args.command,)
+    try:
+        if shard_router.enabled:
+            await shard_router.load_overrides()
+        await maintenance.run(jobs)
+    finally:
+        await shard_router.stop()
+    stats = maintenance.stats
+    if stats.last_error:
+        raise SystemExit(stats.last_error)
+    logging.info(
+        f"Deleted {stats.messages_deleted} messages, {stats.chats_deleted} chats, "
+        f"{stats.attachments_deleted} attachments, {stats.tokens_deleted} tokens "
+        f"and {stats.uploads_deleted} uploads"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
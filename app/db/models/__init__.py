@@ -1,4 +1,9 @@
 from .user import User
 from .chat import Chat
 from .user_chats import UserChat
-from .message import Message
\ No newline at end of file
+from .message import Message
+from .chat_shard import ChatShard, IdSequence
+from .attachment import Attachment, AttachmentUpload
+from .token import TokenFamily, RevokedToken
+from .reaction import Reaction, ReactionCount
+from .scheduled_message import ScheduledMessage
\ No newline at end of file
@@ -0,0 +1,33 @@
+from ..base import Base
+from sqlalchemy import Column, Integer, String, ForeignKey, BigInteger, UUID
+from .message import current_timestamp
+
+class Attachment(Base):
+    "Uploaded file of a chat. Files are stored once per content hash."
+    __tablename__ = "attachments"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
+    created_at = Column(Integer, nullable=False, default=current_timestamp)
+
+class AttachmentUpload(Base):
+    "Resumable upload in progress. Removed once the attachment is complete."
+    __tablename__ = "attachment_uploads"
+
+    id = Column(UUID, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(Integer, nullable=False, default=current_timestamp)
+    # set by the request writing a chunk, until it is done or claimed_until
+    claim = Column(UUID, nullable=True)
+    # end of the last claim, also the last time the upload was resumed
+    claimed_until = Column(Integer, nullable=True)
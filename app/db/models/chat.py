@@ -1,9 +1,15 @@
 from ..base import Base
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
 
 class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    is_group = Column(Boolean, nullable=False)
\ No newline at end of file
+    is_group = Column(Boolean, nullable=False)
+    # user who created a group chat, may change its retention
+    creator_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # overrides MESSAGE_RETENTION_DAYS when set
+    retention_days = Column(Integer, nullable=True)
+    # bumped whenever the message pages of the chat change, see app.core.versions
+    version = Column(Integer, nullable=False, default=0, server_default="0")
\ No newline at end of file
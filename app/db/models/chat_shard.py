@@ -0,0 +1,16 @@
+from ..base import Base
+from sqlalchemy import Column, Integer, ForeignKey, String, BigInteger
+
+class ChatShard(Base):
+    "Explicit shard assignment of a chat, overriding the hash placement."
+    __tablename__ = "chat_shards"
+
+    chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+
+class IdSequence(Base):
+    "Block allocator for ids that must be unique across shards."
+    __tablename__ = "id_sequences"
+
+    name = Column(String, primary_key=True)
+    next_value = Column(BigInteger, nullable=False)
@@ -1,14 +1,19 @@
 from ..base import Base
 import time
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, UUID
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, UUID, Index
+
+def current_timestamp() -> int:
+    return int(time.time())
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_chat_id_timestamp", "chat_id", "timestamp"),)
 
     id = Column(Integer, primary_key=True)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     text = Column(String, nullable=False)
-    timestamp = Column(Integer, nullable=False, default=time.time)
+    timestamp = Column(Integer, nullable=False, default=current_timestamp, index=True)
     is_read = Column(Boolean, default=False)
-    client_message_id = Column(UUID, nullable=False, unique=True)
\ No newline at end of file
+    client_message_id = Column(UUID, nullable=False, unique=True)
+    attachment_id = Column(Integer, ForeignKey("attachments.id"), nullable=True)
\ No newline at end of file
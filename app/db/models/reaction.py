@@ -0,0 +1,19 @@
+from ..base import Base
+from sqlalchemy import Column, Integer, String, ForeignKey
+
+class Reaction(Base):
+    "Reaction of a user to a message. Written in batches by the reaction aggregator."
+    __tablename__ = "reactions"
+
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    emoji = Column(String(32), primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False, index=True)
+
+class ReactionCount(Base):
+    "Reactions of a message by emoji, recounted from reactions on every flush."
+    __tablename__ = "reaction_counts"
+
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    emoji = Column(String(32), primary_key=True)
+    count = Column(Integer, nullable=False)
\ No newline at end of file
@@ -0,0 +1,20 @@
+from ..base import Base
+from sqlalchemy import Column, Integer, String, ForeignKey, UUID
+from .message import current_timestamp
+
+class ScheduledMessage(Base):
+    "Message to send at send_at. Removed once it is sent."
+    __tablename__ = "scheduled_messages"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    text = Column(String, nullable=False)
+    # becomes the client_message_id of the sent message, so it is sent once
+    client_message_id = Column(UUID, nullable=False, unique=True)
+    attachment_id = Column(Integer, ForeignKey("attachments.id"), nullable=True)
+    send_at = Column(Integer, nullable=False, index=True)
+    created_at = Column(Integer, nullable=False, default=current_timestamp)
+    # failed sends, the message is not tried again once failed_at is set
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    failed_at = Column(Integer, nullable=True)
\ No newline at end of file
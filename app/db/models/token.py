@@ -0,0 +1,22 @@
+from ..base import Base
+from sqlalchemy import Column, Integer, String, ForeignKey
+from .message import current_timestamp
+
+class TokenFamily(Base):
+    "Refresh tokens issued from one login. Only the latest one is valid."
+    __tablename__ = "token_families"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    current_jti = Column(String(32), nullable=False)
+    expires_at = Column(Integer, nullable=False, index=True)
+
+class RevokedToken(Base):
+    "Revoked token family, kept until its tokens would have expired."
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    family = Column(String(32), nullable=False, unique=True)
+    expires_at = Column(Integer, nullable=False, index=True)
+    # lets every process sync only the rows added since its last sync
+    created_at = Column(Integer, nullable=False, default=current_timestamp, index=True)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from ..base import Base
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index, func
 
 class User(Base):
     __tablename__ = "users"
@@ -7,4 +7,11 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     email = Column(String, unique=True)
     name = Column(String)
-    hashed_password = Column(String, nullable=False)
\ No newline at end of file
+    hashed_password = Column(String, nullable=False)
+    # bumped whenever the chat list of the user changes, see app.core.versions
+    chats_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+# user search: prefix ranges and keyset order. On PostgreSQL the migration
+# builds them with COLLATE "C" and adds trigram indexes
+Index("ix_users_lower_name_id", func.lower(User.name), User.id)
+Index("ix_users_lower_email", func.lower(User.email))
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Message shard maintenance.
+
+    python -m app.db.reshard init
+        Create the message tables on every shard and seed the message id
+        sequence in the metadata database.
+    python -m app.db.reshard pin-all
+        Record the current placement of every chat in chat_shards. Run it
+        before changing the number of shards, so no chat moves implicitly.
+    python -m app.db.reshard move CHAT_ID SHARD
+        Move the messages of one chat to another shard while the app runs.
+
+A move copies the messages in batches, then switches the chat in
+chat_shards while holding the chat row FOR UPDATE. App processes read the
+placement of a chat when they write to it (ShardRouter.lock_placement), so
+the switch waits for writes in flight and nothing is written to the old shard
+after it, whatever the state of their cached shard map. After two refresh
+intervals, so processes with a stale map can still read the chat meanwhile,
+the messages left on the old shard are drained batch by batch: each batch is
+copied along with its read receipts and reactions, and exactly the copied
+rows are deleted, until the old shard holds none of the chat. Reaction
+counts are then rebuilt on the new shard.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import logging
+from sqlalchemy import select, update, delete, func
+from app.core.config import settings
+from app.db.base import AsyncLocalSession, insert_ignore
+from app.db.models import Chat, ChatShard, IdSequence, Message, Reaction, ReactionCount
+from app.db.sharding import shard_router, create_shard_schema, MESSAGE_SEQUENCE
+
+BATCH_SIZE = 1000
+
+
+async def init_shards():
+    for index, engine in enumerate(shard_router.engines):
+        await create_shard_schema(engine)
+        logging.info(f"Shard {index} schema ready")
+    async with AsyncLocalSession() as session:
+        sequence = await session.get(IdSequence, MESSAGE_SEQUENCE)
+        if sequence:
+            return
+        max_ids = [(await session.execute(select(func.max(Message.id)))).scalar()]
+        for shard in range(len(shard_router.engines)):
+            async with shard_router.shard_session(shard) as shard_session:
+                max_ids.append((await shard_session.execute(select(func.max(Message.id)))).scalar())
+        next_value = max(message_id or 0 for message_id in max_ids) + 1
+        session.add(IdSequence(name=MESSAGE_SEQUENCE, next_value=next_value))
+        await session.commit()
+        logging.info(f"Message id sequence starts at {next_value}")
+
+
+async def pin_all():
+    await shard_router.load_overrides()
+    async with AsyncLocalSession() as session:
+        chat_ids = (await session.execute(select(Chat.id))).scalars().all()
+        for chat_id in chat_ids:
+            if chat_id not in shard_router.overrides:
+                session.add(ChatShard(chat_id=chat_id, shard=shard_router.shard_for(chat_id)))
+        await session.commit()
+    logging.info(f"Pinned {len(chat_ids)} chats")
+
+
+async def copy_messages(chat_id: int, source: int, target: int, after_id: int) -> int:
+    """
+    Copy messages with id > after_id, batch by batch. Returns the last copied id.
+    """
+    columns = [column for column in Message.__table__.columns]
+    dialect_name = shard_router.engines[target].dialect.name
+    copied = 0
+    while True:
+        async with shard_router.shard_session(source) as source_session:
+            stmt = (
+                select(*columns)
+                .where(Message.chat_id == chat_id, Message.id > after_id)
+                .order_by(Message.id)
+                .limit(BATCH_SIZE)
+            )
+            rows = [dict(row) for row in (await source_session.execute(stmt)).mappings()]
+        if not rows:
+            return after_id
+        async with shard_router.shard_session(target) as target_session:
+            await target_session.execute(insert_ignore(Message.__table__, dialect_name), rows)
+            await target_session.commit()
+        after_id = rows[-1]["id"]
+        copied += len(rows)
+        logging.info(f"Chat {chat_id}: copied {copied} messages to shard {target}")
+
+
+async def switch_chat(chat_id: int, target: int):
+    """
+    Point the chat at the target shard. The chat row is locked FOR UPDATE
+    first, which waits for writes that placed the chat on the source
+    (lock_placement) to commit, and makes every later write see the target.
+    """
+    async with AsyncLocalSession() as session:
+        lock_stmt = select(Chat.id).where(Chat.id == chat_id).with_for_update()
+        await session.execute(lock_stmt)
+        await session.merge(ChatShard(chat_id=chat_id, shard=target))
+        await session.commit()
+
+
+async def drain_batch(chat_id: int, source: int, target: int) -> int:
+    """
+    Move the next batch of messages left on the source: copy the messages,
+    their read state and reactions, then delete exactly the copied rows
+    from the source. Returns the number of messages moved.
+    """
+    columns = [column for column in Message.__table__.columns]
+    dialect_name = shard_router.engines[target].dialect.name
+    async with shard_router.shard_session(source) as source_session:
+        stmt = (
+            select(*columns)
+            .where(Message.chat_id == chat_id)
+            .order_by(Message.id)
+            .limit(BATCH_SIZE)
+        )
+        rows = [dict(row) for row in (await source_session.execute(stmt)).mappings()]
+        if not rows:
+            return 0
+        message_ids = [row["id"] for row in rows]
+        reactions_stmt = select(*Reaction.__table__.columns).where(
+            Reaction.message_id.in_(message_ids)
+        )
+        reactions = [dict(row) for row in (await source_session.execute(reactions_stmt)).mappings()]
+    async with shard_router.shard_session(target) as target_session:
+        await target_session.execute(insert_ignore(Message.__table__, dialect_name), rows)
+        # copied before the switch, may have been read since
+        read_ids = [row["id"] for row in rows if row["is_read"]]
+        if read_ids:
+            await target_session.execute(
+                update(Message).where(Message.id.in_(read_ids)).values(is_read=True)
+            )
+        if reactions:
+            await target_session.execute(insert_ignore(Reaction.__table__, dialect_name), reactions)
+        await target_session.commit()
+    async with shard_router.shard_session(source) as source_session:
+        for model in (Reaction, ReactionCount):
+            await source_session.execute(delete(model).where(model.message_id.in_(message_ids)))
+        await source_session.execute(delete(Message).where(Message.id.in_(message_ids)))
+        await source_session.commit()
+    return len(rows)
+
+
+async def recount_reactions(chat_id: int, shard: int):
+    """
+    Rebuild the reaction counts of a chat from its reactions, the target
+    already has counts of reactions flushed since the switch.
+    """
+    async with shard_router.shard_session(shard) as session:
+        chat_message_ids = select(Message.id).where(Message.chat_id == chat_id)
+        await session.execute(
+            delete(ReactionCount).where(ReactionCount.message_id.in_(chat_message_ids))
+        )
+        counts = (
+            select(Reaction.message_id, Reaction.emoji, func.count())
+            .where(Reaction.chat_id == chat_id)
+            .group_by(Reaction.message_id, Reaction.emoji)
+        )
+        await session.execute(
+            ReactionCount.__table__.insert().from_select(["message_id", "emoji", "count"], counts)
+        )
+        await session.commit()
+
+
+async def move_chat(chat_id: int, target: int):
+    if not 0 <= target < len(shard_router.engines):
+        raise SystemExit(f"Shard {target} is not configured")
+    await shard_router.load_overrides()
+    source = shard_router.shard_for(chat_id)
+    if source == target:
+        logging.info(f"Chat {chat_id} is already on shard {target}")
+        return
+    await copy_messages(chat_id, source, target, after_id=0)
+    await switch_chat(chat_id, target)
+    # writes are fenced by the switch, the wait only keeps the messages
+    # readable for processes still reading the source from a stale map
+    wait = 2 * settings.SHARD_MAP_REFRESH_SECONDS
+    logging.info(f"Chat {chat_id} switched to shard {target}, waiting {wait:.0f}s for app processes")
+    await asyncio.sleep(wait)
+    moved = 0
+    while count := await drain_batch(chat_id, source, target):
+        moved += count
+        logging.info(f"Chat {chat_id}: moved {moved} messages off shard {source}")
+    await recount_reactions(chat_id, target)
+    logging.info(f"Chat {chat_id} moved from shard {source} to shard {target}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Message shard maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init")
+    commands.add_parser("pin-all")
+    move = commands.add_parser("move")
+    move.add_argument("chat_id", type=int)
+    move.add_argument("shard", type=int)
+    args = parser.parse_args()
+    if not shard_router.enabled:
+        raise SystemExit("MESSAGE_SHARD_URLS is not configured")
+    try:
+        if args.command == "init":
+            await init_shards()
+        elif args.command == "pin-all":
+            await pin_all()
+        elif args.command == "move":
+            await move_chat(args.chat_id, args.shard)
+    finally:
+        await shard_router.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
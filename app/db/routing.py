@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import logging
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from app.core.config import settings
+from app.db.base import async_engine, make_engine, AsyncLocalSession
+
+
+class ReplicaRouter:
+    """
+    Routes read-only sessions to healthy replicas in round-robin order, and
+    writes to the primary.
+
+    Users and chats written recently are pinned to the primary for
+    READ_YOUR_WRITES_SECONDS, so a lagging replica never hides a fresh write
+    from its author or serves stale rows under a freshly bumped ETag version.
+    """
+
+    def __init__(self, primary: AsyncEngine, replica_urls: list[str]):
+        self.primary = primary
+        self.replicas = [make_engine(url) for url in replica_urls]
+        self.healthy = [True] * len(self.replicas)
+        self.sessionmakers = {id(primary): AsyncLocalSession}
+        for engine in self.replicas:
+            self.sessionmakers[id(engine)] = async_sessionmaker(
+                bind=engine, expire_on_commit=False
+            )
+        self.recent_writes: dict[tuple[str, int], float] = {}
+        self._counter = itertools.count()
+        self._health_task: asyncio.Task | None = None
+
+    def mark_write(self, user_ids=(), chat_ids=()):
+        """
+        Pin users and chats to the primary for the read-your-writes window.
+        """
+        if not self.replicas:
+            return
+        deadline = time.monotonic() + settings.READ_YOUR_WRITES_SECONDS
+        for user_id in user_ids:
+            self.recent_writes[("user", user_id)] = deadline
+        for chat_id in chat_ids:
+            self.recent_writes[("chat", chat_id)] = deadline
+
+    def _is_pinned(self, key: tuple[str, int], now: float) -> bool:
+        deadline = self.recent_writes.get(key)
+        return deadline is not None and deadline > now
+
+    def pick(self, user_id: int, chat_id: int | None = None, chat_ids=()) -> AsyncEngine:
+        """
+        Pick the engine for a read-only request about a user and their chats.
+        """
+        if not self.replicas:
+            return self.primary
+        now = time.monotonic()
+        if self._is_pinned(("user", user_id), now):
+            return self.primary
+        if chat_id is not None and self._is_pinned(("chat", chat_id), now):
+            return self.primary
+        if any(self._is_pinned(("chat", chat_id), now) for chat_id in chat_ids):
+            return self.primary
+        for _ in range(len(self.replicas)):
+            index = next(self._counter) % len(self.replicas)
+            if self.healthy[index]:
+                return self.replicas[index]
+        return self.primary
+
+    def session(self, engine: AsyncEngine):
+        return self.sessionmakers[id(engine)]()
+
+    def mark_unhealthy(self, engine: AsyncEngine):
+        """
+        Take a replica out of rotation until the next successful health check.
+        """
+        for index, replica in enumerate(self.replicas):
+            if replica is engine and self.healthy[index]:
+                self.healthy[index] = False
+                logging.warning(f"Replica {index} marked unhealthy")
+
+    async def check_health(self):
+        for index, engine in enumerate(self.replicas):
+            try:
+                async with asyncio.timeout(settings.READINESS_TIMEOUT_SECONDS):
+                    async with engine.connect() as connection:
+                        await connection.execute(text("SELECT 1"))
+                if not self.healthy[index]:
+                    logging.info(f"Replica {index} is healthy again")
+                self.healthy[index] = True
+            except Exception as e:
+                if self.healthy[index]:
+                    logging.warning(f"Replica {index} failed health check: {e}")
+                self.healthy[index] = False
+
+    def prune(self):
+        """
+        Drop expired read-your-writes entries to keep memory bounded.
+        """
+        now = time.monotonic()
+        expired = [key for key, deadline in self.recent_writes.items() if deadline <= now]
+        for key in expired:
+            del self.recent_writes[key]
+
+    async def _run_health_checks(self):
+        while True:
+            await self.check_health()
+            self.prune()
+            await asyncio.sleep(settings.REPLICA_HEALTH_CHECK_SECONDS)
+
+    def start(self):
+        if self.replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._run_health_checks())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for engine in self.replicas:
+            await engine.dispose()
+
+
+replica_router = ReplicaRouter(async_engine, settings.DATABASE_REPLICA_URLS)
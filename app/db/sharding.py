@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from sqlalchemy import MetaData, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from app.core.config import settings
+from app.db.base import make_engine, AsyncLocalSession
+from app.db.models import Chat, ChatShard, IdSequence, Message, Reaction, ReactionCount
+
+MESSAGE_SEQUENCE = "messages"
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash: stable placement that moves only 1/n of the keys
+    when a bucket is added.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+# tables kept on every shard database, the others stay in DATABASE_URL
+SHARD_TABLES = (Message.__table__, Reaction.__table__, ReactionCount.__table__)
+
+
+def shard_table(source, metadata: MetaData):
+    """
+    Copy of a message table for a shard database. Users and chats live in
+    the metadata database, so the foreign keys are dropped.
+    """
+    table = source.to_metadata(metadata)
+    for column in table.columns:
+        column.foreign_keys.clear()
+    table.foreign_keys.clear()
+    table.constraints = {
+        constraint
+        for constraint in table.constraints
+        if not constraint.__visit_name__ == "foreign_key_constraint"
+    }
+    return table
+
+
+async def create_shard_schema(engine: AsyncEngine):
+    """
+    Create the message tables on a shard database if they do not exist.
+    """
+    metadata = MetaData()
+    for table in SHARD_TABLES:
+        shard_table(table, metadata)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+
+
+class ShardRouter:
+    """
+    Maps chat_id to the database holding the messages of the chat.
+
+    Placement is a jump hash of chat_id over MESSAGE_SHARD_URLS, overridden by
+    rows in chat_shards (written by the resharding tool). Overrides are cached
+    and refreshed every SHARD_MAP_REFRESH_SECONDS for reads, writes read the
+    placement of their chats at write time (lock_placement), so a process
+    with a stale map never writes to a shard a chat moved away from.
+    Without configured shards
+    every call falls back to the caller's session, so the default single
+    database setup is unchanged.
+    """
+
+    def __init__(self, shard_urls: list[str]):
+        self.engines = [make_engine(url) for url in shard_urls]
+        self.sessionmakers = [
+            async_sessionmaker(bind=engine, expire_on_commit=False)
+            for engine in self.engines
+        ]
+        self.overrides: dict[int, int] = {}
+        self._next_id = 0
+        self._id_limit = 0
+        self._id_lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def hashed_shard(self, chat_id: int) -> int:
+        return jump_hash(chat_id, len(self.engines))
+
+    def shard_for(self, chat_id: int) -> int:
+        override = self.overrides.get(chat_id)
+        if override is not None:
+            return override
+        return self.hashed_shard(chat_id)
+
+    @asynccontextmanager
+    async def session_for(
+        self, chat_id: int, fallback: AsyncSession
+    ) -> AsyncIterator[AsyncSession]:
+        """
+        Session on the shard owning the chat, or the fallback when not sharded.
+        """
+        if not self.enabled:
+            yield fallback
+            return
+        async with self.sessionmakers[self.shard_for(chat_id)]() as session:
+            yield session
+
+    async def lock_placement(self, session: AsyncSession, chat_ids) -> dict[int, int]:
+        """
+        Shards to write the messages of chats to, read from chat_shards
+        instead of the cached map. The chat rows are locked FOR KEY SHARE
+        until session ends: a move locks the row FOR UPDATE while it
+        switches the chat, so it waits for writes placed before the switch
+        and writes placed after it see the new shard. Keep session open
+        until the write to the shard is committed.
+        """
+        chat_ids = sorted(set(chat_ids))
+        lock_stmt = (
+            select(Chat.id)
+            .where(Chat.id.in_(chat_ids))
+            .with_for_update(read=True, key_share=True)
+        )
+        await session.execute(lock_stmt)
+        # a statement of its own, so it sees a switch committed while waiting
+        placement_stmt = select(ChatShard.chat_id, ChatShard.shard).where(
+            ChatShard.chat_id.in_(chat_ids)
+        )
+        pinned = dict((await session.execute(placement_stmt)).all())
+        shards = {}
+        for chat_id in chat_ids:
+            shards[chat_id] = pinned.get(chat_id, self.hashed_shard(chat_id))
+            if chat_id in pinned:
+                self.overrides[chat_id] = pinned[chat_id]
+        return shards
+
+    @asynccontextmanager
+    async def write_session_for(
+        self, chat_id: int, session: AsyncSession
+    ) -> AsyncIterator[AsyncSession]:
+        """
+        Session for writing messages of a chat: on the shard owning it as
+        of now, fenced against moves through session (see lock_placement),
+        or session itself when not sharded.
+        """
+        if not self.enabled:
+            yield session
+            return
+        shard = (await self.lock_placement(session, (chat_id,)))[chat_id]
+        async with self.sessionmakers[shard]() as shard_session:
+            yield shard_session
+
+    @asynccontextmanager
+    async def shard_session(self, shard: int) -> AsyncIterator[AsyncSession]:
+        async with self.sessionmakers[shard]() as session:
+            yield session
+
+    async def find_chat_id(self, message_id: int) -> int | None:
+        """
+        Locate the chat of a message by probing every shard. Only needed for
+        clients that do not send chat_id along with a message id.
+        """
+        if not self.enabled:
+            return None
+
+        async def probe(shard: int) -> int | None:
+            async with self.shard_session(shard) as session:
+                stmt = select(Message.chat_id).where(Message.id == message_id)
+                return (await session.execute(stmt)).scalar_one_or_none()
+
+        found = await asyncio.gather(*(probe(shard) for shard in range(len(self.engines))))
+        return next((chat_id for chat_id in found if chat_id is not None), None)
+
+    async def allocate_message_id(self) -> int | None:
+        """
+        Next globally unique message id, or None to let the database assign
+        it when not sharded. Ids are reserved from the metadata database in
+        blocks of MESSAGE_ID_BLOCK_SIZE, so messages keep their id when a
+        chat is moved between shards.
+        """
+        if not self.enabled:
+            return None
+        async with self._id_lock:
+            if self._next_id >= self._id_limit:
+                block = settings.MESSAGE_ID_BLOCK_SIZE
+                async with AsyncLocalSession() as session:
+                    stmt = (
+                        update(IdSequence)
+                        .where(IdSequence.name == MESSAGE_SEQUENCE)
+                        .values(next_value=IdSequence.next_value + block)
+                        .returning(IdSequence.next_value)
+                    )
+                    limit = (await session.execute(stmt)).scalar_one()
+                    await session.commit()
+                self._next_id, self._id_limit = limit - block, limit
+            message_id = self._next_id
+            self._next_id += 1
+            return message_id
+
+    async def load_overrides(self):
+        async with AsyncLocalSession() as session:
+            result = await session.execute(select(ChatShard.chat_id, ChatShard.shard))
+            self.overrides = {chat_id: shard for chat_id, shard in result}
+
+    async def _refresh_overrides(self):
+        while True:
+            try:
+                await self.load_overrides()
+            except Exception as e:
+                logging.error(f"Failed to refresh shard map: {e}")
+            await asyncio.sleep(settings.SHARD_MAP_REFRESH_SECONDS)
+
+    def start(self):
+        if self.enabled and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_overrides())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+
+shard_router = ShardRouter(settings.MESSAGE_SHARD_URLS)
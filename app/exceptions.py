@@ -9,3 +9,13 @@ class UnauthorizedException(HTTPException):
 
     def __init__(self, detail: str = "Unauthorized access"):
         self.detail = detail
+
+
+class CommandError(Exception):
+    """Exception raised by a WebSocket command handler, answered with an
+    ERROR frame while the connection stays open."""
+
+    def __init__(self, code: str, detail: str):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
@@ -2,23 +2,97 @@ from dotenv import load_dotenv
 import logging
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
 
+from app.core.logs import setup_logging
+
+setup_logging()
+
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI, status
 from app.core import settings
-from app.api.endpoints import auth_router, chat_router, message_router
+from app.core.warmup import warm_up, warm_up_until_ready
+from app.core.typing_indicators import typing_tracker
+from app.core.tracing import TracingMiddleware
+from app.core.revocation import revocation_list
+from app.core.tasks import task_queue
+from app.core.spool import message_spool
+from app.core.reactions import reaction_aggregator
+from app.core.scheduler import message_scheduler
+from app.db.base import async_engine
+from app.db.routing import replica_router
+from app.db.sharding import shard_router
+from app.db.maintenance import maintenance
+from app.api.endpoints import (
+    auth_router,
+    chat_router,
+    message_router,
+    health_router,
+    attachment_router,
+    debug_router,
+    user_router,
+)
+from app.api.endpoints.messages import send_scheduled_message
 
 API_DESCRIPTION = """
 API for a simple chat application featuring authentication, chat management, and real-time messaging via WebSockets.
 """
 API_VERSION = "0.1.0"
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up the pool and caches before serving, dispose the engine on shutdown.
+    If the database is down at startup, keep retrying in the background and
+    let /readyz report not ready meanwhile.
+    """
+    retry_task = None
+    try:
+        await warm_up(async_engine)
+    except Exception as e:
+        logging.error(f"Startup warm-up failed: {e}")
+        retry_task = asyncio.create_task(warm_up_until_ready(async_engine))
+    task_queue.start()
+    message_spool.start()
+    reaction_aggregator.start()
+    message_scheduler.start(send_scheduled_message)
+    replica_router.start()
+    shard_router.start()
+    typing_tracker.start()
+    maintenance.start()
+    revocation_list.start()
+    yield
+    await message_spool.stop()
+    await message_scheduler.stop()
+    await reaction_aggregator.stop()
+    await task_queue.stop()
+    await revocation_list.stop()
+    await maintenance.stop()
+    await typing_tracker.stop()
+    await shard_router.stop()
+    await replica_router.stop()
+    if retry_task:
+        retry_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await retry_task
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description=API_DESCRIPTION,
     version=API_VERSION,
+    lifespan=lifespan,
 )
 
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(message_router)
+app.include_router(health_router)
+app.include_router(attachment_router)
+if settings.DEBUG_ENDPOINTS_ENABLED:
+    app.include_router(debug_router)
+app.include_router(user_router)
+
+app.add_middleware(TracingMiddleware)
@@ -0,0 +1,44 @@
+"""Add chat_shards and id_sequences for message sharding
+
+Revision ID: 5c1e7a9d2b40
+Revises: 97aa79977725
+Create Date: 2026-10-19 10:12:31.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e7a9d2b40'
+down_revision: Union[str, None] = '97aa79977725'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('chat_shards',
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ),
+    sa.PrimaryKeyConstraint('chat_id')
+    )
+    op.create_table('id_sequences',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # message ids allocated for shards continue after the unsharded ones
+    op.execute(
+        "INSERT INTO id_sequences (name, next_value) "
+        "SELECT 'messages', COALESCE(MAX(id), 0) + 1 FROM messages"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('id_sequences')
+    op.drop_table('chat_shards')
@@ -0,0 +1,30 @@
+"""Add chat and chat list versions
+
+Revision ID: b4d2e6a81c37
+Revises: e7b1f9c3a260
+Create Date: 2026-10-20 10:12:41.305118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d2e6a81c37'
+down_revision: Union[str, None] = 'e7b1f9c3a260'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('chats_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'chats_version')
+    op.drop_column('chats', 'version')
@@ -0,0 +1,47 @@
+"""Add reactions
+
+Revision ID: c2e8d5a71f04
+Revises: a6c4e81f2b93
+Create Date: 2026-10-19 18:04:51.227306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e8d5a71f04'
+down_revision: Union[str, None] = 'a6c4e81f2b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reactions',
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('emoji', sa.String(length=32), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('message_id', 'user_id', 'emoji')
+    )
+    op.create_index(op.f('ix_reactions_chat_id'), 'reactions', ['chat_id'], unique=False)
+    op.create_table('reaction_counts',
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('emoji', sa.String(length=32), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ),
+    sa.PrimaryKeyConstraint('message_id', 'emoji')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('reaction_counts')
+    op.drop_index(op.f('ix_reactions_chat_id'), table_name='reactions')
+    op.drop_table('reactions')
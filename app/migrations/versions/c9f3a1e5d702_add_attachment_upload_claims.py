@@ -0,0 +1,30 @@
+"""Add attachment upload claims
+
+Revision ID: c9f3a1e5d702
+Revises: b4d2e6a81c37
+Create Date: 2026-10-20 15:47:09.682341
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9f3a1e5d702'
+down_revision: Union[str, None] = 'b4d2e6a81c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attachment_uploads', sa.Column('claim', sa.UUID(), nullable=True))
+    op.add_column('attachment_uploads', sa.Column('claimed_until', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('attachment_uploads', 'claimed_until')
+    op.drop_column('attachment_uploads', 'claim')
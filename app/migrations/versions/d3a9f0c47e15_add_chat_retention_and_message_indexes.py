@@ -0,0 +1,32 @@
+"""Add chat retention and message timestamp indexes
+
+Revision ID: d3a9f0c47e15
+Revises: 8e4b2f61c9a7
+Create Date: 2026-10-19 13:20:05.114702
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a9f0c47e15'
+down_revision: Union[str, None] = '8e4b2f61c9a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('retention_days', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_messages_timestamp'), 'messages', ['timestamp'], unique=False)
+    op.create_index('ix_messages_chat_id_timestamp', 'messages', ['chat_id', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_timestamp', table_name='messages')
+    op.drop_index(op.f('ix_messages_timestamp'), table_name='messages')
+    op.drop_column('chats', 'retention_days')
@@ -0,0 +1,30 @@
+"""Add scheduled message attempts
+
+Revision ID: d8b2e4f6a913
+Revises: c9f3a1e5d702
+Create Date: 2026-10-20 16:21:53.104728
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8b2e4f6a913'
+down_revision: Union[str, None] = 'c9f3a1e5d702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('scheduled_messages', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('scheduled_messages', sa.Column('failed_at', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('scheduled_messages', 'failed_at')
+    op.drop_column('scheduled_messages', 'attempts')
@@ -0,0 +1,30 @@
+"""Add chat creator
+
+Revision ID: e2c7a9b4f158
+Revises: d8b2e4f6a913
+Create Date: 2026-10-20 16:58:27.519306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c7a9b4f158'
+down_revision: Union[str, None] = 'd8b2e4f6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('creator_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('chats_creator_id_fkey', 'chats', 'users', ['creator_id'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('chats_creator_id_fkey', 'chats', type_='foreignkey')
+    op.drop_column('chats', 'creator_id')
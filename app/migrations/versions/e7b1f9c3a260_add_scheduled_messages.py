@@ -0,0 +1,46 @@
+"""Add scheduled messages
+
+Revision ID: e7b1f9c3a260
+Revises: c2e8d5a71f04
+Create Date: 2026-10-19 19:31:08.662914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b1f9c3a260'
+down_revision: Union[str, None] = 'c2e8d5a71f04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('scheduled_messages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('text', sa.String(), nullable=False),
+    sa.Column('client_message_id', sa.UUID(), nullable=False),
+    sa.Column('attachment_id', sa.Integer(), nullable=True),
+    sa.Column('send_at', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['attachment_id'], ['attachments.id'], ),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ),
+    sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('client_message_id')
+    )
+    op.create_index(op.f('ix_scheduled_messages_sender_id'), 'scheduled_messages', ['sender_id'], unique=False)
+    op.create_index(op.f('ix_scheduled_messages_send_at'), 'scheduled_messages', ['send_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scheduled_messages_send_at'), table_name='scheduled_messages')
+    op.drop_index(op.f('ix_scheduled_messages_sender_id'), table_name='scheduled_messages')
+    op.drop_table('scheduled_messages')
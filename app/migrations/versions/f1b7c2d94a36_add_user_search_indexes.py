@@ -0,0 +1,42 @@
+"""Add user search indexes
+
+Revision ID: f1b7c2d94a36
+Revises: d3a9f0c47e15
+Create Date: 2026-10-19 14:05:41.662018
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b7c2d94a36'
+down_revision: Union[str, None] = 'd3a9f0c47e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # byte order, so a lowercase prefix is one index range
+        op.create_index('ix_users_lower_name_id', 'users', [sa.text('lower(name) COLLATE "C"'), 'id'], unique=False)
+        op.create_index('ix_users_lower_email', 'users', [sa.text('lower(email) COLLATE "C"')], unique=False)
+        # trigram indexes serve ILIKE '%term%' on name and email
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_users_name_trgm', 'users', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_users_email_trgm', 'users', ['email'], unique=False, postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'})
+    else:
+        op.create_index('ix_users_lower_name_id', 'users', [sa.text('lower(name)'), 'id'], unique=False)
+        op.create_index('ix_users_lower_email', 'users', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_users_email_trgm', table_name='users')
+        op.drop_index('ix_users_name_trgm', table_name='users')
+    op.drop_index('ix_users_lower_email', table_name='users')
+    op.drop_index('ix_users_lower_name_id', table_name='users')
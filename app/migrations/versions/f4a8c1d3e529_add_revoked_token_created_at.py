@@ -0,0 +1,32 @@
+"""Add revoked token created_at
+
+Revision ID: f4a8c1d3e529
+Revises: e2c7a9b4f158
+Create Date: 2026-10-20 17:34:12.846590
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a8c1d3e529'
+down_revision: Union[str, None] = 'e2c7a9b4f158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows are read by the first sync of every process anyway
+    op.add_column('revoked_tokens', sa.Column('created_at', sa.Integer(), server_default='0', nullable=False))
+    op.alter_column('revoked_tokens', 'created_at', server_default=None)
+    op.create_index(op.f('ix_revoked_tokens_created_at'), 'revoked_tokens', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_revoked_tokens_created_at'), table_name='revoked_tokens')
+    op.drop_column('revoked_tokens', 'created_at')
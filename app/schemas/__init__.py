@@ -1,4 +1,31 @@
-from .user import UserCreate, UserRead
-from .token import Token
-from .chat import ChatCreate, ChatRead
-from .message import MessageCreate, MessageResponse, MessageReadNotification, WebSocketCommand
\ No newline at end of file
+from .user import UserCreate, UserRead, UserUpdate, SenderProfile, UserSearchPage
+from .token import Token, TokenRefresh
+from .chat import ChatCreate, ChatRead, ChatRetentionUpdate, ChatRetentionRead
+from .message import (
+    MessageCreate,
+    MessageImport,
+    MessageResponse,
+    MessageExpanded,
+    MessageExpand,
+    SpooledMessage,
+    MessageStored,
+    HistoryBatchChat,
+    HistoryBatchRequest,
+    HistoryBatchPage,
+    ScheduledMessageRead,
+    ScheduledMessageNotification,
+    MessageReadNotification,
+    TypingNotification,
+    ReactionNotification,
+    AuthNotification,
+    ErrorNotification,
+    WebSocketCommand,
+    ClientFrame,
+    SendMessagePayload,
+    ScheduleMessagePayload,
+    ReadMessagePayload,
+    TypingPayload,
+    ReactPayload,
+    AuthPayload,
+)
+from .attachment import AttachmentUploadCreate, AttachmentUploadRead, AttachmentRead
\ No newline at end of file
@@ -0,0 +1,36 @@
+import uuid
+from pydantic import BaseModel, Field
+
+
+class AttachmentUploadCreate(BaseModel):
+    chat_id: int = Field(..., description="Chat the attachment is shared in")
+    filename: str = Field(..., min_length=1, max_length=255, description="Original file name")
+    content_type: str = Field(
+        "application/octet-stream", max_length=255, description="MIME type of the file"
+    )
+    size: int = Field(..., gt=0, description="Total size of the file in bytes")
+
+
+class AttachmentRead(BaseModel):
+    id: int = Field(..., description="Unique identifier for the attachment")
+    chat_id: int = Field(..., description="Chat the attachment is shared in")
+    filename: str = Field(..., description="Original file name")
+    content_type: str = Field(..., description="MIME type of the file")
+    size: int = Field(..., description="Size of the file in bytes")
+    sha256: str = Field(..., description="SHA-256 of the content")
+
+    class Config:
+        from_attributes = True
+
+
+class AttachmentUploadRead(BaseModel):
+    id: uuid.UUID = Field(..., description="Upload identifier")
+    chat_id: int = Field(..., description="Chat the attachment is shared in")
+    size: int = Field(..., description="Total size of the file in bytes")
+    received: int = Field(..., description="Bytes received so far, the offset to resume from")
+    attachment: AttachmentRead | None = Field(
+        None, description="The stored attachment, once all bytes are received"
+    )
+
+    class Config:
+        from_attributes = True
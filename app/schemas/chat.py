@@ -12,5 +12,16 @@ class ChatCreate(ChatBase):
 class ChatRead(ChatBase):
     id: int = Field(..., title="ID of the chat")
     
+    class Config:
+        from_attributes = True
+
+class ChatRetentionUpdate(BaseModel):
+    retention_days: int | None = Field(
+        ..., ge=1, title="Days messages are kept, null for the server default"
+    )
+
+class ChatRetentionRead(ChatRetentionUpdate):
+    id: int = Field(..., title="ID of the chat")
+
     class Config:
         from_attributes = True
\ No newline at end of file
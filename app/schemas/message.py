@@ -1,10 +1,25 @@
 import uuid
+from typing import Annotated, Any, Literal, Union
 from pydantic import BaseModel, Field
+from pydantic.json_schema import SkipJsonSchema
 from enum import StrEnum
+from .user import SenderProfile
 
 class WebSocketCommand(StrEnum):
     SEND_MESSAGE = "SEND_MESSAGE"
     READ_MESSAGE = "READ_MESSAGE"
+    TYPING = "TYPING"
+    AUTH = "AUTH"
+    REACT = "REACT"
+    SCHEDULE_MESSAGE = "SCHEDULE_MESSAGE"
+    # sent by the server only, in reply to a command that failed
+    ERROR = "ERROR"
+    # sent by the server only, when a spooled message got its id
+    MESSAGE_STORED = "MESSAGE_STORED"
+
+
+class MessageExpand(StrEnum):
+    SENDER = "sender"
 
 
 class MessageBase(BaseModel):
@@ -16,21 +31,114 @@ class MessageBase(BaseModel):
     client_message_id: uuid.UUID = Field(
         ..., description="Unique identifier for the message from the client"
     )
+    attachment_id: int | None = Field(
+        None, description="Attachment uploaded to the same chat"
+    )
 
 
 class MessageCreate(MessageBase):
     pass
 
 
+class MessageImport(MessageCreate):
+    timestamp: int | None = Field(
+        None, description="Unix time the message was sent, the import time if missing"
+    )
+    is_read: bool = Field(False, description="Read status of the message")
+
+
 class MessageResponse(MessageBase):
     id: int = Field(..., description="Unique identifier for the message")
     timestamp: int = Field(..., description="Timestamp of when the message was sent")
     is_read: bool = Field(False, description="Read status of the message")
+    reactions: dict[str, int] = Field(
+        default_factory=dict, description="Number of reactions by emoji"
+    )
+
+    class Config:
+        from_attributes = True
+
+
+class MessageExpanded(MessageResponse):
+    sender: SenderProfile | None = Field(
+        None, description="Profile of the sender, null if the account is gone"
+    )
+
+
+class SpooledMessage(MessageBase):
+    id: None = Field(
+        None, description="Null until the message is stored, see MessageStored"
+    )
+    timestamp: int = Field(..., description="Timestamp of when the message was sent")
+    is_read: bool = Field(False, description="Read status of the message")
+    sender: SenderProfile | None = Field(
+        None, description="Profile of the sender, for expanded connections only"
+    )
+
+
+class MessageStored(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    client_message_id: uuid.UUID = Field(
+        ..., description="Unique identifier for the message from the client"
+    )
+    id: int = Field(..., description="Unique identifier for the message")
+    command: str = Field(
+        WebSocketCommand.MESSAGE_STORED,
+        description="Command to indicate a spooled message was stored",
+    )
+
+
+class HistoryBatchChat(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    before: str | None = Field(
+        None, description="next_cursor of an earlier response, to load older messages"
+    )
+
+
+class HistoryBatchRequest(BaseModel):
+    chats: list[HistoryBatchChat] | None = Field(
+        None, max_length=500, description="Chats to load, every chat of the user if null"
+    )
+    limit: int = Field(50, ge=1, le=100, description="Latest messages per chat")
+
+
+class HistoryBatchPage(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    messages: list[MessageResponse] = Field(..., description="Messages, oldest first")
+    next_cursor: str | None = Field(
+        None, description="Pass as before to get older messages, null if there are none"
+    )
+
+
+class ScheduledMessageRead(BaseModel):
+    id: int = Field(..., description="Unique identifier for the scheduled message")
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    sender_id: int = Field(..., description="Unique identifier for the sender")
+    text: str = Field(..., description="Content of the message")
+    client_message_id: uuid.UUID = Field(
+        ..., description="client_message_id the message is sent with"
+    )
+    attachment_id: int | None = Field(
+        None, description="Attachment uploaded to the same chat"
+    )
+    send_at: int = Field(..., description="Unix time the message is sent at")
+    created_at: int = Field(..., description="Unix time the message was scheduled")
+    failed_at: int | None = Field(
+        None,
+        description="Unix time sending was given up after SCHEDULER_MAX_ATTEMPTS failures",
+    )
 
     class Config:
         from_attributes = True
 
 
+class ScheduledMessageNotification(ScheduledMessageRead):
+    command: str = Field(
+        WebSocketCommand.SCHEDULE_MESSAGE,
+        description="Command to confirm a scheduled message",
+    )
+
+
 class MessageReadNotification(BaseModel):
     id: int = Field(..., description="Unique identifier for the message")
     chat_id: int = Field(..., description="Unique identifier for the chat")
@@ -39,4 +147,131 @@ class MessageReadNotification(BaseModel):
     )
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class TypingNotification(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    user_ids: list[int] = Field(
+        ..., description="Users typing right now, empty when nobody is typing"
+    )
+    command: str = Field(
+        WebSocketCommand.TYPING, description="Command to indicate typing users"
+    )
+
+
+class ReactionNotification(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+    message_id: int = Field(..., description="Unique identifier for the message")
+    reactions: dict[str, int] = Field(
+        ..., description="Number of reactions by emoji, all of them"
+    )
+    command: str = Field(
+        WebSocketCommand.REACT, description="Command to indicate new reaction counts"
+    )
+
+
+class AuthNotification(BaseModel):
+    expires_at: int = Field(
+        ..., description="Unix time the connection needs a new AUTH by"
+    )
+    command: str = Field(
+        WebSocketCommand.AUTH, description="Command to confirm re-authentication"
+    )
+
+
+class ErrorNotification(BaseModel):
+    request: str | None = Field(
+        None, description="Command of the failed frame, null if it could not be read"
+    )
+    code: str = Field(
+        ...,
+        description=(
+            "invalid_json, invalid_frame, unknown_command, invalid_payload, "
+            "not_found, forbidden, duplicate or unavailable"
+        ),
+    )
+    detail: str = Field(..., description="Human readable reason")
+    errors: list[dict[str, Any]] | None = Field(
+        None, description="Validation errors of invalid_payload, without the input"
+    )
+    command: str = Field(
+        WebSocketCommand.ERROR, description="Command to indicate a failed command"
+    )
+
+
+class SendMessagePayload(MessageBase):
+    # the sender is the user of the connection, never taken from the frame
+    sender_id: SkipJsonSchema[None] = Field(None, exclude=True)
+
+
+class ScheduleMessagePayload(SendMessagePayload):
+    send_at: int = Field(
+        ..., gt=0, description="Unix time to send the message at, now if in the past"
+    )
+
+
+class ReadMessagePayload(BaseModel):
+    id: int = Field(..., description="Unique identifier for the message")
+    chat_id: int | None = Field(
+        None, description="Chat of the message, spares probing every shard"
+    )
+
+
+class TypingPayload(BaseModel):
+    chat_id: int = Field(..., description="Unique identifier for the chat")
+
+
+class ReactPayload(BaseModel):
+    message_id: int = Field(..., description="Unique identifier for the message")
+    chat_id: int = Field(..., description="Chat of the message")
+    emoji: str = Field(..., min_length=1, max_length=32, description="Reaction")
+    remove: bool = Field(False, description="Take the reaction back")
+
+
+class AuthPayload(BaseModel):
+    token: str = Field(..., description="New access token of the same user")
+
+
+class SendMessageFrame(BaseModel):
+    command: Literal[WebSocketCommand.SEND_MESSAGE]
+    payload: SendMessagePayload
+
+
+class ScheduleMessageFrame(BaseModel):
+    command: Literal[WebSocketCommand.SCHEDULE_MESSAGE]
+    payload: ScheduleMessagePayload
+
+
+class ReadMessageFrame(BaseModel):
+    command: Literal[WebSocketCommand.READ_MESSAGE]
+    payload: ReadMessagePayload
+
+
+class TypingFrame(BaseModel):
+    command: Literal[WebSocketCommand.TYPING]
+    payload: TypingPayload
+
+
+class ReactFrame(BaseModel):
+    command: Literal[WebSocketCommand.REACT]
+    payload: ReactPayload
+
+
+class AuthFrame(BaseModel):
+    command: Literal[WebSocketCommand.AUTH]
+    payload: AuthPayload
+
+
+# frames a client sends, told apart by command
+ClientFrame = Annotated[
+    Union[
+        SendMessageFrame,
+        ScheduleMessageFrame,
+        ReadMessageFrame,
+        TypingFrame,
+        ReactFrame,
+        AuthFrame,
+    ],
+    Field(discriminator="command"),
+]
\ No newline at end of file
@@ -1,6 +1,12 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class Token(BaseModel):
     "Token for OAuth2 token response"
     access_token: str
-    token_type: str
\ No newline at end of file
+    token_type: str
+    refresh_token: str | None = Field(
+        None, description="Exchange at /token/refresh for a new pair, valid once"
+    )
+
+class TokenRefresh(BaseModel):
+    refresh_token: str = Field(..., description="Refresh token of the last token response")
\ No newline at end of file
@@ -11,4 +11,15 @@ class UserRead(UserBase):
     id: int = Field(..., description="Unique identifier for the user")
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class UserUpdate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=50, description="Name of the user")
+
+class SenderProfile(BaseModel):
+    id: int = Field(..., description="Unique identifier for the user")
+    name: str = Field(..., description="Name of the user")
+
+class UserSearchPage(BaseModel):
+    items: list[UserRead] = Field(..., description="Matching users ordered by name")
+    next_cursor: str | None = Field(None, description="Pass as cursor to get the next page, null on the last page")
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Measure event-loop lag while coroutines log, with a plain StreamHandler on
+the loop thread versus the queue-backed pipeline from app.core.logs.
+
+A ticker task sleeps for 1 ms in a loop and records how late it wakes up,
+while worker tasks emit message.sent events. The stream sleeps on every
+write to stand in for stderr behind a slow pipe or log collector. The last
+run keeps the default LOG_SAMPLE_RATES.
+
+Run from the repository root:
+    python -m benchmarks.bench_logging [records] [workers] [write_latency_us]
+"""
+import os
+import sys
+import asyncio
+import logging
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from app.core import logs
+from app.core.config import settings
+
+TICK = 0.001
+
+
+class SlowStream:
+    "Text stream that blocks for a fixed time on every write"
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def write(self, text: str):
+        time.sleep(self.latency)
+
+    def flush(self):
+        pass
+
+
+async def ticker(lags: list[float], done: asyncio.Event):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def worker(records: int):
+    for i in range(records):
+        logs.log_event("message.sent", user_id=i, chat_id=i % 100, message_id=i)
+        if i % 10 == 0:
+            await asyncio.sleep(0)
+
+
+async def run(records: int, workers: int) -> tuple[float, list[float]]:
+    lags: list[float] = []
+    done = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, done))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(records // workers) for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+    return elapsed, sorted(lags)
+
+
+def report(name: str, elapsed: float, lags: list[float]):
+    p50 = lags[len(lags) // 2] * 1e3
+    p99 = lags[int(len(lags) * 0.99)] * 1e3
+    print(
+        f"{name:>6}: {elapsed * 1e3:8.1f} ms on loop, "
+        f"lag p50 {p50:6.2f} ms, p99 {p99:6.2f} ms, max {lags[-1] * 1e3:6.2f} ms"
+    )
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1e6
+    sample_rates = settings.LOG_SAMPLE_RATES
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    sink = SlowStream(latency)
+
+    settings.LOG_SAMPLE_RATES = {}
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logs.JsonFormatter())
+    root.handlers = [handler]
+    report("sync", *asyncio.run(run(records, workers)))
+
+    root.handlers = []
+    sys.stderr, stderr = sink, sys.stderr
+    try:
+        logs.setup_logging()
+        report("queue", *asyncio.run(run(records, workers)))
+        settings.LOG_SAMPLE_RATES = sample_rates
+        report("sample", *asyncio.run(run(records, workers)))
+        dropped = logs._queue_handler.dropped
+        logs.stop_logging()
+    finally:
+        sys.stderr = stderr
+    print(f"records dropped by the full queue: {dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare the ORM + per-row model_validate path of the list endpoints with the
+column-select + bulk TypeAdapter path.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialization [rows] [iterations]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import timeit
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select, insert
+from sqlalchemy.orm import Session
+from app.db.models import User, Chat, Message, ReactionCount
+from app.schemas import MessageResponse
+from app.core.serialization import fold_reaction, history_page_stmt, message_rows_adapter
+
+response_adapter = TypeAdapter(list[MessageResponse])
+
+
+def seed(engine, rows: int):
+    for table in (User.__table__, Chat.__table__, Message.__table__, ReactionCount.__table__):
+        table.create(engine)
+    with Session(engine) as session:
+        session.execute(insert(User), [{"id": 1, "name": "u", "hashed_password": "x"}])
+        session.execute(insert(Chat), [{"id": 1, "name": "c", "is_group": False}])
+        now = int(time.time())
+        session.execute(
+            insert(Message),
+            [
+                {
+                    "chat_id": 1,
+                    "sender_id": 1,
+                    "text": "x" * 120,
+                    "timestamp": now + i,
+                    "is_read": False,
+                    "client_message_id": uuid.uuid4(),
+                }
+                for i in range(rows)
+            ],
+        )
+        session.commit()
+
+
+def current_path(engine, rows: int) -> bytes:
+    "What get_messages + FastAPI response_model serialization did before"
+    with Session(engine) as session:
+        stmt = select(Message).where(Message.chat_id == 1).order_by(Message.timestamp).limit(rows)
+        messages = session.execute(stmt).scalars().all()
+        validated = [MessageResponse.model_validate(message) for message in messages]
+        # FastAPI validates the return value against response_model once more,
+        # then JSONResponse renders the jsonable data with json.dumps
+        revalidated = response_adapter.validate_python(validated, from_attributes=True)
+        content = response_adapter.dump_python(revalidated, mode="json")
+        return json.dumps(content, separators=(",", ":")).encode()
+
+
+def fast_path(engine, rows: int) -> bytes:
+    "What get_messages does now, reaction counts included"
+    with Session(engine) as session:
+        result = session.execute(history_page_stmt(1, rows, 0))
+        keys = tuple(result.keys())
+        messages = []
+        for row in result:
+            fold_reaction(messages, dict(zip(keys, row)))
+        return message_rows_adapter.dump_json(messages)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    engine = create_engine("sqlite://")
+    seed(engine, rows)
+    assert json.loads(current_path(engine, rows)) == json.loads(fast_path(engine, rows))
+    for name, func in (("current", current_path), ("fast", fast_path)):
+        seconds = min(timeit.repeat(lambda: func(engine, rows), number=iterations, repeat=3))
+        print(f"{name:>8}: {seconds / iterations * 1e6:9.1f} us per {rows}-row page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Latency of GET /users/search queries on a seeded user directory.
+
+Seeds users (1M by default) once into BENCH_DATABASE_URL, then times typical
+queries and fails when a p99 is over the target. Without BENCH_DATABASE_URL a
+SQLite file in the temp directory is created from the models and only the
+prefix queries run. A PostgreSQL database must be migrated with alembic
+first, it also runs the substring queries served by pg_trgm.
+
+Run from the repository root:
+    python -m benchmarks.bench_user_search [users] [target_ms]
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.bench_user_search
+"""
+import os
+import sys
+import time
+import asyncio
+import random
+import tempfile
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy import insert, select, func, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.db.models import User
+from app.api.endpoints.users import find_users
+
+FIRST_NAMES = [
+    "anna", "boris", "clara", "dmitri", "elena", "felix", "galina", "hugo",
+    "irina", "jonas", "katya", "leon", "maria", "nikita", "olga", "pavel",
+    "quinn", "roman", "sofia", "timur", "ulyana", "victor", "wanda", "yuri",
+]
+LAST_NAMES = [
+    "ivanov", "smirnova", "kuznetsov", "popova", "sokolov", "lebedeva",
+    "kozlov", "novikova", "morozov", "petrova", "volkov", "solovyova",
+]
+# name: (query, needs substring matching)
+QUERIES = {
+    "common prefix": ("ann", False),
+    "full name": ("maria petrova", False),
+    "short term": ("yu", False),
+    "email prefix": ("olga.kozlov1", False),
+    "email address": ("olga.kozlov12@", False),
+    "no match": ("zzzzqx", False),
+    "rare substring": ("ovikova77", True),
+    # in more than SUBSTRING_MAX_MATCHES users, matched as a prefix
+    "email domain": ("example.org", True),
+}
+PAGE_SIZE = 21
+SEED_BATCH = 20000
+
+
+def user_rows(start: int, stop: int):
+    rng = random.Random(start)
+    for i in range(start, stop):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        domain = "example.org" if i % 97 == 0 else "example.com"
+        yield {
+            "name": f"{first} {last}{i % 100}",
+            "email": f"{first}.{last}{i}@{domain}",
+            "hashed_password": "x",
+        }
+
+
+async def seed(engine, users: int):
+    async with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            await connection.run_sync(User.__table__.create, checkfirst=True)
+        existing = (await connection.execute(select(func.count(User.id)))).scalar()
+    if existing >= users:
+        return
+    print(f"Seeding {users - existing} users...")
+    for start in range(existing, users, SEED_BATCH):
+        async with engine.begin() as connection:
+            await connection.execute(
+                insert(User), list(user_rows(start, min(start + SEED_BATCH, users)))
+            )
+    async with engine.begin() as connection:
+        await connection.execute(text("ANALYZE"))
+
+
+async def time_query(session_maker, q: str, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        async with session_maker() as session:
+            start = time.perf_counter()
+            rows = await find_users(session, q, PAGE_SIZE)
+            if len(rows) == PAGE_SIZE:
+                user, key = rows[-2]
+                await find_users(session, q, PAGE_SIZE, (key, user.id))
+            timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    target_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50.0
+    default_url = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.gettempdir(), f"bench_users_{users}.sqlite"
+    )
+    engine = create_async_engine(os.environ.get("BENCH_DATABASE_URL", default_url))
+    await seed(engine, users)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    failed = False
+    print(f"first and second page, {users} users, target p99 {target_ms:.0f} ms")
+    dialect_name = engine.dialect.name
+    for name, (q, substring) in QUERIES.items():
+        if substring and dialect_name != "postgresql":
+            continue
+        timings = await time_query(session_maker, q, runs=50)
+        p50 = timings[len(timings) // 2] * 1e3
+        p99 = timings[int(len(timings) * 0.99)] * 1e3
+        verdict = "ok" if p99 <= target_ms else "SLOW"
+        failed |= p99 > target_ms
+        print(f"{name:>15} {q!r:>16}: p50 {p50:7.2f} ms, p99 {p99:7.2f} ms {verdict}")
+    await engine.dispose()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Parse cost per WebSocket frame: the former json.loads + dict lookups +
+MessageCreate(**payload) path against one pass of the discriminated-union
+TypeAdapter used by the dispatcher.
+
+Run from the repository root:
+    python -m benchmarks.bench_ws_frames [iterations]
+"""
+import os
+import sys
+import json
+import uuid
+import timeit
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+from pydantic import ValidationError
+from app.schemas import MessageCreate, WebSocketCommand
+from app.core.serialization import client_frame_adapter
+
+FRAMES = {
+    "SEND_MESSAGE": {
+        "command": "SEND_MESSAGE",
+        "payload": {
+            "chat_id": 42,
+            "text": "x" * 120,
+            "client_message_id": str(uuid.uuid4()),
+        },
+    },
+    "READ_MESSAGE": {"command": "READ_MESSAGE", "payload": {"id": 123456, "chat_id": 42}},
+    "TYPING": {"command": "TYPING", "payload": {"chat_id": 42}},
+    "invalid SEND_MESSAGE": {
+        "command": "SEND_MESSAGE",
+        "payload": {"chat_id": 42, "text": "", "client_message_id": "nope"},
+    },
+}
+
+
+def previous_path(raw: str):
+    "What the if/elif loop did with a frame before the handler ran"
+    data = json.loads(raw)
+    command = data.get("command")
+    if isinstance(command, str) and command in WebSocketCommand.__members__:
+        pass
+    payload = data.get("payload")
+    if command == WebSocketCommand.SEND_MESSAGE:
+        try:
+            return MessageCreate(**payload, sender_id=1)
+        except ValidationError:
+            return None
+    if command == WebSocketCommand.READ_MESSAGE:
+        return payload.get("id"), payload.get("chat_id")
+    return payload.get("chat_id")
+
+
+def dispatcher_path(raw: str):
+    try:
+        return client_frame_adapter.validate_json(raw)
+    except ValidationError:
+        return None
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{'frame':22} {'previous':>12} {'dispatcher':>12}")
+    for name, frame in FRAMES.items():
+        raw = json.dumps(frame)
+        timings = []
+        for path in (previous_path, dispatcher_path):
+            seconds = min(timeit.repeat(lambda: path(raw), number=iterations, repeat=3))
+            timings.append(seconds / iterations * 1e6)
+        print(f"{name:22} {timings[0]:9.2f} us {timings[1]:9.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Memory held by idle WebSocket connections.
+
+Seeds a SQLite database with one user per connection, each a member of a few
+chats, then opens the connections through the ASGI app in process: every
+connection authenticates, subscribes to its rooms and waits for a frame that
+never comes. Reports the growth of RSS per connection and, for a smaller
+sample, the Python heap per connection traced by tracemalloc.
+
+Run from the repository root (Linux, RSS is read from /proc):
+    python -m benchmarks.bench_ws_memory [connections] [chats_per_user]
+"""
+import os
+import sys
+import gc
+import asyncio
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), f"bench_ws_{uuid.uuid4().hex}.sqlite")
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + DATABASE_PATH
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["LOG_LEVEL"] = "WARNING"
+os.environ["TRACING_ENABLED"] = "false"
+
+from sqlalchemy import create_engine, insert
+from app.db.base import Base, async_engine
+from app.db.models import Chat, User, UserChat
+from app.core.security import create_access_token
+from app.core.websocket import Connection, ws_manager
+from app.main import app
+
+CONCURRENCY = 50
+ROOM_SIZE = 250
+SAMPLE = 1000
+
+
+def seed(users: int, chats_per_user: int):
+    engine = create_engine("sqlite:///" + DATABASE_PATH)
+    tables = [table for name, table in Base.metadata.tables.items() if name != "groups"]
+    Base.metadata.create_all(engine, tables=tables)
+    chats = max(users * chats_per_user // ROOM_SIZE, chats_per_user)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "hashed_password": "x"}
+                for i in range(1, users + 1)
+            ],
+        )
+        connection.execute(
+            insert(Chat), [{"id": i, "name": f"chat {i}", "is_group": True} for i in range(1, chats + 1)]
+        )
+        connection.execute(
+            insert(UserChat),
+            [
+                {"user_id": i, "chat_id": (i * chats_per_user + j) % chats + 1}
+                for i in range(1, users + 1)
+                for j in range(chats_per_user)
+            ],
+        )
+    engine.dispose()
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class IdleClient:
+    "ASGI WebSocket client that connects and then stays silent"
+
+    def __init__(self, user_id: int):
+        self.token = create_access_token(data={"sub": f"user{user_id}@example.com"})
+        self.accepted = asyncio.Event()
+        self.closed: asyncio.Future | None = None
+        self.connected = False
+
+    async def receive(self):
+        if not self.connected:
+            self.connected = True
+            return {"type": "websocket.connect"}
+        self.closed = asyncio.get_running_loop().create_future()
+        return await self.closed
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.close":
+            raise RuntimeError(f"Connection refused: {message}")
+
+    def scope(self) -> dict:
+        path = f"/ws/{self.token}"
+        return {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "subprotocols": [],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+
+    def disconnect(self):
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result({"type": "websocket.disconnect", "code": 1000})
+
+
+async def open_connections(clients: list[IdleClient]) -> list[asyncio.Task]:
+    limit = asyncio.Semaphore(CONCURRENCY)
+    tasks = []
+
+    async def open_one(client: IdleClient):
+        async with limit:
+            tasks.append(asyncio.create_task(app(client.scope(), client.receive, client.send)))
+            await client.accepted.wait()
+            # wait until the endpoint is parked in receive
+            while client.closed is None:
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(open_one(client) for client in clients))
+    return tasks
+
+
+async def close_connections(clients: list[IdleClient], tasks: list[asyncio.Task]):
+    for client in clients:
+        client.disconnect()
+    await asyncio.gather(*tasks)
+
+
+async def measure(users: range) -> tuple[int, float]:
+    clients = [IdleClient(user_id) for user_id in users]
+    gc.collect()
+    before = rss()
+    start = time.perf_counter()
+    tasks = await open_connections(clients)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    grown = rss() - before
+    assert sum(map(len, ws_manager.active_connections.values())) == len(clients)
+    await close_connections(clients, tasks)
+    assert not ws_manager.active_connections and not ws_manager.rooms
+    return grown, elapsed
+
+
+async def heap_sample(users: range) -> int:
+    clients = [IdleClient(user_id) for user_id in users]
+    gc.collect()
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    tasks = await open_connections(clients)
+    gc.collect()
+    grown = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename"))
+    tracemalloc.stop()
+    await close_connections(clients, tasks)
+    return grown
+
+
+async def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    chats_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    seed(connections + SAMPLE, chats_per_user)
+    try:
+        # warm up the pool, imports and caches before measuring
+        await measure(range(connections + 1, connections + 101))
+        heap = await heap_sample(range(connections + 1, connections + SAMPLE + 1))
+        grown, elapsed = await measure(range(1, connections + 1))
+    finally:
+        await async_engine.dispose()
+        os.remove(DATABASE_PATH)
+    print(f"{connections} idle connections, {chats_per_user} chats per user, opened in {elapsed:.1f} s")
+    print(f"  RSS:         {grown / connections:8.0f} bytes per connection")
+    print(f"  Python heap: {heap / SAMPLE:8.0f} bytes per connection ({SAMPLE} sampled)")
+    print(f"  Connection record: {sys.getsizeof(Connection.__new__(Connection))} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,321 @@
+"""
+Soak test of WebSocket connection handling.
+
+Serves the app with uvicorn in process and churns connections against it
+through every way a connection ends: a normal close, invalid frames, a
+rejected token, a close by the server (AUTH as another user), an abrupt TCP
+drop and a command failing unexpectedly (a fault injected into TYPING on one
+chat). Every check interval new connections are paused until the open ones
+are done, then the connection registry, live Connection records, database
+sessions and pool checkouts, asyncio tasks and RSS are compared to the
+baseline taken after the warm-up. Any leak stops the run with exit status 1.
+
+Hours of production churn are compressed by running many clients back to
+back, e.g. four hours at 50 concurrent clients:
+    python -m benchmarks.soak_websocket 14400 50
+
+Run from the repository root (Linux, RSS is read from /proc):
+    python -m benchmarks.soak_websocket [seconds] [concurrency] [check_every_seconds]
+"""
+import os
+import sys
+import gc
+import json
+import time
+import uuid
+import socket
+import asyncio
+import tempfile
+
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), f"soak_ws_{uuid.uuid4().hex}.sqlite")
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + DATABASE_PATH
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["LOG_LEVEL"] = "CRITICAL"
+os.environ["LOG_JSON"] = "false"
+os.environ["TRACING_ENABLED"] = "false"
+
+import uvicorn
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+from app.db.base import Base, async_engine
+from app.db.models import Chat, User, UserChat
+from app.core.security import create_access_token
+from app.core.tasks import task_queue
+from app.core.typing_indicators import typing_tracker
+from app.core.websocket import Connection, ws_manager
+from app.main import app
+
+USERS = 100
+# every user is a member, TYPING in it fails inside the server
+FAULT_CHAT_ID = 1
+WARMUP_SECONDS = 10.0
+# RSS may grow this much over the baseline, allocator noise and caches
+RSS_GROWTH_LIMIT = 32 * 1024 * 1024
+SETTLE_TIMEOUT_SECONDS = 10.0
+
+
+def seed():
+    engine = create_engine("sqlite:///" + DATABASE_PATH)
+    tables = [table for name, table in Base.metadata.tables.items() if name != "groups"]
+    Base.metadata.create_all(engine, tables=tables)
+    users = range(1, USERS + 1)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "hashed_password": "x"}
+                for i in users
+            ],
+        )
+        # a chat of their own per user, so sends are echoed to the sender only
+        chats = [{"id": FAULT_CHAT_ID, "name": "fault", "is_group": True}]
+        chats += [{"id": own_chat(i), "name": f"user {i}", "is_group": False} for i in users]
+        connection.execute(insert(Chat), chats)
+        members = [{"user_id": i, "chat_id": FAULT_CHAT_ID} for i in users]
+        members += [{"user_id": i, "chat_id": own_chat(i)} for i in users]
+        connection.execute(insert(UserChat), members)
+    engine.dispose()
+
+
+def own_chat(user_id: int) -> int:
+    return 1000 + user_id
+
+
+def token(user_id: int) -> str:
+    return create_access_token(data={"sub": f"user{user_id}@example.com", "uid": user_id})
+
+
+def inject_fault():
+    typing = typing_tracker.typing
+
+    async def failing_typing(user_id: int, chat_id: int):
+        if chat_id == FAULT_CHAT_ID:
+            raise RuntimeError("injected fault")
+        await typing(user_id, chat_id)
+
+    typing_tracker.typing = failing_typing
+
+
+def frame(command: str, payload: dict) -> str:
+    return json.dumps({"command": command, "payload": payload})
+
+
+async def receive(websocket, predicate) -> dict:
+    "Skip frames until one matches, deliveries of a dropped connection of the user may come first"
+    while True:
+        reply = json.loads(await websocket.recv())
+        if predicate(reply):
+            return reply
+
+
+async def until_closed(websocket):
+    "Skip frames until the server closes the connection, failing if it does not"
+    try:
+        await asyncio.wait_for(receive(websocket, lambda reply: False), SETTLE_TIMEOUT_SECONDS)
+    except ConnectionClosed:
+        return
+
+
+async def normal_close(uri: str, user_id: int):
+    async with connect(f"{uri}/ws/{token(user_id)}") as websocket:
+        payload = {"chat_id": own_chat(user_id), "text": "soak", "client_message_id": str(uuid.uuid4())}
+        await websocket.send(frame("SEND_MESSAGE", payload))
+        await receive(websocket, lambda reply: reply.get("client_message_id") == payload["client_message_id"])
+        await websocket.send(frame("TYPING", {"chat_id": own_chat(user_id)}))
+
+
+async def invalid_frames(uri: str, user_id: int):
+    async with connect(f"{uri}/ws/{token(user_id)}") as websocket:
+        await websocket.send("{")
+        await receive(websocket, lambda reply: reply.get("code") == "invalid_json")
+        await websocket.send(frame("SHOUT", {}))
+        await receive(websocket, lambda reply: reply.get("command") == "ERROR")
+
+
+async def rejected_token(uri: str, user_id: int):
+    try:
+        async with connect(f"{uri}/ws/not-a-token"):
+            pass
+    except (InvalidStatus, ConnectionClosed):
+        return
+    raise AssertionError("Invalid token was accepted")
+
+
+async def closed_by_server(uri: str, user_id: int):
+    other = user_id % USERS + 1
+    async with connect(f"{uri}/ws/{token(user_id)}") as websocket:
+        await websocket.send(frame("AUTH", {"token": token(other)}))
+        await until_closed(websocket)
+
+
+async def tcp_drop(uri: str, user_id: int):
+    websocket = await connect(f"{uri}/ws/{token(user_id)}")
+    payload = {"chat_id": own_chat(user_id), "text": "dropped", "client_message_id": str(uuid.uuid4())}
+    await websocket.send(frame("SEND_MESSAGE", payload))
+    # no close frame, no FIN: the server finds out from a reset socket
+    websocket.transport.abort()
+
+
+async def server_error(uri: str, user_id: int):
+    async with connect(f"{uri}/ws/{token(user_id)}") as websocket:
+        await websocket.send(frame("TYPING", {"chat_id": FAULT_CHAT_ID}))
+        await until_closed(websocket)
+
+
+EXIT_PATHS = (normal_close, invalid_frames, rejected_token, closed_by_server, tcp_drop, server_error)
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def snapshot() -> dict:
+    gc.collect()
+    objects = gc.get_objects()
+    return {
+        "connections": sum(map(len, ws_manager.active_connections.values())),
+        "online_users": len(ws_manager.user_chats),
+        "rooms": len(ws_manager.rooms),
+        "connection_records": sum(isinstance(o, Connection) for o in objects),
+        "sessions": sum(isinstance(o, AsyncSession) for o in objects),
+        "pool_checked_out": async_engine.pool.checkedout(),
+        "tasks": len(asyncio.all_tasks()),
+        "rss": rss(),
+    }
+
+
+def leaks(baseline: dict, current: dict) -> list[str]:
+    # with no client connected nothing may be held at all
+    found = [
+        f"{key}: {current[key]}"
+        for key in ("connections", "online_users", "rooms", "connection_records", "sessions", "pool_checked_out")
+        if current[key]
+    ]
+    if current["tasks"] > baseline["tasks"]:
+        found.append(f"tasks: {current['tasks']} (baseline {baseline['tasks']})")
+    if current["rss"] - baseline["rss"] > RSS_GROWTH_LIMIT:
+        growth = (current["rss"] - baseline["rss"]) / 2**20
+        found.append(f"rss: grew {growth:.1f} MiB over the baseline")
+    return found
+
+
+class Churn:
+    "Clients running the exit paths back to back, pausable for checks"
+
+    def __init__(self, uri: str, concurrency: int):
+        self.uri = uri
+        self.concurrency = concurrency
+        self.running = asyncio.Event()
+        self.running.set()
+        self.in_flight = 0
+        self.done = {path.__name__: 0 for path in EXIT_PATHS}
+        self.errors: list[str] = []
+        self.stopped = False
+
+    async def client(self, number: int):
+        user_id = number % USERS + 1
+        turn = number
+        while not self.stopped:
+            await self.running.wait()
+            if self.stopped:
+                return
+            path = EXIT_PATHS[turn % len(EXIT_PATHS)]
+            turn += 1
+            self.in_flight += 1
+            try:
+                await path(self.uri, user_id)
+                self.done[path.__name__] += 1
+            except Exception as e:
+                # e.g. the server did not close a connection it should have
+                self.errors.append(f"{path.__name__}: {e!r}")
+            finally:
+                self.in_flight -= 1
+
+    async def pause(self):
+        self.running.clear()
+        while self.in_flight:
+            await asyncio.sleep(0.01)
+
+    def resume(self):
+        self.running.set()
+
+    async def stop(self, clients: list[asyncio.Task]):
+        self.stopped = True
+        self.running.set()
+        await asyncio.gather(*clients)
+
+
+async def settle(baseline: dict | None) -> dict:
+    """
+    Wait for server-side cleanup of the connections just closed, a dropped
+    socket is only noticed once the server reads from it.
+    """
+    deadline = time.monotonic() + SETTLE_TIMEOUT_SECONDS
+    while True:
+        await asyncio.sleep(0.1)
+        if task_queue.depth():
+            continue
+        current = snapshot()
+        if not leaks(baseline or current, current) or time.monotonic() > deadline:
+            return current
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    check_every = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    seed()
+    inject_fault()
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="critical"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    churn = Churn(f"ws://127.0.0.1:{port}", concurrency)
+    clients = [asyncio.create_task(churn.client(number)) for number in range(concurrency)]
+    failed = []
+    try:
+        await asyncio.sleep(WARMUP_SECONDS)
+        await churn.pause()
+        baseline = await settle(None)
+        print(f"baseline after warm-up: {baseline}")
+        failed = churn.errors + leaks(baseline, baseline)
+        churn.resume()
+        start = time.monotonic()
+        while not failed and time.monotonic() - start < seconds:
+            await asyncio.sleep(min(check_every, seconds - (time.monotonic() - start)))
+            await churn.pause()
+            current = await settle(baseline)
+            elapsed = time.monotonic() - start
+            total = sum(churn.done.values())
+            print(
+                f"{elapsed:8.0f} s {total:9d} connections, {total / elapsed:6.0f}/s, "
+                f"rss {current['rss'] / 2**20:6.1f} MiB, tasks {current['tasks']}, "
+                f"records {current['connection_records']}, sessions {current['sessions']}"
+            )
+            failed = churn.errors + leaks(baseline, current)
+            churn.resume()
+    finally:
+        await churn.stop(clients)
+        server.should_exit = True
+        await serving
+        await async_engine.dispose()
+        os.remove(DATABASE_PATH)
+    print("connections by exit path: " + ", ".join(f"{name} {count}" for name, count in churn.done.items()))
+    if failed:
+        print("LEAK DETECTED:\n  " + "\n  ".join(failed), file=sys.stderr)
+        sys.exit(1)
+    print("no leaks")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
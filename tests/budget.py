@@ -0,0 +1,46 @@
+"""
+Query and latency budgets of single calls, read from their traces.
+"""
+import os
+import time
+from app.core.tracing import Trace, recent_traces
+
+# multiplies every latency bound, for slow machines
+LATENCY_SCALE = float(os.environ.get("PERF_LATENCY_SCALE", "1"))
+# true in tests marked latency, set by conftest
+check_latency = False
+
+
+def last_trace(name: str, timeout: float = 1.0) -> Trace:
+    """
+    Newest trace called name. WebSocket commands finish their trace after
+    the reply is sent, so wait for it briefly.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        for trace in reversed(recent_traces):
+            if trace.name == name:
+                return trace
+        if time.monotonic() > deadline:
+            raise AssertionError(f"No trace {name!r} recorded")
+        time.sleep(0.005)
+
+
+def assert_budget(trace: Trace, max_queries: int, max_ms: float | None = None):
+    """
+    Fail when the traced call ran more than max_queries statements or, in a
+    test marked latency, took longer than max_ms on the server.
+    """
+    statements = "\n".join(
+        f"{count}x {statement}" for statement, count in trace.statements.most_common()
+    )
+    assert trace.queries <= max_queries, (
+        f"{trace.name}: {trace.queries} queries, budget {max_queries}\n{statements}"
+    )
+    if max_ms is None or not check_latency:
+        return
+    duration_ms = trace.duration * 1e3
+    bound_ms = max_ms * LATENCY_SCALE
+    assert duration_ms <= bound_ms, (
+        f"{trace.name}: {duration_ms:.1f} ms, bound {bound_ms:.0f} ms"
+    )
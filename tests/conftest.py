@@ -0,0 +1,165 @@
+"""
+Fixtures running the app against a temporary SQLite database.
+
+The app runs for the whole session, but each test module gets a freshly
+seeded database file, removed once the module is done, so modules do not
+see each other's writes.
+
+Every request and WebSocket command is traced (see app.core.tracing), so
+tests read the number of statements and the server-side duration of a call
+from the trace it left, see budget.py. Latency bounds only hold in tests
+marked latency, wall-clock time is too noisy for the others.
+"""
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import suppress
+from dataclasses import dataclass, field
+
+DATABASE_DIR = tempfile.mkdtemp(prefix="chat-tests-")
+DATABASE_PATH = os.path.join(DATABASE_DIR, "test.sqlite")
+
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + DATABASE_PATH
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ["TRACING_ENABLED"] = "true"
+os.environ["TRACE_SAMPLE_RATE"] = "1"
+os.environ["LOG_JSON"] = "false"
+os.environ["LOG_LEVEL"] = "WARNING"
+os.environ["DEBUG_ENDPOINTS_ENABLED"] = "true"
+# the last seeded user
+os.environ["ADMIN_EMAILS"] = '["user500@example.com"]'
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from app.db.base import Base, async_engine
+from app.db.models import Chat, Message, User, UserChat
+from app.core.profiles import profile_cache
+from app.core.security import create_access_token
+from app.core.tracing import recent_traces
+from app.main import app
+import budget
+
+# groups uses a PostgreSQL ARRAY column and is not used by the endpoints
+TABLES = [table for name, table in Base.metadata.tables.items() if name != "groups"]
+USERS = 500
+LARGE_GROUP_MEMBERS = 400
+HISTORY_MESSAGES = 20000
+# chats of the busy user, for the chat list
+BUSY_USER_CHATS = 300
+
+
+@dataclass
+class Seed:
+    users: list[int]
+    emails: dict[int, str]
+    dm_chat_id: int
+    large_group_id: int
+    history_chat_id: int
+    busy_user_id: int
+    tokens: dict[int, str] = field(default_factory=dict)
+
+    def token(self, user_id: int) -> str:
+        if user_id not in self.tokens:
+            self.tokens[user_id] = create_access_token(data={"sub": self.emails[user_id]})
+        return self.tokens[user_id]
+
+    def headers(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.token(user_id)}"}
+
+
+def seed_database() -> Seed:
+    engine = create_engine("sqlite:///" + DATABASE_PATH)
+    Base.metadata.create_all(engine, tables=TABLES)
+    users = list(range(1, USERS + 1))
+    emails = {user_id: f"user{user_id}@example.com" for user_id in users}
+    owner, peer, busy = users[0], users[1], users[2]
+    now = int(time.time())
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"id": user_id, "name": f"User {user_id}", "email": email, "hashed_password": "x"}
+                for user_id, email in emails.items()
+            ],
+        )
+        chats = [
+            {"id": 1, "name": "DM", "is_group": False, "creator_id": None},
+            {"id": 2, "name": "Large group", "is_group": True, "creator_id": owner},
+            {"id": 3, "name": "Long history", "is_group": False, "creator_id": None},
+        ]
+        chats += [
+            {"id": chat_id, "name": f"Group {chat_id}", "is_group": True, "creator_id": busy}
+            for chat_id in range(4, 4 + BUSY_USER_CHATS)
+        ]
+        connection.execute(insert(Chat), chats)
+        members = [(owner, 1), (peer, 1), (owner, 3), (peer, 3)]
+        members += [(user_id, 2) for user_id in users[:LARGE_GROUP_MEMBERS]]
+        members += [(busy, chat["id"]) for chat in chats[3:]]
+        connection.execute(
+            insert(UserChat), [{"user_id": u, "chat_id": c} for u, c in members]
+        )
+        connection.execute(
+            insert(Message),
+            [
+                {
+                    "chat_id": 3,
+                    "sender_id": owner if i % 2 else peer,
+                    "text": f"Message {i}",
+                    "client_message_id": uuid.uuid4(),
+                    "timestamp": now - HISTORY_MESSAGES + i,
+                    "is_read": True,
+                }
+                for i in range(HISTORY_MESSAGES)
+            ],
+        )
+    engine.dispose()
+    return Seed(
+        users=users,
+        emails=emails,
+        dm_chat_id=1,
+        large_group_id=2,
+        history_chat_id=3,
+        busy_user_id=busy,
+    )
+
+
+@pytest.fixture(scope="session")
+def client():
+    # empty until the first module seeds it, for the startup of the app
+    engine = create_engine("sqlite:///" + DATABASE_PATH)
+    Base.metadata.create_all(engine, tables=TABLES)
+    engine.dispose()
+    with TestClient(app) as client:
+        yield client
+    shutil.rmtree(DATABASE_DIR, ignore_errors=True)
+
+
+def remove_database(client):
+    # connections of the app to the old file are closed, they would keep it
+    client.portal.call(async_engine.dispose)
+    with suppress(FileNotFoundError):
+        os.remove(DATABASE_PATH)
+    profile_cache.entries.clear()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed(client) -> Seed:
+    remove_database(client)
+    yield seed_database()
+    remove_database(client)
+
+
+@pytest.fixture
+def traces():
+    recent_traces.clear()
+    return recent_traces
+
+
+@pytest.fixture(autouse=True)
+def latency_bounds(request):
+    budget.check_latency = request.node.get_closest_marker("latency") is not None
+    yield
+    budget.check_latency = False
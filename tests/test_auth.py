@@ -0,0 +1,123 @@
+import time
+from sqlalchemy import func, select
+from app.core.revocation import revocation_list
+from app.db.base import AsyncLocalSession
+from app.db.models import RevokedToken
+from budget import assert_budget, last_trace
+
+
+def test_register(client, traces):
+    response = client.post(
+        "/register/",
+        json={"name": "New user", "email": "new.user@example.com", "password": "secret1"},
+    )
+    assert response.status_code == 201, response.text
+    assert_budget(last_trace("POST /register/"), max_queries=3)
+
+
+def test_register_existing_email(client, seed, traces):
+    response = client.post(
+        "/register/",
+        json={"name": "Copy", "email": seed.emails[seed.users[0]], "password": "secret1"},
+    )
+    assert response.status_code == 400
+    assert_budget(last_trace("POST /register/"), max_queries=1)
+
+
+def test_token(client, traces):
+    client.post(
+        "/register/",
+        json={"name": "Login", "email": "login@example.com", "password": "secret1"},
+    )
+    traces.clear()
+    response = client.post(
+        "/token/", data={"username": "login@example.com", "password": "secret1"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["token_type"] == "bearer"
+    # user lookup and the token family of the refresh token
+    assert_budget(last_trace("POST /token/"), max_queries=2)
+
+
+def test_token_invalid_credentials(client, traces):
+    response = client.post(
+        "/token/", data={"username": "nobody@example.com", "password": "secret1"}
+    )
+    assert response.status_code == 401
+    assert_budget(last_trace("POST /token/"), max_queries=1)
+
+
+def login(client, email: str) -> dict:
+    client.post(
+        "/register/", json={"name": "Refresh", "email": email, "password": "secret1"}
+    )
+    response = client.post("/token/", data={"username": email, "password": "secret1"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_refresh_rotates_without_password(client, traces):
+    tokens = login(client, "refresh@example.com")
+    response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200, response.text
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    # only the compare and set of the rotation, no user lookup or hashing
+    assert_budget(last_trace("POST /token/refresh"), max_queries=1)
+    headers = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert client.get("/chats/", headers=headers).status_code == 200
+
+
+def test_reused_refresh_token_revokes_family(client):
+    tokens = login(client, "reuse@example.com")
+    refreshed = client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    ).json()
+    reused = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert reused.status_code == 401
+    # the legitimate holder is logged out too
+    response = client.post(
+        "/token/refresh", json={"refresh_token": refreshed["refresh_token"]}
+    )
+    assert response.status_code == 401
+    headers = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert client.get("/chats/", headers=headers).status_code == 401
+
+
+def test_revoke(client):
+    tokens = login(client, "logout@example.com")
+    response = client.post("/token/revoke", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/chats/", headers=headers).status_code == 401
+    response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_access_token_is_not_a_refresh_token(client):
+    tokens = login(client, "types@example.com")
+    response = client.post("/token/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert client.get("/chats/", headers=headers).status_code == 401
+
+
+def test_revocation_committed_out_of_id_order_is_synced(client):
+    async def revoke_elsewhere() -> bool:
+        await revocation_list.sync()
+        async with AsyncLocalSession() as session:
+            # another process took a lower id but committed after the sync
+            lowest = (await session.execute(select(func.min(RevokedToken.id)))).scalar() or 0
+            session.add(
+                RevokedToken(
+                    id=lowest - 1,
+                    family="elsewhere",
+                    expires_at=int(time.time()) + 3600,
+                    created_at=int(time.time()) - 5,
+                )
+            )
+            await session.commit()
+        await revocation_list.sync()
+        return revocation_list.is_revoked("elsewhere")
+
+    assert client.portal.call(revoke_elsewhere)
@@ -0,0 +1,89 @@
+import pytest
+from budget import assert_budget, last_trace
+
+
+@pytest.mark.latency
+def test_chat_list_does_not_grow_with_chats(client, seed, traces):
+    for user_id in (seed.users[0], seed.busy_user_id):
+        response = client.get("/chats/", headers=seed.headers(user_id))
+        assert response.status_code == 200
+        assert_budget(last_trace("GET /chats/"), max_queries=2, max_ms=50)
+    # the large group and the busy user's groups
+    assert len(response.json()) == 301
+
+
+def test_chat_list_not_modified(client, seed, traces):
+    headers = seed.headers(seed.busy_user_id)
+    etag = client.get("/chats/", headers=headers).headers["ETag"]
+    response = client.get("/chats/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    # only the user lookup of authentication
+    assert_budget(last_trace("GET /chats/"), max_queries=1)
+
+
+def test_create_direct_chat(client, seed, traces):
+    response = client.post(
+        "/chats/",
+        json={"name": "Direct", "recipient_id": seed.users[-1]},
+        headers=seed.headers(seed.users[-2]),
+    )
+    assert response.status_code == 201, response.text
+    assert_budget(last_trace("POST /chats/"), max_queries=7)
+
+
+def test_create_group_chat(client, seed, traces):
+    response = client.post(
+        "/chats/",
+        json={"name": "New group", "is_group": True},
+        headers=seed.headers(seed.users[3]),
+    )
+    assert response.status_code == 201, response.text
+    assert_budget(last_trace("POST /chats/"), max_queries=5)
+
+
+@pytest.mark.latency
+def test_add_user_to_large_group(client, seed, traces):
+    response = client.post(
+        f"/chats/{seed.large_group_id}/add-user",
+        params={"user_id": seed.users[-1]},
+        headers=seed.headers(seed.users[0]),
+    )
+    assert response.status_code == 200, response.text
+    assert_budget(
+        last_trace("POST /chats/{chat_id}/add-user"), max_queries=8, max_ms=100
+    )
+
+
+def test_exit_large_group(client, seed, traces):
+    response = client.delete(
+        f"/chats/{seed.large_group_id}/exit", headers=seed.headers(seed.users[10])
+    )
+    assert response.status_code == 200, response.text
+    assert_budget(last_trace("DELETE /chats/{chat_id}/exit"), max_queries=6)
+
+
+def test_set_retention(client, seed, traces):
+    response = client.patch(
+        f"/chats/{seed.large_group_id}/retention",
+        json={"retention_days": 30},
+        headers=seed.headers(seed.users[0]),
+    )
+    assert response.status_code == 200, response.text
+    assert_budget(
+        last_trace("PATCH /chats/{chat_id}/retention"), max_queries=4
+    )
+
+
+def test_set_retention_of_a_group_is_for_its_creator(client, seed):
+    url = f"/chats/{seed.large_group_id}/retention"
+    body = {"retention_days": None}
+    # a member, not the creator
+    response = client.patch(url, json=body, headers=seed.headers(seed.users[1]))
+    assert response.status_code == 403
+    # an admin, not a member
+    response = client.patch(url, json=body, headers=seed.headers(seed.users[-1]))
+    assert response.status_code == 200, response.text
+    response = client.patch(
+        f"/chats/{seed.dm_chat_id}/retention", json=body, headers=seed.headers(seed.users[1])
+    )
+    assert response.status_code == 200, response.text
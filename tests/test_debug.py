@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/debug/traces", "/debug/maintenance", "/debug/tasks", "/debug/spool", "/debug/reactions", "/debug/scheduler"])
+def test_debug_endpoints_are_for_admins(client, seed, path):
+    response = client.get(path, headers=seed.headers(seed.users[0]))
+    assert response.status_code == 403
+
+
+def test_debug_traces(client, seed, traces):
+    response = client.get("/debug/traces", headers=seed.headers(seed.users[-1]))
+    assert response.status_code == 200, response.text
+
+
+def test_debug_tasks(client, seed):
+    response = client.get("/debug/tasks", headers=seed.headers(seed.users[-1]))
+    assert response.status_code == 200, response.text
+    assert "depth" in response.json()
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import time
+import uuid
+import pytest
+from sqlalchemy import func, select
+from app.core.attachments import attachment_storage
+from app.core.config import settings
+from app.db.base import AsyncLocalSession
+from app.db.maintenance import DAY, Maintenance
+from app.db.models import Attachment, AttachmentUpload, Chat, Message, Reaction, ReactionCount
+
+
+@pytest.fixture
+def maintenance(tmp_path, monkeypatch):
+    "A maintenance runner with small batches, storing files under tmp_path"
+    monkeypatch.setattr(attachment_storage, "root", tmp_path)
+    monkeypatch.setattr(settings, "MAINTENANCE_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "MAINTENANCE_BATCH_PAUSE_SECONDS", 0)
+    return Maintenance()
+
+
+def add_messages(chat_id: int, sender_id: int, timestamps: list[int]) -> list[Message]:
+    return [
+        Message(
+            chat_id=chat_id,
+            sender_id=sender_id,
+            text=f"At {timestamp}",
+            timestamp=timestamp,
+            client_message_id=uuid.uuid4(),
+        )
+        for timestamp in timestamps
+    ]
+
+
+def write_file(path, content: bytes = b"content", age: float = 0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+
+def count(client, stmt) -> int:
+    async def read() -> int:
+        async with AsyncLocalSession() as session:
+            return await session.scalar(stmt)
+
+    return client.portal.call(read)
+
+
+def test_expired_messages_are_deleted_in_batches(client, seed, maintenance):
+    chat_id, sender = seed.dm_chat_id, seed.users[0]
+    now = int(time.time())
+    old = [now - 40 * DAY - i for i in range(5)]
+
+    async def add():
+        async with AsyncLocalSession() as session:
+            chat = await session.get(Chat, chat_id)
+            chat.retention_days = 30
+            messages = add_messages(chat_id, sender, old + [now - DAY])
+            session.add_all(messages)
+            await session.flush()
+            session.add(Reaction(message_id=messages[0].id, user_id=sender, emoji="👍", chat_id=chat_id))
+            session.add(ReactionCount(message_id=messages[0].id, emoji="👍", count=1))
+            await session.commit()
+
+    client.portal.call(add)
+    url, headers = f"/history/{chat_id}", seed.headers(sender)
+    etag = client.get(url, headers=headers).headers["ETag"]
+    assert client.portal.call(maintenance.expire_messages) == len(old)
+    # 2 + 2 + 1
+    assert maintenance.stats.batches == 3
+    assert maintenance.stats.messages_deleted == len(old)
+    assert count(client, select(func.count()).select_from(Reaction)) == 0
+    assert count(client, select(func.count()).select_from(ReactionCount)) == 0
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert [message["timestamp"] for message in response.json()] == [now - DAY]
+    # the long history chat keeps everything without a default retention
+    stmt = select(func.count()).where(Message.chat_id == seed.history_chat_id)
+    assert count(client, stmt) == 20000
+
+
+def test_orphan_chats_are_removed_with_their_files(client, seed, maintenance):
+    sender = seed.users[0]
+    own, shared = "a" * 64, "b" * 64
+    upload_id = uuid.uuid4()
+
+    async def add() -> int:
+        async with AsyncLocalSession() as session:
+            orphan = Chat(name="Nobody left", is_group=True)
+            session.add(orphan)
+            await session.flush()
+            session.add_all(add_messages(orphan.id, sender, [int(time.time())] * 3))
+            for chat_id, sha256 in ((orphan.id, own), (orphan.id, shared), (seed.dm_chat_id, shared)):
+                session.add(
+                    Attachment(
+                        chat_id=chat_id,
+                        uploader_id=sender,
+                        filename="file.txt",
+                        content_type="text/plain",
+                        size=7,
+                        sha256=sha256,
+                    )
+                )
+            session.add(
+                AttachmentUpload(
+                    id=upload_id,
+                    chat_id=orphan.id,
+                    uploader_id=sender,
+                    filename="part.txt",
+                    content_type="text/plain",
+                    size=100,
+                )
+            )
+            await session.commit()
+            return orphan.id
+
+    orphan_id = client.portal.call(add)
+    for sha256 in (own, shared):
+        write_file(attachment_storage.object_path(sha256))
+    write_file(attachment_storage.part_path(upload_id))
+    assert client.portal.call(maintenance.remove_orphan_chats) == 1
+    assert maintenance.stats.attachments_deleted == 2
+    assert count(client, select(func.count()).where(Message.chat_id == orphan_id)) == 0
+    assert count(client, select(func.count()).where(Chat.id == orphan_id)) == 0
+    assert count(client, select(func.count()).where(Attachment.sha256 == shared)) == 1
+    assert not attachment_storage.object_path(own).exists()
+    # still the file of the DM's attachment
+    assert attachment_storage.object_path(shared).exists()
+    assert not attachment_storage.part_path(upload_id).exists()
+    # chats with members stay
+    assert client.portal.call(maintenance.remove_orphan_chats) == 0
+
+
+def upload(client, seed, content: bytes) -> dict:
+    headers = seed.headers(seed.users[0])
+    body = {"chat_id": seed.dm_chat_id, "filename": "file.txt", "size": len(content)}
+    upload_id = client.post("/attachments/uploads", json=body, headers=headers).json()["id"]
+    response = client.patch(
+        f"/attachments/uploads/{upload_id}",
+        content=content,
+        headers={**headers, "Upload-Offset": "0"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["attachment"]
+
+
+def test_upload_keeps_the_file_of_a_removed_orphan(client, seed, maintenance):
+    sender = seed.users[0]
+    shared, removed = b"shared content", b"removed content"
+
+    async def add_orphan(content: bytes):
+        async with AsyncLocalSession() as session:
+            orphan = Chat(name="Nobody left", is_group=True)
+            session.add(orphan)
+            await session.flush()
+            session.add(
+                Attachment(
+                    chat_id=orphan.id,
+                    uploader_id=sender,
+                    filename="file.txt",
+                    content_type="text/plain",
+                    size=len(content),
+                    sha256=hashlib.sha256(content).hexdigest(),
+                )
+            )
+            await session.commit()
+
+    for content in (shared, removed):
+        client.portal.call(add_orphan, content)
+        write_file(attachment_storage.object_path(hashlib.sha256(content).hexdigest()), content)
+    # completed while the orphan still references the stored file
+    attachment = upload(client, seed, shared)
+    assert client.portal.call(maintenance.remove_orphan_chats) == 2
+    # completed after the file was removed with the orphan, stored again
+    attachments = [attachment, upload(client, seed, removed)]
+    for attachment, content in zip(attachments, (shared, removed)):
+        assert attachment["sha256"] == hashlib.sha256(content).hexdigest()
+        response = client.get(f"/attachments/{attachment['id']}", headers=seed.headers(sender))
+        assert response.status_code == 200 and response.content == content
+    assert not list((attachment_storage.root / "uploads").glob("*.part"))
+
+
+def test_abandoned_uploads_are_removed_with_their_part_files(client, seed, maintenance):
+    ttl = settings.ATTACHMENT_UPLOAD_TTL_SECONDS
+    now = int(time.time())
+    abandoned, resumed, fresh = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    stray = uuid.uuid4()
+
+    async def add():
+        async with AsyncLocalSession() as session:
+            for upload_id, created_at, claimed_until in (
+                (abandoned, now - 2 * ttl, None),
+                (resumed, now - 2 * ttl, now),
+                (fresh, now, None),
+            ):
+                session.add(
+                    AttachmentUpload(
+                        id=upload_id,
+                        chat_id=seed.dm_chat_id,
+                        uploader_id=seed.users[0],
+                        filename="part.txt",
+                        content_type="text/plain",
+                        size=100,
+                        created_at=created_at,
+                        claimed_until=claimed_until,
+                    )
+                )
+            await session.commit()
+
+    client.portal.call(add)
+    for upload_id in (abandoned, resumed, fresh):
+        write_file(attachment_storage.part_path(upload_id))
+    # left behind without its row, e.g. by a process stopped in between
+    write_file(attachment_storage.part_path(stray), age=2 * ttl)
+    assert client.portal.call(maintenance.expire_uploads) == 1
+    assert maintenance.stats.uploads_deleted == 1
+    assert not attachment_storage.part_path(abandoned).exists()
+    assert not attachment_storage.part_path(stray).exists()
+    assert attachment_storage.part_path(resumed).exists()
+    assert attachment_storage.part_path(fresh).exists()
+    assert count(client, select(func.count()).select_from(AttachmentUpload)) == 2
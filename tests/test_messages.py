@@ -0,0 +1,243 @@
+import json
+import time
+import uuid
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from app.core.profiles import profile_cache
+from app.core.security import create_access_token
+from app.db.base import AsyncLocalSession
+from app.db.import_messages import write_rows
+from budget import assert_budget, last_trace
+
+
+@pytest.mark.parametrize("offset", [0, 19900])
+@pytest.mark.latency
+def test_history_page(client, seed, traces, offset):
+    response = client.get(
+        f"/history/{seed.history_chat_id}",
+        params={"limit": 100, "offset": offset},
+        headers=seed.headers(seed.users[0]),
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 100
+    assert_budget(last_trace("GET /history/{chat_id}"), max_queries=3, max_ms=50)
+
+
+def test_history_not_modified(client, seed, traces):
+    headers = seed.headers(seed.users[0])
+    url = f"/history/{seed.history_chat_id}"
+    etag = client.get(url, headers=headers).headers["ETag"]
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert_budget(last_trace("GET /history/{chat_id}"), max_queries=2)
+
+
+def test_import_by_another_process_changes_the_etag(client, seed):
+    headers = seed.headers(seed.users[0])
+    url = f"/history/{seed.dm_chat_id}"
+    params = {"limit": 1000}
+    etag = client.get(url, params=params, headers=headers).headers["ETag"]
+    row = {
+        "chat_id": seed.dm_chat_id,
+        "sender_id": seed.users[1],
+        "text": "Imported",
+        "client_message_id": uuid.uuid4(),
+        "timestamp": int(time.time()),
+        "is_read": False,
+        "attachment_id": None,
+    }
+
+    async def import_row():
+        # the import CLI, nothing in this process sees the write
+        async with AsyncLocalSession() as session:
+            await write_rows(session, [row])
+
+    client.portal.call(import_row)
+    response = client.get(url, params=params, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Imported" in [message["text"] for message in response.json()]
+
+
+def test_history_expanded_with_sender(client, seed, traces):
+    profile_cache.entries.clear()
+    url = f"/history/{seed.history_chat_id}"
+    params = {"limit": 100, "expand": "sender"}
+    headers = seed.headers(seed.users[0])
+    for max_queries in (4, 3):
+        # one IN query for the senders of the page, none once cached
+        response = client.get(url, params=params, headers=headers)
+        assert response.status_code == 200
+        assert_budget(last_trace("GET /history/{chat_id}"), max_queries=max_queries)
+    senders = {message["sender"]["id"]: message["sender"]["name"] for message in response.json()}
+    assert senders == {user_id: f"User {user_id}" for user_id in seed.users[:2]}
+
+
+def test_profile_change_reaches_expanded_history(client, seed):
+    user_id = seed.users[1]
+    headers = seed.headers(user_id)
+    url = f"/history/{seed.history_chat_id}"
+    params = {"limit": 10, "expand": "sender"}
+    etag = client.get(url, params=params, headers=headers).headers["ETag"]
+    try:
+        response = client.patch("/users/me", json={"name": "Renamed"}, headers=headers)
+        assert response.status_code == 200 and response.json()["name"] == "Renamed"
+        response = client.get(url, params=params, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        names = {m["sender"]["name"] for m in response.json() if m["sender_id"] == user_id}
+        assert names == {"Renamed"}
+    finally:
+        client.patch("/users/me", json={"name": f"User {user_id}"}, headers=headers)
+
+
+def history_batch(client, headers: dict, body: dict) -> list[dict]:
+    response = client.post("/history/batch", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.latency
+def test_history_batch_all_chats(client, seed, traces):
+    pages = history_batch(client, seed.headers(seed.busy_user_id), {"limit": 20})
+    chat_ids = [page["chat_id"] for page in pages]
+    # the large group and the busy user's groups
+    assert len(chat_ids) == 301 and chat_ids == sorted(set(chat_ids))
+    # auth, membership and one windowed query, whatever the number of chats
+    assert_budget(last_trace("POST /history/batch"), max_queries=3, max_ms=200)
+
+
+def test_history_batch_cursor(client, seed):
+    headers = seed.headers(seed.users[0])
+    url = f"/history/{seed.history_chat_id}"
+    body = {"chats": [{"chat_id": seed.history_chat_id}, {"chat_id": seed.dm_chat_id}], "limit": 100}
+    pages = {page["chat_id"]: page for page in history_batch(client, headers, body)}
+    latest = pages[seed.history_chat_id]
+    assert latest["messages"] == client.get(url, params={"offset": 19900}, headers=headers).json()
+    body["chats"] = [{"chat_id": seed.history_chat_id, "before": latest["next_cursor"]}]
+    (older,) = history_batch(client, headers, body)
+    assert older["messages"] == client.get(url, params={"offset": 19800}, headers=headers).json()
+
+
+def test_history_batch_requires_membership(client, seed):
+    body = {"chats": [{"chat_id": seed.dm_chat_id}, {"chat_id": seed.history_chat_id}]}
+    response = client.post("/history/batch", json=body, headers=seed.headers(seed.busy_user_id))
+    assert response.status_code == 403
+
+
+def send_message(websocket, chat_id: int) -> dict:
+    websocket.send_json(
+        {
+            "command": "SEND_MESSAGE",
+            "payload": {
+                "chat_id": chat_id,
+                "text": "Hello",
+                "client_message_id": str(uuid.uuid4()),
+            },
+        }
+    )
+    return websocket.receive_json()
+
+
+@pytest.mark.parametrize("chat", ["dm_chat_id", "large_group_id"])
+def test_send_message(client, seed, traces, chat):
+    chat_id = getattr(seed, chat)
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        message = send_message(websocket, chat_id)
+        assert message["chat_id"] == chat_id
+        # the same whatever the size of the chat
+        assert_budget(last_trace("WS SEND_MESSAGE"), max_queries=6)
+
+
+def test_send_message_expanded(client, seed):
+    sender, peer = seed.users[0], seed.users[1]
+    with client.websocket_connect(f"/ws/{seed.token(peer)}?expand=sender") as expanded:
+        with client.websocket_connect(f"/ws/{seed.token(sender)}") as websocket:
+            message = send_message(websocket, seed.dm_chat_id)
+            assert "sender" not in message
+        delivered = expanded.receive_json()
+        assert delivered["id"] == message["id"]
+        assert delivered["sender"] == {"id": sender, "name": f"User {sender}"}
+
+
+def test_invalid_frames_get_error_replies(client, seed):
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        websocket.send_text("{not json")
+        assert websocket.receive_json()["code"] == "invalid_json"
+        websocket.send_json({"command": "SHOUT", "payload": {}})
+        assert websocket.receive_json()["code"] == "unknown_command"
+        websocket.send_json({"command": "SEND_MESSAGE", "payload": {"chat_id": seed.dm_chat_id, "text": ""}})
+        reply = websocket.receive_json()
+        assert reply["command"] == "ERROR" and reply["request"] == "SEND_MESSAGE"
+        assert reply["code"] == "invalid_payload"
+        assert {tuple(e["loc"]) for e in reply["errors"]} == {
+            ("payload", "text"),
+            ("payload", "client_message_id"),
+        }
+        assert all("input" not in e for e in reply["errors"])
+        payload = {
+            "chat_id": seed.dm_chat_id,
+            "sender_id": seed.users[1],
+            "text": "Hi",
+            "client_message_id": str(uuid.uuid4()),
+        }
+        websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+        reply = websocket.receive_json()
+        assert reply["code"] == "invalid_payload"
+        assert [tuple(e["loc"]) for e in reply["errors"]] == [("payload", "sender_id")]
+        # the connection is still usable
+        assert send_message(websocket, seed.dm_chat_id)["chat_id"] == seed.dm_chat_id
+
+
+def test_failed_commands_get_error_replies(client, seed):
+    with client.websocket_connect(f"/ws/{seed.token(seed.busy_user_id)}") as websocket:
+        payload = {"chat_id": seed.dm_chat_id, "text": "Hi", "client_message_id": str(uuid.uuid4())}
+        websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+        assert websocket.receive_json()["code"] == "forbidden"
+        websocket.send_json({"command": "READ_MESSAGE", "payload": {"id": 10**9}})
+        assert websocket.receive_json()["code"] == "not_found"
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        message = send_message(websocket, seed.dm_chat_id)
+        payload = {
+            "chat_id": seed.dm_chat_id,
+            "text": "Hello",
+            "client_message_id": message["client_message_id"],
+        }
+        websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+        reply = websocket.receive_json()
+        assert reply["code"] == "duplicate" and reply["request"] == "SEND_MESSAGE"
+
+
+def test_read_message(client, seed, traces):
+    sender, reader = seed.users[0], seed.users[1]
+    with client.websocket_connect(f"/ws/{seed.token(sender)}") as websocket:
+        message = send_message(websocket, seed.dm_chat_id)
+    with client.websocket_connect(f"/ws/{seed.token(reader)}") as websocket:
+        websocket.send_json(
+            {
+                "command": "READ_MESSAGE",
+                "payload": {"id": message["id"], "chat_id": seed.dm_chat_id},
+            }
+        )
+        assert_budget(last_trace("WS READ_MESSAGE"), max_queries=3)
+
+
+def test_auth_renews_connection(client, seed, traces):
+    user_id = seed.users[0]
+    old_token = create_access_token(data={"sub": seed.emails[user_id], "uid": user_id})
+    with client.websocket_connect(f"/ws/{old_token}") as websocket:
+        token = create_access_token(data={"sub": seed.emails[user_id], "uid": user_id})
+        websocket.send_json({"command": "AUTH", "payload": {"token": token}})
+        reply = websocket.receive_json()
+        assert reply["command"] == "AUTH" and reply["expires_at"] > time.time()
+        assert_budget(last_trace("WS AUTH"), max_queries=0)
+        assert send_message(websocket, seed.dm_chat_id)["chat_id"] == seed.dm_chat_id
+
+
+def test_auth_as_other_user_closes(client, seed):
+    user_id, other = seed.users[0], seed.users[1]
+    with client.websocket_connect(f"/ws/{seed.token(user_id)}") as websocket:
+        token = create_access_token(data={"sub": seed.emails[other], "uid": other})
+        websocket.send_json({"command": "AUTH", "payload": {"token": token}})
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
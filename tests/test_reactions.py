@@ -0,0 +1,140 @@
+import asyncio
+import uuid
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app.core.reactions import ReactionAggregator, reaction_aggregator
+from app.db.base import Base
+from app.db.models import Chat, Message, User
+from budget import assert_budget, last_trace
+
+
+def react(websocket, message: dict, emoji: str, remove: bool = False):
+    payload = {
+        "message_id": message["id"],
+        "chat_id": message["chat_id"],
+        "emoji": emoji,
+        "remove": remove,
+    }
+    websocket.send_json({"command": "REACT", "payload": payload})
+
+
+def sync(websocket):
+    "Wait until the commands sent so far ran, frames are handled in order"
+    websocket.send_text("{")
+    while websocket.receive_json().get("code") != "invalid_json":
+        pass
+
+
+def receive_reactions(websocket, message_id: int, expected: dict) -> dict:
+    "Skip frames until the counts of the message are the expected ones"
+    while True:
+        frame = websocket.receive_json()
+        if frame.get("command") == "REACT" and frame["message_id"] == message_id:
+            if frame["reactions"] == expected:
+                return frame
+
+
+def test_reactions_are_counted_and_fanned_out(client, seed, traces):
+    user_id, peer = seed.users[0], seed.users[1]
+    with client.websocket_connect(f"/ws/{seed.token(peer)}") as peer_websocket:
+        with client.websocket_connect(f"/ws/{seed.token(user_id)}") as websocket:
+            payload = {"chat_id": seed.dm_chat_id, "text": "React to me", "client_message_id": str(uuid.uuid4())}
+            websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+            message = websocket.receive_json()
+            assert message["reactions"] == {}
+            assert peer_websocket.receive_json()["id"] == message["id"]
+            etag = client.get(
+                f"/history/{seed.dm_chat_id}", headers=seed.headers(user_id)
+            ).headers["ETag"]
+            react(websocket, message, "👍")
+            sync(websocket)
+            # the chat of the message is cached, toggling stays in memory
+            react(peer_websocket, message, "👍")
+            react(websocket, message, "❤")
+            react(websocket, message, "❤", remove=True)
+            sync(peer_websocket)
+            sync(websocket)
+            assert_budget(last_trace("WS REACT"), max_queries=0)
+            client.portal.call(reaction_aggregator.flush)
+            for ws in (websocket, peer_websocket):
+                receive_reactions(ws, message["id"], {"👍": 2})
+    headers = seed.headers(user_id)
+    response = client.get(
+        f"/history/{seed.dm_chat_id}",
+        params={"limit": 1000},
+        headers={**headers, "If-None-Match": etag},
+    )
+    assert response.status_code == 200
+    stored = next(m for m in response.json() if m["id"] == message["id"])
+    assert stored["reactions"] == {"👍": 2}
+    pages = client.post(
+        "/history/batch", json={"chats": [{"chat_id": seed.dm_chat_id}], "limit": 100}, headers=headers
+    ).json()
+    stored = next(m for m in pages["messages"] if m["id"] == message["id"])
+    assert stored["reactions"] == {"👍": 2}
+
+
+def test_react_errors(client, seed):
+    history = client.get(
+        f"/history/{seed.history_chat_id}", params={"limit": 1}, headers=seed.headers(seed.users[0])
+    ).json()[0]
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        react(websocket, {"id": 10**9, "chat_id": seed.dm_chat_id}, "👍")
+        assert websocket.receive_json()["code"] == "not_found"
+        # a message of another chat of the user
+        react(websocket, {"id": history["id"], "chat_id": seed.dm_chat_id}, "👍")
+        assert websocket.receive_json()["code"] == "not_found"
+    with client.websocket_connect(f"/ws/{seed.token(seed.busy_user_id)}") as websocket:
+        react(websocket, history, "👍")
+        reply = websocket.receive_json()
+        assert reply["code"] == "forbidden" and reply["request"] == "REACT"
+
+
+def test_failed_flush_keeps_changes(monkeypatch):
+    async def run():
+        aggregator = ReactionAggregator()
+        aggregator.react(1, 10, 1, "👍", True)
+        aggregator.react(1, 10, 2, "👍", True)
+
+        async def unavailable(sessionmaker, batch):
+            # a newer change made while the flush waits on the database
+            aggregator.react(1, 10, 2, "👍", False)
+            raise OSError("connection refused")
+
+        monkeypatch.setattr(aggregator, "_write", unavailable)
+        with pytest.raises(OSError):
+            await aggregator.flush()
+        assert aggregator.pending == {(10, 1, "👍"): (1, True), (10, 2, "👍"): (1, False)}
+
+    asyncio.run(run())
+
+
+def test_reaction_to_a_deleted_message_is_dropped_alone(client, seed):
+    # foreign keys are enforced on this database only, the test database
+    # does not check them
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    event.listen(engine.sync_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    sessionmaker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    user_id, chat_id = seed.users[0], seed.dm_chat_id
+
+    async def run():
+        tables = [table for name, table in Base.metadata.tables.items() if name != "groups"]
+        async with engine.begin() as connection:
+            await connection.run_sync(lambda sync: Base.metadata.create_all(sync, tables=tables))
+            await connection.execute(insert(User), [{"id": user_id, "name": "u", "email": "u", "hashed_password": "x"}])
+            await connection.execute(insert(Chat), [{"id": chat_id, "name": "c", "is_group": False}])
+            await connection.execute(
+                insert(Message),
+                [{"id": 10, "chat_id": chat_id, "sender_id": user_id, "text": "t", "client_message_id": uuid.uuid4()}],
+            )
+        aggregator = ReactionAggregator()
+        batch = [((10, user_id, "👍"), chat_id, True), ((11, user_id, "👍"), chat_id, True)]
+        counts = await aggregator._write(sessionmaker, batch)
+        await engine.dispose()
+        return aggregator.stats, counts
+
+    stats, counts = client.portal.call(run)
+    assert (stats.written, stats.dropped) == (1, 1)
+    assert counts[10] == (chat_id, {"👍": 1})
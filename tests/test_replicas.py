@@ -0,0 +1,79 @@
+import shutil
+import sqlite3
+import time
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.core.config import settings
+from app.db.base import AsyncLocalSession, make_engine
+from app.db.routing import replica_router
+
+REPLICAS = 2
+
+
+@pytest.fixture
+def replicas(client, tmp_path, monkeypatch):
+    """
+    The app's replica router over REPLICAS copies of the database, for one
+    test. The DM is renamed on each copy to tell them apart, and writes to
+    the primary do not reach them.
+    """
+    primary_path = make_url(settings.DATABASE_URL).database
+    engines = []
+    for index in range(REPLICAS):
+        path = tmp_path / f"replica{index}.sqlite"
+        shutil.copy(primary_path, path)
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute("UPDATE chats SET name = ? WHERE id = 1", (f"DM on replica {index}",))
+        connection.close()
+        engines.append(make_engine(f"sqlite+aiosqlite:///{path}"))
+    sessionmakers = {id(replica_router.primary): AsyncLocalSession}
+    for engine in engines:
+        sessionmakers[id(engine)] = async_sessionmaker(bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(replica_router, "replicas", engines)
+    monkeypatch.setattr(replica_router, "healthy", [True] * REPLICAS)
+    monkeypatch.setattr(replica_router, "sessionmakers", sessionmakers)
+    monkeypatch.setattr(replica_router, "recent_writes", {})
+    yield replica_router
+    for engine in engines:
+        client.portal.call(engine.dispose)
+
+
+def dm_name(client, seed, user_id: int) -> str:
+    "Name of the DM in the chat list, telling which database served it"
+    response = client.get("/chats/", headers=seed.headers(user_id))
+    assert response.status_code == 200, response.text
+    return next(chat["name"] for chat in response.json() if chat["id"] == seed.dm_chat_id)
+
+
+def test_reads_go_round_robin_to_healthy_replicas(client, seed, replicas):
+    user_id = seed.users[1]
+    names = [dm_name(client, seed, user_id) for _ in range(4)]
+    assert set(names) == {"DM on replica 0", "DM on replica 1"}
+    assert names[0] != names[1] and names[:2] == names[2:]
+    replicas.mark_unhealthy(replicas.replicas[0])
+    assert {dm_name(client, seed, user_id) for _ in range(3)} == {"DM on replica 1"}
+    replicas.mark_unhealthy(replicas.replicas[1])
+    # no replica left, the primary serves reads
+    assert dm_name(client, seed, user_id) == "DM"
+    client.portal.call(replicas.check_health)
+    assert replicas.healthy == [True, True]
+    assert dm_name(client, seed, user_id) != "DM"
+
+
+def test_writer_reads_from_the_primary_for_a_while(client, seed, replicas, monkeypatch):
+    monkeypatch.setattr(settings, "READ_YOUR_WRITES_SECONDS", 0.5)
+    user_id = seed.users[4]
+    response = client.post(
+        "/chats/", json={"name": "Fresh group", "is_group": True}, headers=seed.headers(user_id)
+    )
+    assert response.status_code == 201, response.text
+    chat_id = response.json()["id"]
+    # the replicas do not have the chat, the primary does
+    chats = client.get("/chats/", headers=seed.headers(user_id)).json()
+    assert chat_id in {chat["id"] for chat in chats}
+    assert dm_name(client, seed, seed.users[1]) != "DM"
+    time.sleep(0.5)
+    chats = client.get("/chats/", headers=seed.headers(user_id)).json()
+    assert chat_id not in {chat["id"] for chat in chats}
@@ -0,0 +1,149 @@
+import time
+import uuid
+from sqlalchemy import select
+from app.core.config import settings
+from app.core.scheduler import MessageScheduler, message_scheduler
+from app.api.endpoints.messages import send_scheduled_message
+from app.db.base import AsyncLocalSession
+from app.db.models import ScheduledMessage
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def history_texts(client, seed) -> list[str]:
+    response = client.get(
+        f"/history/{seed.dm_chat_id}",
+        params={"limit": 1000},
+        headers=seed.headers(seed.users[0]),
+    )
+    return [message["text"] for message in response.json()]
+
+
+def schedule(client, seed, text: str, send_at: int, client_message_id: str | None = None):
+    body = {
+        "chat_id": seed.dm_chat_id,
+        "text": text,
+        "client_message_id": client_message_id or str(uuid.uuid4()),
+        "send_at": send_at,
+    }
+    return client.post("/scheduled", json=body, headers=seed.headers(seed.users[0]))
+
+
+def test_due_message_is_sent(client, seed):
+    response = schedule(client, seed, "Scheduled for now", int(time.time()))
+    assert response.status_code == 201, response.text
+    assert response.json()["sender_id"] == seed.users[0]
+    wait_until(lambda: "Scheduled for now" in history_texts(client, seed))
+    scheduled = client.get("/scheduled", headers=seed.headers(seed.users[0])).json()
+    assert response.json()["id"] not in {s["id"] for s in scheduled}
+
+
+def test_restart_does_not_send_twice(client, seed):
+    sent_id, pending_id = uuid.uuid4(), uuid.uuid4()
+
+    async def crash_after_send():
+        await message_scheduler.stop()
+        async with AsyncLocalSession() as session:
+            for client_message_id, text in ((sent_id, "Sent before the crash"), (pending_id, "Due during the restart")):
+                session.add(
+                    ScheduledMessage(
+                        chat_id=seed.dm_chat_id,
+                        sender_id=seed.users[0],
+                        text=text,
+                        client_message_id=client_message_id,
+                        send_at=int(time.time()) - 1,
+                    )
+                )
+            await session.commit()
+            # stored, but the process died before the row was deleted
+            scheduled = (
+                await session.execute(
+                    select(ScheduledMessage).where(ScheduledMessage.client_message_id == sent_id)
+                )
+            ).scalar_one()
+        await send_scheduled_message(scheduled)
+        message_scheduler.start(send_scheduled_message)
+
+    async def remaining() -> int:
+        async with AsyncLocalSession() as session:
+            stmt = select(ScheduledMessage.id).where(
+                ScheduledMessage.client_message_id.in_([sent_id, pending_id])
+            )
+            return len((await session.execute(stmt)).all())
+
+    client.portal.call(crash_after_send)
+    wait_until(lambda: client.portal.call(remaining) == 0)
+    texts = history_texts(client, seed)
+    assert texts.count("Sent before the crash") == 1
+    assert texts.count("Due during the restart") == 1
+
+
+def test_later_messages_stay_in_the_database(client, seed):
+    send_at = int(time.time() + 10 * settings.SCHEDULER_WINDOW_SECONDS)
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        payload = {
+            "chat_id": seed.dm_chat_id,
+            "text": "Much later",
+            "client_message_id": str(uuid.uuid4()),
+            "send_at": send_at,
+        }
+        websocket.send_json({"command": "SCHEDULE_MESSAGE", "payload": payload})
+        reply = websocket.receive_json()
+        assert reply["command"] == "SCHEDULE_MESSAGE" and reply["send_at"] == send_at
+        assert reply["id"] not in message_scheduler.loaded
+        websocket.send_json({"command": "SCHEDULE_MESSAGE", "payload": payload})
+        assert websocket.receive_json()["code"] == "duplicate"
+    assert schedule(client, seed, "Again", send_at, payload["client_message_id"]).status_code == 409
+    headers = seed.headers(seed.users[0])
+    assert client.delete(f"/scheduled/{reply['id']}", headers=headers).status_code == 204
+    assert client.delete(f"/scheduled/{reply['id']}", headers=headers).status_code == 404
+    body = {**payload, "client_message_id": str(uuid.uuid4())}
+    response = client.post("/scheduled", json=body, headers=seed.headers(seed.busy_user_id))
+    assert response.status_code == 403
+
+
+def test_failing_message_is_given_up(client, seed, monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_ATTEMPTS", 2)
+    # far ahead, so the scheduler running in the app leaves it alone
+    send_at = int(time.time() + 10 * settings.SCHEDULER_WINDOW_SECONDS)
+    scheduler = MessageScheduler()
+
+    async def failing_send(scheduled: ScheduledMessage):
+        raise ValueError("cannot be sent")
+
+    scheduler.send = failing_send
+
+    async def add() -> int:
+        async with AsyncLocalSession() as session:
+            scheduled = ScheduledMessage(
+                chat_id=seed.dm_chat_id,
+                sender_id=seed.users[0],
+                text="Never sent",
+                client_message_id=uuid.uuid4(),
+                send_at=send_at,
+            )
+            session.add(scheduled)
+            await session.commit()
+            return scheduled.id
+
+    async def attempt(scheduled_id: int) -> tuple:
+        await scheduler._send_due([scheduled_id])
+        # a window reaching the message
+        await scheduler._load(send_at)
+        async with AsyncLocalSession() as session:
+            scheduled = await session.get(ScheduledMessage, scheduled_id)
+            return scheduled.attempts, scheduled.failed_at, scheduled_id in scheduler.loaded
+
+    scheduled_id = client.portal.call(add)
+    assert client.portal.call(attempt, scheduled_id) == (1, None, True)
+    attempts, failed_at, loaded = client.portal.call(attempt, scheduled_id)
+    assert attempts == 2 and failed_at is not None and not loaded
+    assert scheduler.stats.failed == 1
+    listed = client.get("/scheduled", headers=seed.headers(seed.users[0])).json()
+    assert next(s for s in listed if s["id"] == scheduled_id)["failed_at"] == failed_at
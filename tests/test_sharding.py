@@ -0,0 +1,152 @@
+import time
+import uuid
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.core.config import settings
+from app.db import reshard
+from app.db.base import AsyncLocalSession, make_engine
+from app.db.models import ChatShard, Message
+from app.db.sharding import shard_router
+
+SHARDS = 3
+
+
+@pytest.fixture
+def shards(client, tmp_path, monkeypatch):
+    "The app's shard router over SHARDS SQLite files, for one test"
+    engines = [
+        make_engine(f"sqlite+aiosqlite:///{tmp_path / f'shard{shard}.sqlite'}")
+        for shard in range(SHARDS)
+    ]
+    sessionmakers = [
+        async_sessionmaker(bind=engine, expire_on_commit=False) for engine in engines
+    ]
+    monkeypatch.setattr(shard_router, "engines", engines)
+    monkeypatch.setattr(shard_router, "sessionmakers", sessionmakers)
+    monkeypatch.setattr(shard_router, "overrides", {})
+    monkeypatch.setattr(shard_router, "_next_id", 0)
+    monkeypatch.setattr(shard_router, "_id_limit", 0)
+    client.portal.call(reshard.init_shards)
+    yield shard_router
+    for engine in engines:
+        client.portal.call(engine.dispose)
+
+
+def chat_message_ids(client, chat_id: int) -> list[list[int]]:
+    "Ids of the messages of a chat on each shard"
+
+    async def read() -> list[list[int]]:
+        ids = []
+        for shard in range(SHARDS):
+            async with shard_router.shard_session(shard) as session:
+                stmt = select(Message.id).where(Message.chat_id == chat_id).order_by(Message.id)
+                ids.append(list((await session.execute(stmt)).scalars()))
+        return ids
+
+    return client.portal.call(read)
+
+
+def send_message(websocket, chat_id: int, text: str = "Hello") -> dict:
+    payload = {"chat_id": chat_id, "text": text, "client_message_id": str(uuid.uuid4())}
+    websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+    return websocket.receive_json()
+
+
+def test_messages_are_stored_on_the_shard_of_their_chat(client, seed, shards):
+    sender, reader = seed.users[0], seed.users[1]
+    shard = shards.hashed_shard(seed.dm_chat_id)
+    with client.websocket_connect(f"/ws/{seed.token(sender)}") as websocket:
+        first = send_message(websocket, seed.dm_chat_id, "First")
+        second = send_message(websocket, seed.dm_chat_id, "Second")
+    # one block of ids, after the ids already used by the metadata database
+    assert second["id"] == first["id"] + 1 and first["id"] > 20000
+    ids = chat_message_ids(client, seed.dm_chat_id)
+    assert ids[shard] == [first["id"], second["id"]]
+    assert sum(map(len, ids)) == 2
+    url = f"/history/{seed.dm_chat_id}"
+    history = client.get(url, headers=seed.headers(reader)).json()
+    assert [message["text"] for message in history] == ["First", "Second"]
+    with client.websocket_connect(f"/ws/{seed.token(reader)}") as websocket:
+        payload = {"id": first["id"], "chat_id": seed.dm_chat_id}
+        websocket.send_json({"command": "READ_MESSAGE", "payload": payload})
+        # without chat_id the message is found by probing the shards
+        websocket.send_json({"command": "READ_MESSAGE", "payload": {"id": second["id"]}})
+        websocket.send_text("{")
+        assert websocket.receive_json()["code"] == "invalid_json"
+    history = client.get(url, headers=seed.headers(reader)).json()
+    assert [message["is_read"] for message in history] == [True, True]
+
+
+def test_chat_shards_overrides_the_hash(client, seed, shards):
+    target = (shards.hashed_shard(seed.large_group_id) + 1) % SHARDS
+
+    async def pin():
+        async with AsyncLocalSession() as session:
+            session.add(ChatShard(chat_id=seed.large_group_id, shard=target))
+            await session.commit()
+
+    client.portal.call(pin)
+    # the write reads chat_shards itself, the cached map is not loaded yet
+    assert shards.shard_for(seed.large_group_id) != target
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        message = send_message(websocket, seed.large_group_id)
+    assert chat_message_ids(client, seed.large_group_id)[target] == [message["id"]]
+    assert shards.shard_for(seed.large_group_id) == target
+    history = client.get(f"/history/{seed.large_group_id}", headers=seed.headers(seed.users[1]))
+    assert [m["id"] for m in history.json()] == [message["id"]]
+
+
+def test_move_chat_keeps_concurrent_writes(client, seed, shards, monkeypatch):
+    chat_id = seed.dm_chat_id
+    source = shards.hashed_shard(chat_id)
+    target = (source + 1) % SHARDS
+    monkeypatch.setattr(reshard, "BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "SHARD_MAP_REFRESH_SECONDS", 0.5)
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        sent = [send_message(websocket, chat_id, f"Before {i}")["id"] for i in range(5)]
+    switch_chat = reshard.switch_chat
+
+    async def write_then_switch(chat_id: int, target: int):
+        # placed on the source while the messages are being copied
+        async with AsyncLocalSession() as fence:
+            async with shards.write_session_for(chat_id, fence) as session:
+                message = Message(
+                    id=await shards.allocate_message_id(),
+                    chat_id=chat_id,
+                    sender_id=seed.users[1],
+                    text="During the copy",
+                    client_message_id=uuid.uuid4(),
+                )
+                session.add(message)
+                await session.commit()
+        sent.append(message.id)
+        await switch_chat(chat_id, target)
+
+    monkeypatch.setattr(reshard, "switch_chat", write_then_switch)
+    move = client.portal.start_task_soon(reshard.move_chat, chat_id, target)
+
+    def switched() -> bool:
+        async def read() -> int | None:
+            async with AsyncLocalSession() as session:
+                return await session.scalar(
+                    select(ChatShard.shard).where(ChatShard.chat_id == chat_id)
+                )
+
+        return client.portal.call(read) == target
+
+    deadline = time.monotonic() + 5
+    while not switched():
+        assert time.monotonic() < deadline, "The chat was not switched"
+        time.sleep(0.01)
+    # the move is waiting for stale maps now, writes go to the target
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        sent.append(send_message(websocket, chat_id, "After the switch")["id"])
+    assert sent[-1] in chat_message_ids(client, chat_id)[target]
+    move.result(timeout=10)
+    ids = chat_message_ids(client, chat_id)
+    assert ids[source] == [] and ids[target] == sorted(sent)
+    # the five sent before, the one during the copy and the one after
+    assert len(set(sent)) == len(sent) == 7
+    history = client.get(f"/history/{chat_id}", headers=seed.headers(seed.users[1]))
+    assert [m["id"] for m in history.json()] == sorted(sent)
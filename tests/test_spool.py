@@ -0,0 +1,132 @@
+import asyncio
+import json
+import time
+import uuid
+import pytest
+from app.api.endpoints import messages
+from app.core.config import settings
+from app.core import spool as spool_module
+from app.core.spool import MessageSpool, message_spool
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def record(chat_id: int, sender_id: int, text: str, client_message_id: str | None = None) -> dict:
+    return {
+        "chat_id": chat_id,
+        "sender_id": sender_id,
+        "text": text,
+        "client_message_id": client_message_id or str(uuid.uuid4()),
+        "attachment_id": None,
+        "timestamp": int(time.time()),
+        "is_read": False,
+    }
+
+
+def history_texts(client, seed) -> list[str]:
+    response = client.get(
+        f"/history/{seed.dm_chat_id}",
+        params={"limit": 1000},
+        headers=seed.headers(seed.users[0]),
+    )
+    return [message["text"] for message in response.json()]
+
+
+def test_spool_is_recovered_and_drained_once(client, seed, tmp_path, monkeypatch):
+    stored = client.post(
+        "/history/batch",
+        json={"chats": [{"chat_id": seed.history_chat_id}], "limit": 1},
+        headers=seed.headers(seed.users[0]),
+    ).json()["messages"][0]
+    path = tmp_path / "spool.jsonl"
+    lines = [
+        # stored before the crash, only its line survived
+        record(seed.history_chat_id, stored["sender_id"], stored["text"], stored["client_message_id"]),
+        record(seed.dm_chat_id, seed.users[0], "Spooled before the crash"),
+    ]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines) + '{"chat_id": 1, "sen')
+    monkeypatch.setattr(settings, "MESSAGE_SPOOL_PATH", str(path))
+    spool = MessageSpool()
+
+    async def start():
+        spool.start()
+
+    client.portal.call(start)
+    try:
+        assert spool.stats.recovered == 2
+        wait_until(lambda: not spool.pending and spool.size == 0)
+        assert spool.stats.stored == 2
+        assert path.stat().st_size == 0
+    finally:
+        client.portal.call(spool.stop)
+    assert history_texts(client, seed).count("Spooled before the crash") == 1
+
+
+@pytest.fixture
+def stalled_database(client, tmp_path, monkeypatch):
+    "Start the spool and make every commit of SEND_MESSAGE hang"
+    monkeypatch.setattr(settings, "MESSAGE_SPOOL_PATH", str(tmp_path / "spool.jsonl"))
+    monkeypatch.setattr(settings, "MESSAGE_SPOOL_AFTER_SECONDS", 0.05)
+
+    async def stalled_store_message(user_id, payload):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(messages, "store_message", stalled_store_message)
+
+    async def start():
+        message_spool.start()
+
+    client.portal.call(start)
+    yield
+    client.portal.call(message_spool.stop)
+
+
+def test_message_is_spooled_during_a_stall(client, seed, stalled_database):
+    with client.websocket_connect(f"/ws/{seed.token(seed.users[0])}") as websocket:
+        client_message_id = str(uuid.uuid4())
+        payload = {"chat_id": seed.dm_chat_id, "text": "Sent during a stall", "client_message_id": client_message_id}
+        websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+        spooled = websocket.receive_json()
+        assert spooled["id"] is None and spooled["client_message_id"] == client_message_id
+        # the database answers reads, the flusher stores the message at once
+        stored = websocket.receive_json()
+        assert stored["command"] == "MESSAGE_STORED"
+        assert stored["client_message_id"] == client_message_id and stored["id"] > 0
+    assert history_texts(client, seed).count("Sent during a stall") == 1
+
+
+def test_failed_write_after_a_drain_leaves_no_gap(client, seed, tmp_path, monkeypatch):
+    path = tmp_path / "spool.jsonl"
+    monkeypatch.setattr(settings, "MESSAGE_SPOOL_PATH", str(path))
+    spool = MessageSpool()
+
+    async def start():
+        spool.start()
+
+    def fail(fd):
+        raise OSError("disk gone")
+
+    client.portal.call(start)
+    try:
+        client.portal.call(spool.append, record(seed.dm_chat_id, seed.users[0], "Drained"))
+        wait_until(lambda: not spool.pending and spool.size == 0)
+        assert path.stat().st_size == 0
+        with monkeypatch.context() as patch:
+            patch.setattr(spool_module.os, "fsync", fail)
+            with pytest.raises(OSError):
+                client.portal.call(spool.append, record(seed.dm_chat_id, seed.users[0], "Lost"))
+        # rolled back to the end of the truncated file, not the old offset
+        assert path.stat().st_size == 0 and spool.size == 0
+        client.portal.call(spool.append, record(seed.dm_chat_id, seed.users[0], "After the failure"))
+        wait_until(lambda: not spool.pending and spool.size == 0)
+    finally:
+        client.portal.call(spool.stop)
+    assert spool.stats.stored == 2
+    texts = history_texts(client, seed)
+    assert "Lost" not in texts and texts.count("After the failure") == 1
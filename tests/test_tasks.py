@@ -0,0 +1,78 @@
+import asyncio
+from app.core.config import settings
+from app.core.tasks import TaskQueue
+
+
+def test_tasks_of_a_key_run_in_order(monkeypatch):
+    monkeypatch.setattr(settings, "TASK_QUEUE_WORKERS", 4)
+
+    async def run():
+        queue = TaskQueue()
+        queue.start()
+        done: dict[int, list[int]] = {1: [], 2: []}
+
+        async def deliver(key: int, i: int):
+            # later tasks finish first if they are not serialized
+            await asyncio.sleep(0.001 * (10 - i))
+            done[key].append(i)
+
+        for i in range(10):
+            for key in done:
+                await queue.enqueue("deliver", deliver, key, i, key=key)
+        await queue.stop()
+        assert done == {1: list(range(10)), 2: list(range(10))}
+        stats = queue.stats["deliver"].to_dict()
+        assert stats["completed"] == 20 and stats["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_full_queue_blocks_the_producer(monkeypatch):
+    monkeypatch.setattr(settings, "TASK_QUEUE_WORKERS", 1)
+    monkeypatch.setattr(settings, "TASK_QUEUE_SIZE", 2)
+
+    async def run():
+        queue = TaskQueue()
+        queue.start()
+        release = asyncio.Event()
+
+        async def wait():
+            await release.wait()
+
+        await queue.enqueue("wait", wait)
+        await asyncio.sleep(0.01)
+        for _ in range(2):
+            await queue.enqueue("wait", wait)
+        # one task running, two waiting: the next enqueue has no room
+        blocked = asyncio.create_task(queue.enqueue("wait", wait))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        release.set()
+        await blocked
+        await queue.stop()
+        assert queue.stats["wait"].blocked == 1
+        assert queue.stats["wait"].completed == 4
+
+    asyncio.run(run())
+
+
+def test_failures_are_counted_and_stopped_queue_runs_inline():
+    async def run():
+        queue = TaskQueue()
+        queue.start()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        await queue.enqueue("fail", fail)
+        await queue.stop()
+        assert queue.stats["fail"].failed == 1
+        ran = []
+
+        async def record():
+            ran.append(True)
+
+        await queue.enqueue("record", record)
+        assert ran == [True]
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+import sys
+from budget import assert_budget, last_trace
+
+
+def search(client, seed, q: str):
+    return client.get("/users/search", params={"q": q}, headers=seed.headers(seed.users[0]))
+
+
+def test_search_non_ascii_name(client, seed, traces):
+    client.post(
+        "/register/",
+        json={"name": "Élodie Ünal", "email": "elodie@example.com", "password": "secret1"},
+    )
+    response = search(client, seed, "Élodie")
+    assert response.status_code == 200, response.text
+    assert [user["name"] for user in response.json()["items"]] == ["Élodie Ünal"]
+    assert_budget(last_trace("GET /users/search"), max_queries=2)
+
+
+def test_search_last_code_point(client, seed):
+    for q in (chr(sys.maxunicode), "a" + chr(sys.maxunicode), chr(0xD7FF)):
+        response = search(client, seed, q)
+        assert response.status_code == 200, response.text
+        assert response.json()["items"] == []
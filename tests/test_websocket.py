@@ -0,0 +1,138 @@
+import asyncio
+import gc
+import time
+import uuid
+import pytest
+from fastapi import status
+from starlette.websockets import WebSocketDisconnect
+from app.core.config import settings
+from app.core.revocation import revocation_list
+from app.core.security import create_access_token
+from app.core.typing_indicators import typing_tracker
+from app.core.websocket import Connection, WebSocketManager, ws_manager
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent: list[str] = []
+        self.closed_with: int | None = None
+        # a blocked socket never finishes a write, like a client that stopped reading
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await self.unblocked.wait()
+        self.sent.append(text)
+
+    async def close(self, code: int, reason: str | None = None):
+        self.closed_with = code
+
+
+def test_idle_connection_holds_no_sender():
+    async def run():
+        manager = WebSocketManager()
+        websocket = FakeWebSocket()
+        connection = await manager.connect(websocket, 1, [10])
+        for i in range(3):
+            await manager.send_to_chat(str(i), 10)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert websocket.sent == ["0", "1", "2"]
+        assert connection.outbox is None and connection.sender is None
+        manager.disconnect(connection)
+        assert not manager.rooms and not manager.active_connections
+
+    asyncio.run(run())
+
+
+def test_slow_client_is_closed_without_delaying_others():
+    async def run():
+        manager = WebSocketManager()
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        await manager.connect(slow, 1, [10])
+        await manager.connect(fast, 2, [10])
+        for i in range(settings.WS_OUTBOX_SIZE + 2):
+            await manager.send_to_chat(str(i), 10)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert len(fast.sent) == settings.WS_OUTBOX_SIZE + 2
+        assert slow.closed_with == status.WS_1013_TRY_AGAIN_LATER
+        assert not manager.closing
+        assert manager.online_count(10) == 1
+        assert 1 not in manager.active_connections
+
+    asyncio.run(run())
+
+
+def test_expired_or_revoked_connection_gets_no_messages():
+    async def run():
+        manager = WebSocketManager()
+        expired, revoked, valid = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(expired, 1, [10], expires_at=int(time.time()) - 1)
+        await manager.connect(revoked, 2, [10], family="revoked-family")
+        await manager.connect(valid, 3, [10], expires_at=int(time.time()) + 60, family="family")
+        revocation_list.revoked["revoked-family"] = int(time.time()) + 60
+        try:
+            await manager.send_to_chat("message", 10)
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        finally:
+            del revocation_list.revoked["revoked-family"]
+        assert expired.sent == revoked.sent == [] and valid.sent == ["message"]
+        assert expired.closed_with == revoked.closed_with == status.WS_1008_POLICY_VIOLATION
+        assert valid.closed_with is None and not manager.closing
+        assert manager.online_count(10) == 1
+
+    asyncio.run(run())
+
+
+def test_every_exit_path_removes_the_connection(client, seed, monkeypatch):
+    user_id, peer = seed.users[0], seed.users[1]
+    typing = typing_tracker.typing
+
+    async def failing_typing(user_id: int, chat_id: int):
+        if chat_id == seed.history_chat_id:
+            raise RuntimeError("injected fault")
+        await typing(user_id, chat_id)
+
+    monkeypatch.setattr(typing_tracker, "typing", failing_typing)
+    with client.websocket_connect(f"/ws/{seed.token(user_id)}") as websocket:
+        websocket.send_json({"command": "TYPING", "payload": {"chat_id": seed.dm_chat_id}})
+        websocket.send_text("{")
+        assert websocket.receive_json()["code"] == "invalid_json"
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws/not-a-token"):
+            pass
+    with client.websocket_connect(f"/ws/{seed.token(user_id)}") as websocket:
+        # a token of another user closes the connection
+        websocket.send_json({"command": "AUTH", "payload": {"token": seed.token(peer)}})
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == status.WS_1008_POLICY_VIOLATION
+    with pytest.raises(RuntimeError, match="injected fault"):
+        with client.websocket_connect(f"/ws/{seed.token(user_id)}") as websocket:
+            websocket.send_json({"command": "TYPING", "payload": {"chat_id": seed.history_chat_id}})
+            websocket.receive_json()
+    gc.collect()
+    assert not ws_manager.active_connections
+    assert not ws_manager.user_chats and not ws_manager.rooms
+    assert not any(isinstance(o, Connection) for o in gc.get_objects())
+
+
+def test_revoked_session_stops_receiving_the_chat(client, seed):
+    sender, peer = seed.users[0], seed.users[1]
+    family = uuid.uuid4().hex
+    token = create_access_token(data={"sub": seed.emails[peer], "uid": peer, "fam": family})
+    with client.websocket_connect(f"/ws/{token}") as revoked:
+        client.portal.call(revocation_list.revoke, family)
+        with client.websocket_connect(f"/ws/{seed.token(sender)}") as websocket:
+            payload = {"chat_id": seed.dm_chat_id, "text": "Not for you", "client_message_id": str(uuid.uuid4())}
+            websocket.send_json({"command": "SEND_MESSAGE", "payload": payload})
+            assert websocket.receive_json()["text"] == "Not for you"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            revoked.receive_json()
+        assert closed.value.code == status.WS_1008_POLICY_VIOLATION